@@ -1,22 +1,40 @@
 import telebot
 from telebot import types
-from telebot.types import ReplyKeyboardMarkup, KeyboardButton, ChatInviteLink, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
+from telebot.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
 from telebot.apihelper import ApiException
 import time
 import threading
+import itertools
 from datetime import datetime, timedelta
 import re
 import os
 from dotenv import load_dotenv
 import logging
+import logging.handlers
+import queue
+import copy
 import signal
 import sys
 import pytz
 import pymongo
-from pymongo import MongoClient
 import random
 import secrets
 from keep_alive import keep_alive
+import database
+import snapshot
+import metrics
+import instrumentation
+import heartbeat
+import callback_ack
+import lane_pool
+import flows
+import pricing
+import invite_pool
+import reconcile
+import exchange_rates
+import unreachable
+from member_store import MemberStore
+from conversation_state import ConversationStore, expiry_query
 import calendar
 from collections import Counter
 import requests
@@ -32,17 +50,17 @@ import gunicorn
 # Create Flask app
 server = Flask(__name__)
 
-DISCOUNTS = {
+DISCOUNTS = MemberStore({
     'regular': None,  # Discount for Regular membership
     'supreme': None   # Discount for Supreme membership
-}
+})
 
 BOT_VERSION = "v5.1.11b"  # v[Major].[Minor].[Build][Status]
 
 load_dotenv()
 
-MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
-DB_NAME = os.getenv('DB_NAME', 'PTABotDB')
+MONGO_URI = database.MONGO_URI
+DB_NAME = database.DB_NAME
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_IDS = list(map(int, os.getenv('ADMIN_IDS').split(',')))
 PAID_GROUP_ID = int(os.getenv('PAID_GROUP_ID'))
@@ -50,10 +68,20 @@ CREATOR_ID = int(os.getenv('CREATOR_ID', '0'))
 SUPREME_GROUP_ID = int(os.getenv('SUPREME_GROUP_ID'))
 QWEN_API_KEY = os.getenv('QWEN_API_KEY')
 QWEN_API_URL = os.getenv('QWEN_API_URL', 'https://dashscope-intl.aliyuncs.com/api/v1/services/aigc/text-generation/generation')
-
-# Initialize MongoDB connection
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'state_snapshot.bin')
+SNAPSHOT_INTERVAL = int(os.getenv('SNAPSHOT_INTERVAL', '300'))  # Seconds between snapshot writes
+SNAPSHOT_MAX_AGE = int(os.getenv('SNAPSHOT_MAX_AGE', str(7 * 24 * 3600)))  # Ignore snapshots older than a week
+BOOT_MONGO_TIMEOUT_MS = int(os.getenv('BOOT_MONGO_TIMEOUT_MS', '3000'))  # How long startup waits on MongoDB before using the snapshot
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))  # Rotate bot.log at 10 MB
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # 'text' or 'json'
+# Per-subsystem sampling of INFO/DEBUG records, e.g. "send_payment_reminder=0.1,delete_all_reminders=0.25"
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', '')
+
+# Initialize MongoDB connection (pooled client shared with the web dashboard)
+client = database.get_client()
+db = database.get_db()
 
 # Define collections
 payment_collection = db['payments']
@@ -69,8 +97,18 @@ jarvis_usage_collection = db['jarvis_usage']
 destinations_collection = db['announcement_destinations']
 mentors_collection = db['mentors']
 serial_numbers_collection = db["serial_numbers"]
+unreachable_users_collection = db['unreachable_users']  # Users who blocked the bot or were deactivated
+invite_links_collection = db['invite_links']  # Pooled and issued invite links not revoked yet
+
+# Idle conversation state expires per document through a TTL index
+try:
+    database.ensure_pending_indexes()
+except Exception as e:
+    logging.error(f"Error creating conversation expiry index: {e}")
 
 bot = telebot.TeleBot(BOT_TOKEN)
+# Run each user's updates in order, different users in parallel
+lane_pool.install(bot)
 
 QWEN_PROMPT_TEMPLATE = """You are the AI assistant for Prodigy Trading Academy (PTA), a top-tier trading education platform.
 
@@ -137,34 +175,12 @@ Always provide exact dates and numbers from user data — never say "check your
 
 You exist to help people become better traders — always stay focused on that goal."""
 
-def get_exchange_rates():
-    """Fetch real-time exchange rates for multiple currencies against USD"""
-    try:
-        # Use a free exchange rate API
-        response = requests.get('https://open.er-api.com/v6/latest/USD', timeout=10)
-        data = response.json()
-        
-        if data.get('result') == 'success':
-            # Extract the rates we're interested in
-            rates = {
-                'USD': 1.0,  # Base currency is always 1.0
-                'GBP': data['rates'].get('GBP', 0),
-                'EUR': data['rates'].get('EUR', 0),
-                'IDR': data['rates'].get('IDR', 0),
-                'PHP': data['rates'].get('PHP', 0)
-            }
-            return rates
-        else:
-            logging.error(f"Exchange rate API error: {data}")
-            return None
-    except Exception as e:
-        logging.error(f"Error fetching exchange rates: {e}")
-        return None
-
 # Function to handle termination signals (Ctrl+C, kill command)
 def signal_handler(sig, frame):
     logging.info("Stopping bot...")
     bot.stop_polling()  # Stop bot polling first
+    save_state_snapshot()  # Persist the latest state for a warm restart
+    log_listener.stop()  # Flush queued log records
     os._exit(0)  # Use os._exit instead of sys.exit to force immediate termination
 
 # Attach signal handler for Ctrl+C
@@ -173,18 +189,102 @@ signal.signal(signal.SIGTERM, signal_handler)
 
 # Keep your PhilippineTimeFormatter class
 class PhilippineTimeFormatter(logging.Formatter):
+    MANILA_TZ = pytz.timezone('Asia/Manila')
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Records arrive in bursts within the same second, so remember the last one
+        self._cached_time = (None, None)
+    
     def formatTime(self, record, datefmt=None):
-        # Convert the time to Philippine time (UTC+8)
-        philippine_time = datetime.fromtimestamp(record.created, pytz.timezone('Asia/Manila'))
-        # Format the time in 12-hour format
-        return philippine_time.strftime('%Y-%m-%d %I:%M:%S %p')
+        second = int(record.created)
+        cached_second, cached_text = self._cached_time
+        if second == cached_second:
+            return cached_text
+        
+        # Convert the time to Philippine time (UTC+8) in 12-hour format
+        text = datetime.fromtimestamp(second, self.MANILA_TZ).strftime('%Y-%m-%d %I:%M:%S %p')
+        self._cached_time = (second, text)
+        return text
+
+class JsonLogFormatter(PhilippineTimeFormatter):
+    """Format records as one JSON object per line for log shippers"""
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'subsystem': getattr(record, 'subsystem', None) or record.funcName,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
 
-# Fix for duplicate logging - clear existing handlers first
+class SubsystemSamplingFilter(logging.Filter):
+    """Keep only a fraction of INFO/DEBUG records from noisy subsystems
+    
+    The subsystem is the record's 'subsystem' extra, or else the name of the
+    function that logged it. Warnings and errors are never sampled out.
+    """
+    def __init__(self, rates):
+        super().__init__()
+        # Keep every Nth record instead of rolling dice, so output stays even
+        self.keep_every = {name: max(1, round(1 / rate)) for name, rate in rates.items() if rate > 0}
+        self.drop_all = {name for name, rate in rates.items() if rate <= 0}
+        # Logging threads share these; next() on a count is atomic, a dict read-modify-write isn't
+        self.counters = {name: itertools.count() for name in self.keep_every}
+    
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        subsystem = getattr(record, 'subsystem', None) or record.funcName
+        if subsystem in self.drop_all:
+            return False
+        keep_every = self.keep_every.get(subsystem)
+        if not keep_every:
+            return True
+        return next(self.counters[subsystem]) % keep_every == 0
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves exception formatting to the listener's handlers
+    
+    The stock prepare() folds the traceback into the message and drops
+    exc_info, so the JSON formatter could never fill in its 'exception'
+    field. Records stay in this process, so exc_info can travel as is.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def parse_sample_rates(spec):
+    """Parse "name=rate,name=rate" into a dict of sampling rates"""
+    rates = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        name, rate = item.split('=', 1)
+        try:
+            rates[name.strip()] = float(rate)
+        except ValueError:
+            logging.warning(f"Ignoring invalid log sample rate: {item}")
+    return rates
+
+# Logging pipeline: callers only enqueue records; a listener thread does the
+# formatting and I/O for every handler
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Create and configure file handler
-file_handler = logging.FileHandler('bot.log')
+# Handlers already attached (the web dashboard's) move behind the queue too
+existing_handlers = list(logger.handlers)
+for handler in existing_handlers:
+    logger.removeHandler(handler)
+
+# Create and configure size-rotated file handler
+file_handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
 file_handler.setLevel(logging.INFO)
 
 # Create and configure console handler (this sends to terminal)
@@ -192,15 +292,28 @@ console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setLevel(logging.INFO)
 
 # Create formatter
-formatter = PhilippineTimeFormatter('%(asctime)s - %(levelname)s - %(message)s')
+if LOG_FORMAT == 'json':
+    formatter = JsonLogFormatter()
+else:
+    formatter = PhilippineTimeFormatter('%(asctime)s - %(levelname)s - %(message)s')
 
 # Add formatter to handlers
 file_handler.setFormatter(formatter)
 console_handler.setFormatter(formatter)
 
-# Add handlers to logger
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+# Route all records through an unbounded queue drained by one listener thread
+log_queue = queue.Queue(-1)
+queue_handler = LogQueueHandler(log_queue)
+logger.addHandler(queue_handler)
+# Parsed once the queue is attached, so a bad rate is logged like anything else
+queue_handler.addFilter(SubsystemSamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+
+log_listener = logging.handlers.QueueListener(
+    log_queue, file_handler, console_handler, *existing_handlers,
+    respect_handler_level=True
+)
+log_listener.start()
+metrics.QUEUE_DEPTH.set_function(log_queue.qsize, queue='log')
 
 def load_update_subscribers():
     """Load the list of users who want updates from MongoDB"""
@@ -436,6 +549,13 @@ def load_discounts():
     try:
         discounts = {}
         
+        # Discounts created before redemptions were counted start from their users_used list
+        for doc in settings_collection.find({"_id": {"$in": ["regular_discount_settings", "supreme_discount_settings"]}, "redemptions": {"$exists": False}}):
+            settings_collection.update_one(
+                {"_id": doc["_id"], "redemptions": {"$exists": False}},
+                {"$set": {"redemptions": len(doc.get('users_used', []))}}
+            )
+        
         # Load regular discount
         regular_discount = settings_collection.find_one({"_id": "regular_discount_settings"})
         if regular_discount and regular_discount.get('active', False):
@@ -473,6 +593,44 @@ def save_discount(discount_data, membership_type):
             logging.info(f"{membership_type.capitalize()} discount settings removed from MongoDB")
     except Exception as e:
         logging.error(f"Error saving {membership_type} discount: {e}")
+    schedule_discount_expiry(membership_type, discount_data)
+
+def redeem_discount(membership_type, discount, user_id):
+    """Claim one use of a discount for a user in a single atomic update
+
+    Returns 'redeemed', 'already_used', 'limit_reached' or 'unavailable'.
+    The redemption counter is only incremented while it is below the user
+    limit, so concurrent purchases can't overshoot it.
+    """
+    doc_id = f"{membership_type.lower()}_discount_settings"
+    query = {
+        "_id": doc_id,
+        "active": True,
+        "created_at": discount.get('created_at'),
+        "users_used": {"$ne": str(user_id)}
+    }
+    if discount.get('user_limit') is not None:
+        query["redemptions"] = {"$lt": discount['user_limit']}
+    try:
+        updated = settings_collection.find_one_and_update(
+            query,
+            {"$inc": {"redemptions": 1}, "$push": {"users_used": str(user_id)}},
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        if updated:
+            DISCOUNTS[membership_type] = updated
+            return 'redeemed'
+        current = settings_collection.find_one({"_id": doc_id})
+    except Exception as e:
+        logging.error(f"Error redeeming {membership_type} discount for user {user_id}: {e}")
+        return 'unavailable'
+
+    if not current or not current.get('active') or current.get('created_at') != discount.get('created_at'):
+        return 'unavailable'
+    DISCOUNTS[membership_type] = current
+    if str(user_id) in current.get('users_used', []):
+        return 'already_used'
+    return 'limit_reached'
 
 def get_last_gif_message():
     """Get the ID of the last sent GIF message"""
@@ -603,6 +761,7 @@ def save_confirmed_old_members():
         logging.error(f"MongoDB save error: {e}")
 
 # Similarly implement load_payment_data() and save_payment_data()
+@metrics.timed_job('load_payment_data')
 def load_payment_data():
     """Load payment data from MongoDB with enhanced error handling and logging"""
     global payment_collection  # Add this line to access the global variable
@@ -612,7 +771,7 @@ def load_payment_data():
         start_time = time.time()
         docs_count = 0
         
-        for doc in payment_collection.find():
+        for doc in payment_collection.find({}, {'username_lower': 0}):
             user_id = doc['_id']
             payments[user_id] = {k: v for k, v in doc.items() if k != '_id'}
             docs_count += 1
@@ -627,12 +786,13 @@ def load_payment_data():
         try:
             logging.info("Attempting to reconnect to MongoDB...")
             global client, db  # Also need these globals if we're redefining them
-            client = MongoClient(MONGO_URI)
-            db = client[DB_NAME]
+            # The shared client re-establishes pooled connections on its own
+            client = database.get_client()
+            db = database.get_db()
             payment_collection = db['payments']
             
             payments = {}
-            for doc in payment_collection.find():
+            for doc in payment_collection.find({}, {'username_lower': 0}):
                 user_id = doc['_id']
                 payments[user_id] = {k: v for k, v in doc.items() if k != '_id'}
             
@@ -645,8 +805,14 @@ def load_payment_data():
         logging.error(f"MongoDB error loading payments: {e}")
         return {}
 
+@metrics.timed_job('save_payment_data')
 def save_payment_data():
     """Save payment data to MongoDB with enhanced error handling and validation"""
+    if not SNAPSHOT_RECONCILED.is_set():
+        # Every record is written in full, which would put the snapshot's copy over newer
+        # MongoDB documents; changes are kept in memory and merged in by the reconcile
+        logging.warning("Deferring payment data save until the boot snapshot is reconciled with MongoDB")
+        return
     try:
         start_time = time.time()
         
@@ -680,6 +846,7 @@ def save_payment_data():
                 
             doc = {'_id': user_id}
             doc.update(data)
+            database.add_username_key(doc)
             # Add a "last_updated" timestamp for tracking
             doc['last_updated'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             
@@ -689,6 +856,7 @@ def save_payment_data():
         
         if operations:
             result = payment_collection.bulk_write(operations)
+            database.invalidate_member_stats()
             elapsed = time.time() - start_time
             
             logging.info(f"Successfully saved {len(operations)} payment records to MongoDB "
@@ -708,12 +876,14 @@ def save_payment_data():
                     
                 doc = {'_id': user_id}
                 doc.update(data)
+                database.add_username_key(doc)
                 doc['last_updated'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 payment_collection.replace_one({'_id': user_id}, doc, upsert=True)
                 success_count += 1
             except Exception as e:
                 logging.error(f"Failed to save payment for user {user_id}: {e}")
                 
+        database.invalidate_member_stats()
         logging.info(f"Fallback save completed: saved {success_count} of {len(PAYMENT_DATA)} records")
     except Exception as e:
         logging.error(f"MongoDB save error: {e}")
@@ -739,24 +909,50 @@ def save_changelogs(changelogs):
         logging.error(f"MongoDB save error: {e}")
 
 def save_pending_users():
+    """Write the pending users whose conversation changed since they were last saved"""
     try:
         operations = []
-        for user_id, data in PENDING_USERS.items():
+        saved = []
+        for user_id, data, fingerprint in PENDING_USERS.pending_writes():
             doc = {'_id': str(user_id)}  # Convert to string for MongoDB _id
             doc.update(data)
             operations.append(
                 pymongo.ReplaceOne({'_id': str(user_id)}, doc, upsert=True)
             )
+            saved.append((user_id, fingerprint))
         if operations:
             pending_collection.bulk_write(operations)
+            for user_id, fingerprint in saved:
+                PENDING_USERS.mark_saved(user_id, fingerprint)
         logging.info(f"Saved {len(operations)} pending users to MongoDB")
     except Exception as e:
         logging.error(f"MongoDB save error for pending users: {e}")
 
+def update_pending_user(user_id, fields, unset=()):
+    """Apply a change to one pending user and write only the changed fields"""
+    update = PENDING_USERS.set_fields(user_id, fields, unset)
+    if update is None:
+        # The record has other unsaved changes, so write it in full
+        save_pending_users()
+        return
+    try:
+        result = pending_collection.update_one({'_id': str(user_id)}, update)
+        if result.matched_count == 0:
+            PENDING_USERS.mark_dirty(user_id)
+            save_pending_users()
+    except Exception as e:
+        PENDING_USERS.mark_dirty(user_id)
+        logging.error(f"MongoDB update error for pending user {user_id}: {e}")
+
+def pending_status(user_id):
+    """Return the user's conversation state, or None"""
+    return PENDING_USERS.get(user_id, {}).get('status')
+
 def load_pending_users():
     try:
         pending = {}
-        for doc in pending_collection.find():
+        # Skip documents past expiry that the TTL monitor hasn't removed yet
+        for doc in pending_collection.find(expiry_query()):
             # Convert string _id back to int for PENDING_USERS dictionary
             user_id = int(doc['_id'])
             pending[user_id] = {k: v for k, v in doc.items() if k != '_id'}
@@ -813,25 +1009,43 @@ USER_PAYMENT_DUE = {}
 CONFESSION_COUNTER = 0
 USERS_CONFESSING = {}
 PDF_MESSAGE_IDS = {}
-QWEN_USAGE = load_qwen_usage()
-PAYMENT_DATA = load_payment_data()
-PENDING_USERS = load_pending_users() 
+QWEN_USAGE = MemberStore(load_qwen_usage())
+# Load the hot state from MongoDB when it answers quickly; otherwise serve it
+# from the local snapshot so an unreachable MongoDB doesn't block startup, and
+# reconcile in the background. Full saves wait until that has happened.
+SNAPSHOT_RECONCILED = threading.Event()
+BOOT_SNAPSHOT = None
+if not database.ping(BOOT_MONGO_TIMEOUT_MS):
+    BOOT_SNAPSHOT = snapshot.load_snapshot(SNAPSHOT_PATH, max_age=SNAPSHOT_MAX_AGE)
+if BOOT_SNAPSHOT:
+    PAYMENT_DATA = MemberStore(BOOT_SNAPSHOT['payment_data'])
+    # What the snapshot held, to tell edits made since boot from MongoDB's newer data
+    BOOT_PAYMENT_DATA = copy.deepcopy(BOOT_SNAPSHOT['payment_data'])
+    PENDING_USERS = ConversationStore(BOOT_SNAPSHOT['pending_users'])
+    BOT_SETTINGS = BOOT_SNAPSHOT['settings']
+    DISCOUNTS = MemberStore(BOOT_SNAPSHOT['discounts'])
+    logging.info(f"Warm start from snapshot: {len(PAYMENT_DATA)} members, {len(PENDING_USERS)} pending users")
+else:
+    SNAPSHOT_RECONCILED.set()
+    PAYMENT_DATA = MemberStore(load_payment_data())
+    PENDING_USERS = ConversationStore(load_pending_users())
+    BOT_SETTINGS = load_settings()
+    DISCOUNTS = MemberStore(load_discounts())
 CHANGELOGS = load_changelogs()
-BOT_SETTINGS = load_settings()
 CONFESSION_COUNTER = load_confession_counter()
 CONFESSION_TOPIC_ID = BOT_SETTINGS.get('confession_topic_id', None)
 DAILY_CHALLENGE_TOPIC_ID = BOT_SETTINGS.get('daily_challenge_topic_id', None)
 ANNOUNCEMENT_TOPIC_ID = BOT_SETTINGS.get('announcement_topic_id', None)
 ACCOUNTABILITY_TOPIC_ID = BOT_SETTINGS.get('accountability_topic_id', None)
 LEADERBOARD_TOPIC_ID = BOT_SETTINGS.get('leaderboard_topic_id', None)
-DISCOUNTS = load_discounts()
 UPDATE_SUBSCRIBERS = load_update_subscribers()
 ANNOUNCEMENT_DESTINATIONS = load_announcement_destinations()
 # Define fee percentages for different payment methods
+DISCOUNT_EXPIRY_TIMERS = {}  # Discount type -> timer firing at its end date
 PAYMENT_FEES = {
     "💳 Paypal": 10.0,  # 10% fee
 }
-SERIAL_NUMBERS = load_serial_numbers()
+SERIAL_NUMBERS = MemberStore(load_serial_numbers())
 
 
 ### Different types of messages for the bot ###
@@ -1071,8 +1285,7 @@ def call_qwen_api(prompt, user_id=None, chat_id=None):
     
     try:
         # Initialize conversation history for this user if it doesn't exist
-        if user_id not in QWEN_USAGE:
-            QWEN_USAGE[user_id] = {'last_used': time.time(), 'count': 0, 'messages': []}
+        QWEN_USAGE.setdefault(user_id, {'last_used': time.time(), 'count': 0, 'messages': []})
         
         # Check if user has hit rate limit (assuming max of 5 queries per hour)
         if QWEN_USAGE[user_id]['count'] >= 5:
@@ -1159,10 +1372,23 @@ Please use this information to provide a personalized response, but don't explic
             }
         }
 
-        response = requests.post(QWEN_API_URL, headers=headers, data=json.dumps(payload), timeout=30)
-        response.raise_for_status()
+        qwen_start = time.perf_counter()
+        qwen_status = 'error'
+        try:
+            response = requests.post(QWEN_API_URL, headers=headers, data=json.dumps(payload), timeout=30)
+            qwen_status = 'ok' if response.ok else str(response.status_code)
+            response.raise_for_status()
+        except requests.exceptions.Timeout:
+            qwen_status = 'timeout'
+            raise
+        finally:
+            metrics.QWEN_REQUEST_DURATION.observe(time.perf_counter() - qwen_start, status=qwen_status)
         
         response_json = response.json()
+        usage = response_json.get('usage') or {}
+        for kind in ('input', 'output'):
+            if usage.get(f'{kind}_tokens'):
+                metrics.QWEN_TOKENS.inc(usage[f'{kind}_tokens'], kind=kind)
         # Fix: Using the correct path to get the response content
         ai_response = response_json['output']['choices'][0]['message']['content']
         
@@ -1398,8 +1624,7 @@ def send_welcome(message):
     user_id = message.from_user.id
 
     # Reload pending users from MongoDB to ensure we have latest data
-    global PENDING_USERS
-    PENDING_USERS = load_pending_users()
+    PENDING_USERS.replace(load_pending_users())
 
     # Check for pending admin actions
     pending_verification = False
@@ -1782,87 +2007,18 @@ def handle_upgrade_membership(call):
         )
         return
     
-    # Get supreme discount if applicable
-    applicable_discount = DISCOUNTS.get('supreme')
-    discount_active = applicable_discount and applicable_discount.get('active', False)
-    
-    # Check if discount applies to upgrades
-    if discount_active:
-        discount_transaction_type = applicable_discount.get('transaction_type', 'both')
-        
-        # For upgrades, we'll consider them as "new" transactions for the supreme tier
-        applies_to_transaction = (
-            discount_transaction_type == 'both' or 
-            discount_transaction_type == 'new'
-        )
-        
-        # Only consider discount active if it applies to upgrades
-        if not applies_to_transaction:
-            discount_active = False
-            
-    discount_percentage = applicable_discount.get('percentage', 0) if discount_active else 0
-    discount_name = applicable_discount.get('name', '') if discount_active else ''
-    
-    # Original prices
-    apprentice_price = 309.99
-    disciple_price = 524.99
-    legacy_price = 899.99
+    # Upgrades count as new purchases of the supreme tier
+    menu = pricing.plan_menu('supreme', pricing.applicable_discount(DISCOUNTS.get('supreme'), is_renewal=False))
     
-    # Create markup for plan selection
-    markup = InlineKeyboardMarkup(row_width=1)
-    
-    if discount_active:
-        # Calculate discounted prices
-        apprentice_discounted = round(apprentice_price * (1 - discount_percentage / 100), 2)
-        disciple_discounted = round(disciple_price * (1 - discount_percentage / 100), 2)
-        legacy_discounted = round(legacy_price * (1 - discount_percentage / 100), 2)
-        
-        # Add buttons with discounted prices
-        markup.add(
-            InlineKeyboardButton(f"Apprentice (${apprentice_discounted:.2f}) / 3 Months", callback_data="plan_apprentice"),
-            InlineKeyboardButton(f"Disciple (${disciple_discounted:.2f}) / 6 Months", callback_data="plan_disciple"),
-            InlineKeyboardButton(f"Legacy (${legacy_discounted:.2f}) / Lifetime", callback_data="plan_supreme_legacy")
-        )
-        
-        # Add back button
-        markup.add(InlineKeyboardButton("⬅️ Go Back", callback_data="menu_manage"))
-        
-        # FIXED: Use edit_message_text instead of send_message
-        bot.edit_message_text(
-            f"⬆️ *Upgrade to Supreme Membership*\n\n"
-            f"Choose your Supreme plan:\n\n"
-            f"🎉 <b>{discount_name}: {discount_percentage}% OFF!</b>\n\n"
-            f"💰 <b>Apprentice</b> - <s>${apprentice_price:.2f}</s> ${apprentice_discounted:.2f} / 3 Months\n"
-            f"💰 <b>Disciple</b> - <s>${disciple_price:.2f}</s> ${disciple_discounted:.2f} / 6 Months\n"
-            f"💰 <b>Legacy</b> - <s>${legacy_price:.2f}</s> ${legacy_discounted:.2f} / Lifetime", 
-            chat_id,
-            message_id,
-            reply_markup=markup, 
-            parse_mode="HTML"
-        )
-    else:
-        # No discount - show regular prices without strikethrough
-        markup.add(
-            InlineKeyboardButton(f"Apprentice (${apprentice_price:.2f}) / 3 Months", callback_data="plan_apprentice"),
-            InlineKeyboardButton(f"Disciple (${disciple_price:.2f}) / 6 Months", callback_data="plan_disciple"),
-            InlineKeyboardButton(f"Legacy (${legacy_price:.2f}) / Lifetime", callback_data="plan_supreme_legacy")
-        )
-        
-        # Add back button
-        markup.add(InlineKeyboardButton("⬅️ Go Back", callback_data="menu_manage"))
-        
-        # FIXED: Use edit_message_text instead of send_message
-        bot.edit_message_text(
-            f"⬆️ *Upgrade to Supreme Membership*\n\n"
-            f"Choose your Supreme plan:\n\n"
-            f"💰 <b>Apprentice</b> - ${apprentice_price:.2f} / 3 Months\n"
-            f"💰 <b>Disciple</b> - ${disciple_price:.2f} / 6 Months\n"
-            f"💰 <b>Legacy</b> - ${legacy_price:.2f} / Lifetime", 
-            chat_id,
-            message_id,
-            reply_markup=markup, 
-            parse_mode="HTML"
-        )
+    bot.edit_message_text(
+        f"⬆️ *Upgrade to Supreme Membership*\n\n"
+        f"Choose your Supreme plan:\n\n"
+        f"{menu.text}",
+        chat_id,
+        message_id,
+        reply_markup=plan_menu_markup(menu, "menu_manage"),
+        parse_mode="HTML"
+    )
 
 @bot.callback_query_handler(func=lambda call: call.data == "menu_finish_forms")
 def handle_menu_finish_forms(call):
@@ -1907,8 +2063,10 @@ def handle_menu_finish_forms(call):
     # Start onboarding form process
     send_onboarding_form(user_id)
 
+@metrics.timed_job('check_form_completion_reminders')
 def check_form_completion_reminders():
     """Check for users who need form completion reminders"""
+    heartbeat.beat('form_completion_reminders')
     logging.info("Checking for pending form completions")
     
     now = datetime.now()
@@ -1924,7 +2082,9 @@ def check_form_completion_reminders():
                 if days_remaining <= 2 and not data.get('form_reminder_sent', False):
                     # Time to send reminder
                     user_id = int(user_id_str)
-                    
+                    if unreachable.should_skip(user_id, 'form_reminders'):
+                        continue
+
                     # Send reminder message
                     try:
                         bot.send_message(
@@ -1978,9 +2138,12 @@ def check_form_completion_reminders():
                 logging.error(f"Error checking form completion for user {user_id_str}: {e}")
     
     # Schedule next check in 12 hours
+    heartbeat.success('form_completion_reminders')
+    heartbeat.expect('form_completion_reminders', 43200)
     threading.Timer(43200, check_form_completion_reminders).start()
 
 # Start the form completion checker
+heartbeat.expect('form_completion_reminders', 5)
 threading.Timer(5, check_form_completion_reminders).start()
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("kick_form_"))
@@ -2270,17 +2433,59 @@ def handle_xm_deposit_not_yet(call):
     
     bot.answer_callback_query(call.id)
 
+def is_composing_post(user_id):
+    """Whether the user is writing a confession or an announcement"""
+    return (
+        USERS_CONFESSING.get(user_id, {}).get('status') == 'awaiting_confession'
+        or ADMIN_ANNOUNCING.get(user_id, {}).get('status') == 'waiting_for_announcement'
+    )
+
+BOT_COMMANDS = None  # Commands with a registered handler, collected on first use
+
+def is_bot_command(message):
+    """Whether a message is one of the bot's registered /commands"""
+    global BOT_COMMANDS
+    if message.content_type != 'text' or not (message.text or '').startswith('/'):
+        return False
+    if BOT_COMMANDS is None:
+        BOT_COMMANDS = {
+            command
+            for handler in bot.message_handlers
+            for command in (handler['filters'].get('commands') or ())
+        }
+    return telebot.util.extract_command(message.text) in BOT_COMMANDS
+
+def routes_to_flow(message):
+    """Whether a private message is the input for the sender's current flow step"""
+    if message.chat.type != 'private':
+        return False
+    # Photos from users writing a confession or announcement go to those modes first
+    if message.content_type == 'photo' and is_composing_post(message.from_user.id):
+        return False
+    # Commands like /verify reach their own handlers instead of being saved as an answer
+    if is_bot_command(message):
+        return False
+    return flows.accepts(message)
+
+# Conversation steps register with @flows.step and are all routed from this one
+# handler by (state, content type), instead of a filter per step
+@bot.message_handler(func=routes_to_flow, content_types=flows.CONTENT_TYPES)
+def handle_flow_step(message):
+    try:
+        flows.dispatch(message)
+    except ValueError as e:
+        logging.error(f"Error in conversation step for user {message.from_user.id}: {e}")
+        bot.reply_to(message, "❌ An error occurred while processing your request.")
+
+
 # Handle screenshot submission for deposit verification
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'xm_awaiting_deposit_screenshot', content_types=['photo'])
+@flows.step('xm', 'xm_awaiting_deposit_screenshot', content_types=['photo'], transitions=['xm_awaiting_deposit_verification'])
 def handle_deposit_screenshot(message):
     """Handle the deposit screenshot submission"""
     user_id = message.from_user.id
     chat_id = message.chat.id
     user_id_str = str(user_id)
     
-    # Store the screenshot message ID for reference
-    PENDING_USERS[user_id]['screenshot_message_id'] = message.message_id
-    
     # Get account ID 
     xm_account_id = PENDING_USERS[user_id].get('xm_account_id', 'Unknown')
     
@@ -2312,9 +2517,8 @@ def handle_deposit_screenshot(message):
             reply_markup=markup
         )
     
-    # Update user status
-    PENDING_USERS[user_id]['status'] = 'xm_awaiting_deposit_verification'
-    save_pending_users()
+    # Update user status, keeping the screenshot message ID for reference
+    flows.advance(user_id, 'xm_awaiting_deposit_verification', {'screenshot_message_id': message.message_id})
     
     # Inform user that verification is in progress
     bot.send_message(
@@ -2475,8 +2679,10 @@ def handle_reject_deposit(call):
         bot.answer_callback_query(call.id, f"❌ Error: {str(e)}")
         logging.error(f"Error rejecting deposit: {e}")
 
+@metrics.timed_job('check_grace_periods')
 def check_grace_periods():
     """Check for users with expired grace periods and notify admins"""
+    heartbeat.beat('grace_periods')
     logging.info("Checking for expired grace periods")
     
     now = datetime.now()
@@ -2522,9 +2728,12 @@ def check_grace_periods():
                 logging.error(f"Error checking grace period for user {user_id_str}: {e}")
     
     # Schedule next check in 12 hours
+    heartbeat.success('grace_periods')
+    heartbeat.expect('grace_periods', 43200)
     threading.Timer(43200, check_grace_periods).start()
 
 # Start the grace period checker
+heartbeat.expect('grace_periods', 5)
 threading.Timer(5, check_grace_periods).start()
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("kick_grace_"))
@@ -2885,17 +3094,17 @@ def handle_xm_verify_proceed(call):
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'xm_awaiting_account_screenshot', content_types=['photo'])
+@flows.step('xm', 'xm_awaiting_account_screenshot', content_types=['photo'], transitions=['xm_awaiting_dashboard_screenshot'])
 def handle_xm_registration_screenshot(message):
     """Handle the first screenshot (registration screenshot)"""
     user_id = message.from_user.id
     chat_id = message.chat.id
     
     # Store screenshot details
-    PENDING_USERS[user_id]['screenshot_message_id'] = message.message_id
-    PENDING_USERS[user_id]['registration_screenshot'] = message.photo[-1].file_id
-    PENDING_USERS[user_id]['status'] = 'xm_awaiting_dashboard_screenshot'
-    save_pending_users()
+    flows.advance(user_id, 'xm_awaiting_dashboard_screenshot', {
+        'screenshot_message_id': message.message_id,
+        'registration_screenshot': message.photo[-1].file_id
+    })
     
     # Ask for XM Dashboard screenshot instead of account ID
     bot.send_message(
@@ -2935,17 +3144,17 @@ def handle_xm_verify_cancel(call):
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'xm_awaiting_dashboard_screenshot', content_types=['photo'])
+@flows.step('xm', 'xm_awaiting_dashboard_screenshot', content_types=['photo'], transitions=['xm_awaiting_deposit_confirmation'])
 def handle_xm_dashboard_screenshot(message):
     """Handle the second screenshot (dashboard screenshot)"""
     user_id = message.from_user.id
     chat_id = message.chat.id
     
     # Store dashboard screenshot details
-    PENDING_USERS[user_id]['dashboard_screenshot'] = message.photo[-1].file_id
-    PENDING_USERS[user_id]['dashboard_message_id'] = message.message_id
-    PENDING_USERS[user_id]['status'] = 'xm_awaiting_deposit_confirmation'
-    save_pending_users()
+    flows.advance(user_id, 'xm_awaiting_deposit_confirmation', {
+        'dashboard_screenshot': message.photo[-1].file_id,
+        'dashboard_message_id': message.message_id
+    })
     
     # Create inline keyboard for deposit confirmation
     markup = InlineKeyboardMarkup(row_width=2)
@@ -3476,14 +3685,7 @@ def handle_xm_registration_no(call):
         
         if not already_in_group:
             # Generate a new invite link
-            new_invite = bot.create_chat_invite_link(
-                target_group_id,
-                name=f"User {user_id} trial access",
-                creates_join_request=False,
-                member_limit=1,
-                expire_date=int((datetime.now() + timedelta(minutes=15)).timestamp())
-            )
-            invite_link = new_invite.invite_link
+            invite_link = invite_pool.take_invite_link(target_group_id, name=f"User {user_id} trial access", user_id=user_id)
             
             # Send invite link to user
             bot.send_message(
@@ -3495,14 +3697,7 @@ def handle_xm_registration_no(call):
             )
             
             # Revoke link after 15 minutes
-            def revoke_link_later(chat_id, invite_link):
-                time.sleep(900)  # 15 minutes
-                try:
-                    bot.revoke_chat_invite_link(chat_id, invite_link)
-                except Exception as e:
-                    logging.error(f"Error revoking invite link: {e}")
-                    
-            threading.Thread(target=revoke_link_later, args=(target_group_id, invite_link)).start()
+            invite_pool.revoke_later(target_group_id, invite_link, 900)
         else:
             bot.send_message(
                 user_id,
@@ -3633,14 +3828,7 @@ def callback_approve_xm_trial(call):
         if not already_in_group:
             try:
                 # Generate a new invite link
-                new_invite = bot.create_chat_invite_link(
-                    target_group_id,
-                    name=f"User {user_id} trial access",
-                    creates_join_request=False,
-                    member_limit=1,
-                    expire_date=int((datetime.now() + timedelta(minutes=15)).timestamp())
-                )
-                invite_link = new_invite.invite_link
+                invite_link = invite_pool.take_invite_link(target_group_id, name=f"User {user_id} trial access", user_id=user_id)
                 
                 # Send approval and invite to user
                 bot.send_message(
@@ -3653,14 +3841,7 @@ def callback_approve_xm_trial(call):
                 )
                 
                 # Revoke link after 15 minutes
-                def revoke_link_later(chat_id, invite_link):
-                    time.sleep(900)  # 15 minutes
-                    try:
-                        bot.revoke_chat_invite_link(chat_id, invite_link)
-                    except Exception as e:
-                        logging.error(f"Error revoking invite link: {e}")
-                        
-                threading.Thread(target=revoke_link_later, args=(target_group_id, invite_link)).start()
+                invite_pool.revoke_later(target_group_id, invite_link, 900)
                 
             except Exception as e:
                 logging.error(f"Error generating invite link: {e}")
@@ -3692,6 +3873,7 @@ def check_trial_reminders():
     """Check for users needing form completion reminders"""
     while True:
         try:
+            heartbeat.beat('trial_reminders')
             now = datetime.now()
             
             for user_id_str, data in PAYMENT_DATA.items():
@@ -3707,7 +3889,9 @@ def check_trial_reminders():
                         if now >= reminder_date:
                             try:
                                 user_id = int(user_id_str)
-                                
+                                if unreachable.should_skip(user_id, 'trial_reminders'):
+                                    continue
+
                                 # Get due date for message
                                 due_date = datetime.strptime(data.get('due_date', '2099-01-01 00:00:00'), '%Y-%m-%d %H:%M:%S')
                                 days_remaining = (due_date - now).days
@@ -3734,11 +3918,13 @@ def check_trial_reminders():
                                 logging.error(f"Error sending trial reminder to user {user_id_str}: {e}")
             
             # Check every hour
-            time.sleep(3600)
+            heartbeat.success('trial_reminders')
+            heartbeat.sleep('trial_reminders', 3600)
             
         except Exception as e:
             logging.error(f"Error in trial reminder checker: {e}")
-            time.sleep(3600)  # Sleep and try again in an hour
+            heartbeat.failure('trial_reminders', e)
+            heartbeat.sleep('trial_reminders', 3600)  # Sleep and try again in an hour
 
 @bot.callback_query_handler(func=lambda call: call.data == "start_xm_forms")
 def start_xm_forms(call):
@@ -4459,6 +4645,26 @@ def handle_cancel_confirmation_callback(call):
     PENDING_USERS.pop(user_id, None)  # Remove from dictionary
     delete_pending_user(user_id)  # Remove from MongoDB
 
+def pending_quote(pending, fee_percentage=0.0):
+    """Return the price quote for the plan a pending user picked, or None if there isn't one"""
+    plan_code = pending.get('plan_code')
+    if plan_code is None:
+        # Picked before plan codes were stored
+        found = pricing.find_plan(pending.get('mentorship_type'), pending.get('plan'))
+        if found is None:
+            return None
+        plan_code = found.code
+    discount_percentage = pending.get('discount_percentage', 0) if pending.get('original_price_usd') else 0
+    return pricing.quote(plan_code, discount_percentage, fee_percentage)
+
+def plan_menu_markup(menu, back_callback):
+    """Build the plan buttons of a price menu followed by a back button"""
+    markup = InlineKeyboardMarkup(row_width=1)
+    for label, callback_data in menu.buttons:
+        markup.add(InlineKeyboardButton(label, callback_data=callback_data))
+    markup.add(InlineKeyboardButton("⬅️ Go Back", callback_data=back_callback))
+    return markup
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith("mentorship_"))
 def handle_mentorship_selection(call):
     """Handle mentorship type selection from inline buttons"""
@@ -4498,96 +4704,25 @@ def handle_mentorship_selection(call):
             )
             return
         
-        # Get regular discount specifically
-        applicable_discount = DISCOUNTS.get('regular')
-        discount_active = applicable_discount and applicable_discount.get('active', False)
-        
-        # Check if discount applies to this transaction type (new or renewal)
-        if discount_active:
-            transaction_type = "renewal" if is_renewal else "new"
-            discount_transaction_type = applicable_discount.get('transaction_type', 'both')
-            
-            # Determine if discount applies to this transaction type
-            applies_to_transaction = (
-                discount_transaction_type == 'both' or 
-                discount_transaction_type == transaction_type
-            )
-            
-            # Only consider discount active if it applies to this transaction type
-            if not applies_to_transaction:
-                discount_active = False
-                
-        discount_percentage = applicable_discount.get('percentage', 0) if discount_active else 0
-        discount_name = applicable_discount.get('name', '') if discount_active else ''
+        # Get regular discount if it applies to this purchase
+        applicable_discount = pricing.applicable_discount(DISCOUNTS.get('regular'), is_renewal)
         
         PENDING_USERS[chat_id]['mentorship_type'] = 'regular'
         PENDING_USERS[chat_id]['status'] = 'choosing_mentorship_plan'
         save_pending_users()
         
-        # Original prices
-        trial_price = 7.99
-        momentum_price = 20.99
-        legacy_price = 89.99
+        menu = pricing.plan_menu('regular', applicable_discount)
         
-        # Create markup for plan selection
-        markup = InlineKeyboardMarkup(row_width=1)
+        # Customize message based on whether this is a renewal
+        intro_text = "Renewal options" if is_renewal else "Please select your Regular Mentorship plan"
         
-        if discount_active:
-            # Calculate discounted prices
-            trial_discounted = round(trial_price * (1 - discount_percentage / 100), 2)
-            momentum_discounted = round(momentum_price * (1 - discount_percentage / 100), 2)
-            legacy_discounted = round(legacy_price * (1 - discount_percentage / 100), 2)
-            
-            # Add buttons with discounted prices
-            markup.add(
-                InlineKeyboardButton(f"Trial (${trial_discounted:.2f}) / Monthly", callback_data="plan_trial"),
-                InlineKeyboardButton(f"Momentum (${momentum_discounted:.2f}) / 3 Months", callback_data="plan_momentum"),
-                InlineKeyboardButton(f"Legacy (${legacy_discounted:.2f}) / Yearly", callback_data="plan_regular_legacy")
-            )
-            
-            # ADD BACK BUTTON
-            markup.add(InlineKeyboardButton("⬅️ Go Back", callback_data="back_to_mentorship_type"))
-            
-            # Customize message based on whether this is a renewal
-            intro_text = "Renewal options" if is_renewal else "Please select your Regular Mentorship plan"
-            
-            # Edit the current message with plans
-            bot.edit_message_text( 
-                f"{intro_text}:\n\n"
-                f"🎉 <b>{discount_name}: {discount_percentage}% OFF!</b>\n\n"
-                f"💰 <b>Trial</b> - <s>${trial_price:.2f}</s> ${trial_discounted:.2f} / Monthly\n"
-                f"💰 <b>Momentum</b> - <s>${momentum_price:.2f}</s> ${momentum_discounted:.2f} / 3 Months\n"
-                f"💰 <b>Legacy</b> - <s>${legacy_price:.2f}</s> ${legacy_discounted:.2f} / Yearly", 
-                chat_id,
-                message_id,
-                reply_markup=markup, 
-                parse_mode="HTML"
-            )
-        else:
-            # No discount - show regular prices without strikethrough
-            markup.add(
-                InlineKeyboardButton(f"Trial (${trial_price:.2f}) / Monthly", callback_data="plan_trial"),
-                InlineKeyboardButton(f"Momentum (${momentum_price:.2f}) / 3 Months", callback_data="plan_momentum"),
-                InlineKeyboardButton(f"Legacy (${legacy_price:.2f}) / Yearly", callback_data="plan_regular_legacy")
-            )
-            
-            # ADD BACK BUTTON
-            markup.add(InlineKeyboardButton("⬅️ Go Back", callback_data="back_to_mentorship_type"))
-            
-            # Customize message based on whether this is a renewal
-            intro_text = "Renewal options" if is_renewal else "Please select your Regular Mentorship plan"
-            
-            # Edit the current message
-            bot.edit_message_text(
-                f"{intro_text}:\n\n"
-                f"💰 <b>Trial</b> - ${trial_price:.2f} / Monthly\n"
-                f"💰 <b>Momentum</b> - ${momentum_price:.2f} / 3 Months\n"
-                f"💰 <b>Legacy</b> - ${legacy_price:.2f} / Yearly", 
-                chat_id,
-                message_id,
-                reply_markup=markup, 
-                parse_mode="HTML"
-            )
+        bot.edit_message_text(
+            f"{intro_text}:\n\n{menu.text}",
+            chat_id,
+            message_id,
+            reply_markup=plan_menu_markup(menu, "back_to_mentorship_type"),
+            parse_mode="HTML"
+        )
         
     elif mentorship_type == "supreme":
         # Process Supreme Mentorship selection
@@ -4618,96 +4753,25 @@ def handle_mentorship_selection(call):
             )
             return
         
-        # Get supreme discount specifically
-        applicable_discount = DISCOUNTS.get('supreme')
-        discount_active = applicable_discount and applicable_discount.get('active', False)
-        
-        # Check if discount applies to this transaction type (new or renewal)
-        if discount_active:
-            transaction_type = "renewal" if is_renewal else "new"
-            discount_transaction_type = applicable_discount.get('transaction_type', 'both')
-            
-            # Determine if discount applies to this transaction type
-            applies_to_transaction = (
-                discount_transaction_type == 'both' or 
-                discount_transaction_type == transaction_type
-            )
-            
-            # Only consider discount active if it applies to this transaction type
-            if not applies_to_transaction:
-                discount_active = False
-                
-        discount_percentage = applicable_discount.get('percentage', 0) if discount_active else 0
-        discount_name = applicable_discount.get('name', '') if discount_active else ''
+        # Get supreme discount if it applies to this purchase
+        applicable_discount = pricing.applicable_discount(DISCOUNTS.get('supreme'), is_renewal)
         
         PENDING_USERS[chat_id]['mentorship_type'] = 'supreme'
         PENDING_USERS[chat_id]['status'] = 'choosing_mentorship_plan'
         save_pending_users()
         
-        # Original prices
-        apprentice_price = 309.99
-        disciple_price = 524.99
-        legacy_price = 899.99
+        menu = pricing.plan_menu('supreme', applicable_discount)
         
-        # Create markup for plan selection
-        markup = InlineKeyboardMarkup(row_width=1)
+        # Customize message based on whether this is a renewal
+        intro_text = "Renewal options" if is_renewal else "Please select your Supreme Mentorship plan"
         
-        if discount_active:
-            # Calculate discounted prices
-            apprentice_discounted = round(apprentice_price * (1 - discount_percentage / 100), 2)
-            disciple_discounted = round(disciple_price * (1 - discount_percentage / 100), 2)
-            legacy_discounted = round(legacy_price * (1 - discount_percentage / 100), 2)
-            
-            # Add buttons with discounted prices
-            markup.add(
-                InlineKeyboardButton(f"Apprentice (${apprentice_discounted:.2f}) / 3 Months", callback_data="plan_apprentice"),
-                InlineKeyboardButton(f"Disciple (${disciple_discounted:.2f}) / 6 Months", callback_data="plan_disciple"),
-                InlineKeyboardButton(f"Legacy (${legacy_discounted:.2f}) / Lifetime", callback_data="plan_supreme_legacy")
-            )
-            
-            # ADD BACK BUTTON BEFORE SENDING THE MESSAGE
-            markup.add(InlineKeyboardButton("⬅️ Go Back", callback_data="back_to_mentorship_type"))
-            
-            # Customize message based on whether this is a renewal
-            intro_text = "Renewal options" if is_renewal else "Please select your Supreme Mentorship plan"
-            
-            # FIXED: Use edit_message_text instead of send_message
-            bot.edit_message_text(
-                f"{intro_text}:\n\n"
-                f"🎉 <b>{discount_name}: {discount_percentage}% OFF!</b>\n\n"
-                f"💰 <b>Apprentice</b> - <s>${apprentice_price:.2f}</s> ${apprentice_discounted:.2f} / 3 Months\n"
-                f"💰 <b>Disciple</b> - <s>${disciple_price:.2f}</s> ${disciple_discounted:.2f} / 6 Months\n"
-                f"💰 <b>Legacy</b> - <s>${legacy_price:.2f}</s> ${legacy_discounted:.2f} / Lifetime", 
-                chat_id,
-                message_id,
-                reply_markup=markup, 
-                parse_mode="HTML"
-            )
-        else:
-            # No discount - show regular prices without strikethrough
-            markup.add(
-                InlineKeyboardButton(f"Apprentice (${apprentice_price:.2f}) / 3 Months", callback_data="plan_apprentice"),
-                InlineKeyboardButton(f"Disciple (${disciple_price:.2f}) / 6 Months", callback_data="plan_disciple"),
-                InlineKeyboardButton(f"Legacy (${legacy_price:.2f}) / Lifetime", callback_data="plan_supreme_legacy")
-            )
-            
-            # ADD BACK BUTTON
-            markup.add(InlineKeyboardButton("⬅️ Go Back", callback_data="back_to_mentorship_type"))
-            
-            # Customize message based on whether this is a renewal
-            intro_text = "Renewal options" if is_renewal else "Please select your Supreme Mentorship plan"
-            
-            # FIXED: Use edit_message_text instead of send_message
-            bot.edit_message_text(
-                f"{intro_text}:\n\n"
-                f"💰 <b>Apprentice</b> - ${apprentice_price:.2f} / 3 Months\n"
-                f"💰 <b>Disciple</b> - ${disciple_price:.2f} / 6 Months\n"
-                f"💰 <b>Legacy</b> - ${legacy_price:.2f} / Lifetime", 
-                chat_id,
-                message_id,
-                reply_markup=markup, 
-                parse_mode="HTML"
-            )
+        bot.edit_message_text(
+            f"{intro_text}:\n\n{menu.text}",
+            chat_id,
+            message_id,
+            reply_markup=plan_menu_markup(menu, "back_to_mentorship_type"),
+            parse_mode="HTML"
+        )
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("plan_"))
 def handle_plan_selection(call):
@@ -4717,48 +4781,23 @@ def handle_plan_selection(call):
     user_id = call.from_user.id
     selected_plan = call.data.split("_", 1)[1]  # Split only on first underscore
     
-    # Extract plan data based on selection
-    if selected_plan == "trial":
-        plan = "Trial"
-        price_usd = 7.99  # Store numeric USD price for currency conversion
-        duration = "Monthly"
-        mentorship_type = "regular"
-    elif selected_plan == "momentum":
-        plan = "Momentum"
-        price_usd = 20.99
-        duration = "3 Months"
-        mentorship_type = "regular"
-    elif selected_plan == "apprentice":
-        plan = "Apprentice"
-        price_usd = 309.99
-        duration = "3 Months"
-        mentorship_type = "supreme"
-    elif selected_plan == "disciple":
-        plan = "Disciple"
-        price_usd = 524.99
-        duration = "6 Months" 
-        mentorship_type = "supreme"
-    elif selected_plan == "regular_legacy":
-        plan = "Legacy"
-        price_usd = 89.99
-        duration = "Yearly"
-        mentorship_type = "regular"
-    elif selected_plan == "supreme_legacy":
-        plan = "Legacy"
-        price_usd = 899.99
-        duration = "Lifetime"
-        mentorship_type = "supreme"
-    else:
+    # Look up the selected plan
+    selected = pricing.PLANS.get(selected_plan)
+    if selected is None:
         # If we get an unknown plan, respond with an error and return
         bot.answer_callback_query(call.id, "❌ Invalid plan selection.")
         return
+    plan = selected.name
+    duration = selected.duration
+    mentorship_type = selected.mentorship_type
 
     # Acknowledge the selection
     bot.answer_callback_query(call.id, f"Selected {plan} plan")
 
     # Store original price before any discounts
-    original_price_usd = price_usd
-    original_price = f"${original_price_usd:.2f}"
+    original_price_usd = float(selected.price)
+    original_price = pricing.usd(selected.price)
+    price_usd = original_price_usd  # Numeric USD price for currency conversion
     
     # Apply appropriate discount based on mentorship type
     discount_applied = False
@@ -4780,16 +4819,15 @@ def handle_plan_selection(call):
         
         # Only apply if the discount is valid for this transaction type
         if applies_to_transaction:
-            # Get discount percentage and user limit
+            # Get discount percentage and name
             discount_percentage = applicable_discount.get('percentage', 0)
-            user_limit = applicable_discount.get('user_limit')
-            users_used = applicable_discount.get('users_used', [])
             discount_name = applicable_discount.get('name', f'Special {mentorship_type.capitalize()} Discount')
             
-            # Check if user limit is reached and if this user already used the discount
-            if (user_limit is None or len(users_used) < user_limit) and str(user_id) not in users_used:
+            # Claim one use of the discount; the limit and this user's previous use are checked atomically
+            redemption = redeem_discount(mentorship_type, applicable_discount, user_id)
+            if redemption == 'redeemed':
                 # Apply the discount
-                price_usd = original_price_usd * (1 - discount_percentage / 100)
+                price_usd = float(pricing.quote(selected_plan, discount_percentage).discounted)
                 
                 # Store discount info for later use
                 PENDING_USERS[chat_id]['discount_percentage'] = discount_percentage
@@ -4799,16 +4837,12 @@ def handle_plan_selection(call):
                 # Mark discount as applied
                 discount_applied = True
                 
-                # Add user to the list of users who used this discount
-                DISCOUNTS[mentorship_type]['users_used'].append(str(user_id))
-                save_discount(DISCOUNTS[mentorship_type], mentorship_type)
-                
                 # Log the discount application
                 logging.info(f"Applied {discount_percentage}% {mentorship_type} discount to user {user_id}, price reduced from ${original_price_usd} to ${price_usd}")
-            elif user_limit is not None and len(users_used) >= user_limit and str(user_id) not in users_used:
+            elif redemption == 'limit_reached':
                 # User limit reached
                 bot.send_message(chat_id, f"❌ The {discount_name} discount has reached its user limit. Your purchase will continue at the regular price.")
-            elif str(user_id) in users_used:
+            elif redemption == 'already_used':
                 # User already used the discount
                 bot.send_message(chat_id, f"ℹ️ You've already used the {discount_name} discount. This purchase will be at the regular price.")
         else:
@@ -4823,6 +4857,7 @@ def handle_plan_selection(call):
 
     # Store the plan details including the numeric USD price
     PENDING_USERS[chat_id]['plan'] = plan
+    PENDING_USERS[chat_id]['plan_code'] = selected_plan
     PENDING_USERS[chat_id]['price'] = price
     PENDING_USERS[chat_id]['price_usd'] = price_usd  # Store numeric price for conversion
     PENDING_USERS[chat_id]['mentorship_type'] = mentorship_type  # Store for later use
@@ -4922,57 +4957,27 @@ def handle_payment_method(call):
     # Get plan details for the message
     mentorship_type = PENDING_USERS[chat_id].get('mentorship_type', '')
     plan = PENDING_USERS[chat_id].get('plan', '')
-    price = PENDING_USERS[chat_id].get('price', '')
-    price_usd = PENDING_USERS[chat_id].get('price_usd', 0)  # Get numeric discounted price
-    original_price_usd = PENDING_USERS[chat_id].get('original_price_usd')  # Original price before discount
     duration = PENDING_USERS[chat_id].get('duration', '')
+    discount_percentage = PENDING_USERS[chat_id].get('discount_percentage')
+    discount_name = PENDING_USERS[chat_id].get('discount_name')
     
-    # Calculate payment method fee based on the ALREADY DISCOUNTED price
+    # Look up the prices with the payment method fee applied to the ALREADY DISCOUNTED price
     fee_percentage = PAYMENT_FEES.get(method, 0.0)
-    if fee_percentage > 0:
-        fee_adjusted_price = price_usd * (1 + fee_percentage/100)
-        fee_adjusted_price_str = f"${fee_adjusted_price:.2f}"
-    else:
-        fee_adjusted_price = price_usd  # No fee adjustment
-        fee_adjusted_price_str = price
-    
-    # Fetch real-time exchange rates - use fee_adjusted_price for conversions
-    exchange_rates = get_exchange_rates()
+    quote = pending_quote(PENDING_USERS[chat_id], fee_percentage)
+    if quote is None:
+        logging.error(f"No plan found for user {user_id} at payment method selection")
+        bot.send_message(chat_id, "❌ We couldn't find your selected plan. Please use /start to choose it again.")
+        return
     
-    # Prepare currency conversion information based on the FINAL price
+    # Currency equivalents of the FINAL price, from the current exchange rates
     currency_info = ""
-    if exchange_rates:
-        currency_info = "\n\n💱 *Equivalent Prices*:\n"
-        
-        # Define currency symbols for better display
-        currency_symbols = {
-            'USD': '$', 'GBP': '£', 'EUR': '€', 'IDR': 'Rp', 'PHP': '₱'
-        }
-        
-        for currency, rate in exchange_rates.items():
-            if currency == 'USD':
-                continue  # Skip USD as it's already shown
-            
-            # Use the final fee-adjusted price for all currency conversions
-            equivalent_price = fee_adjusted_price * rate
-            
-            symbol = currency_symbols.get(currency, '')
-            
-            # Format based on currency
-            if currency in ['IDR', 'PHP']:
-                formatted_price = f"{symbol}{equivalent_price:,.0f}"
-            else:
-                whole_price = int(equivalent_price)
-                formatted_price = f"{symbol}{whole_price:,}.99"
-            
-            currency_info += f"• *{currency}*: {formatted_price}\n"
+    if quote.equivalents:
+        currency_info = "\n\n💱 *Equivalent Prices*:\n" + quote.equivalents
     
-    # Format plan details based on discount and payment fee combinations
-    discount_percentage = PENDING_USERS[chat_id].get('discount_percentage')
-    discount_name = PENDING_USERS[chat_id].get('discount_name')
+    method_name = method.strip('💳📱🏦🌐💸 ')
 
     # Create a comprehensive message showing all calculations clearly
-    if original_price_usd and discount_percentage:
+    if quote.discount_percentage:
         # Case: Has discount
         if fee_percentage > 0:
             # Has both discount AND payment fee - show complete calculation
@@ -4980,13 +4985,13 @@ def handle_payment_method(call):
                 f"*Plan Details*:\n"
                 f"- Type: {mentorship_type.capitalize()} Mentorship\n"
                 f"- Plan: {plan}\n"
-                f"- Original Price: ${original_price_usd:.2f} USD\n"
-                f"- *{discount_name}: {discount_percentage}% OFF* (-${(original_price_usd - price_usd):.2f})\n"
-                f"- Discounted Price: ${price_usd:.2f} USD\n"
-                f"- *{method.strip('💳📱🏦🌐💸 ')} Fee: {fee_percentage}%* (+${(fee_adjusted_price - price_usd):.2f})\n"
-                f"- **Final Price: {fee_adjusted_price_str} USD**\n"
+                f"- Original Price: {pricing.usd(quote.original)} USD\n"
+                f"- *{discount_name}: {discount_percentage}% OFF* (-{pricing.usd(quote.discount_amount)})\n"
+                f"- Discounted Price: {pricing.usd(quote.discounted)} USD\n"
+                f"- *{method_name} Fee: {fee_percentage}%* (+{pricing.usd(quote.fee_amount)})\n"
+                f"- **Final Price: {pricing.usd(quote.final)} USD**\n"
                 f"- Duration: {duration}{currency_info}\n\n"
-                f"*Note: A {fee_percentage}% fee applies to cover {method.strip('💳📱🏦🌐💸 ')} transaction costs.*\n\n"
+                f"*Note: A {fee_percentage}% fee applies to cover {method_name} transaction costs.*\n\n"
             )
         else:
             # Has discount but NO payment fee
@@ -4994,9 +4999,9 @@ def handle_payment_method(call):
                 f"*Plan Details*:\n"
                 f"- Type: {mentorship_type.capitalize()} Mentorship\n"
                 f"- Plan: {plan}\n"
-                f"- Original Price: ${original_price_usd:.2f} USD\n"
-                f"- *{discount_name}: {discount_percentage}% OFF* (-${(original_price_usd - price_usd):.2f})\n"
-                f"- **Final Price: ${price_usd:.2f} USD**\n"
+                f"- Original Price: {pricing.usd(quote.original)} USD\n"
+                f"- *{discount_name}: {discount_percentage}% OFF* (-{pricing.usd(quote.discount_amount)})\n"
+                f"- **Final Price: {pricing.usd(quote.final)} USD**\n"
                 f"- Duration: {duration}{currency_info}\n\n"
             )
     else:
@@ -5007,11 +5012,11 @@ def handle_payment_method(call):
                 f"*Plan Details*:\n"
                 f"- Type: {mentorship_type.capitalize()} Mentorship\n"
                 f"- Plan: {plan}\n"
-                f"- Base Price: ${price_usd:.2f} USD\n"
-                f"- *{method.strip('💳📱🏦🌐💸 ')} Fee: {fee_percentage}%* (+${(fee_adjusted_price - price_usd):.2f})\n"
-                f"- **Final Price: {fee_adjusted_price_str} USD**\n"
+                f"- Base Price: {pricing.usd(quote.discounted)} USD\n"
+                f"- *{method_name} Fee: {fee_percentage}%* (+{pricing.usd(quote.fee_amount)})\n"
+                f"- **Final Price: {pricing.usd(quote.final)} USD**\n"
                 f"- Duration: {duration}{currency_info}\n\n"
-                f"*Note: A {fee_percentage}% fee applies to cover {method.strip('💳📱🏦🌐💸 ')} transaction costs.*\n\n"
+                f"*Note: A {fee_percentage}% fee applies to cover {method_name} transaction costs.*\n\n"
             )
         else:
             # No discount, no payment fee - simplest case
@@ -5019,12 +5024,12 @@ def handle_payment_method(call):
                 f"*Plan Details*:\n"
                 f"- Type: {mentorship_type.capitalize()} Mentorship\n"
                 f"- Plan: {plan}\n"
-                f"- **Price: ${price_usd:.2f} USD**\n"
+                f"- **Price: {pricing.usd(quote.final)} USD**\n"
                 f"- Duration: {duration}{currency_info}\n\n"
             )
 
     # Also update the payment information in PENDING_USERS to track the final price
-    PENDING_USERS[chat_id]['final_price_usd'] = fee_adjusted_price
+    PENDING_USERS[chat_id]['final_price_usd'] = float(quote.final)
     save_pending_users()
 
     # Send payment credentials based on the selected method
@@ -5082,179 +5087,21 @@ def back_to_plan_selection(call):
     PENDING_USERS[chat_id]['status'] = 'choosing_mentorship_plan'
     save_pending_users()
     
-    # Create new markup based on the mentorship type
-    markup = InlineKeyboardMarkup(row_width=1)
+    # Show the plans for the stored mentorship type
+    if mentorship_type != 'regular':
+        mentorship_type = 'supreme'
+    menu = pricing.plan_menu(mentorship_type, pricing.applicable_discount(DISCOUNTS.get(mentorship_type), is_renewal))
     
-    # Use stored mentorship type to determine which plans to show
-    if mentorship_type == 'regular':
-        # Get regular discount if applicable
-        applicable_discount = DISCOUNTS.get('regular')
-        discount_active = applicable_discount and applicable_discount.get('active', False)
-        
-        # Check if discount applies to this transaction type
-        if discount_active:
-            transaction_type = "renewal" if is_renewal else "new"
-            discount_transaction_type = applicable_discount.get('transaction_type', 'both')
-            
-            # Determine if discount applies to this transaction type
-            applies_to_transaction = (
-                discount_transaction_type == 'both' or 
-                discount_transaction_type == transaction_type
-            )
-            
-            # Only consider discount active if it applies to this transaction type
-            if not applies_to_transaction:
-                discount_active = False
-                
-        discount_percentage = applicable_discount.get('percentage', 0) if discount_active else 0
-        discount_name = applicable_discount.get('name', '') if discount_active else ''
-        
-        # Original prices
-        trial_price = 7.99
-        momentum_price = 20.99
-        legacy_price = 89.99
-        
-        if discount_active:
-            # Calculate discounted prices
-            trial_discounted = round(trial_price * (1 - discount_percentage / 100), 2)
-            momentum_discounted = round(momentum_price * (1 - discount_percentage / 100), 2)
-            legacy_discounted = round(legacy_price * (1 - discount_percentage / 100), 2)
-            
-            # Add buttons with discounted prices
-            markup.add(
-                InlineKeyboardButton(f"Trial (${trial_discounted:.2f}) / Monthly", callback_data="plan_trial"),
-                InlineKeyboardButton(f"Momentum (${momentum_discounted:.2f}) / 3 Months", callback_data="plan_momentum"),
-                InlineKeyboardButton(f"Legacy (${legacy_discounted:.2f}) / Yearly", callback_data="plan_regular_legacy")
-            )
-            
-            # Add back button
-            markup.add(InlineKeyboardButton("⬅️ Go Back", callback_data="back_to_mentorship_type"))
-            
-            # Customize message based on whether this is a renewal
-            intro_text = "Renewal options" if is_renewal else "Please select your Regular Mentorship plan"
-            
-            # FIXED: Use edit_message_text instead of send_message
-            bot.edit_message_text(
-                f"{intro_text}:\n\n"
-                f"🎉 <b>{discount_name}: {discount_percentage}% OFF!</b>\n\n"
-                f"💰 <b>Trial</b> - <s>${trial_price:.2f}</s> ${trial_discounted:.2f} / Monthly\n"
-                f"💰 <b>Momentum</b> - <s>${momentum_price:.2f}</s> ${momentum_discounted:.2f} / 3 Months\n"
-                f"💰 <b>Legacy</b> - <s>${legacy_price:.2f}</s> ${legacy_discounted:.2f} / Yearly", 
-                chat_id,
-                message_id,
-                reply_markup=markup, 
-                parse_mode="HTML"
-            )
-        else:
-            # No discount - show regular prices without strikethrough
-            markup.add(
-                InlineKeyboardButton(f"Trial (${trial_price:.2f}) / Monthly", callback_data="plan_trial"),
-                InlineKeyboardButton(f"Momentum (${momentum_price:.2f}) / 3 Months", callback_data="plan_momentum"),
-                InlineKeyboardButton(f"Legacy (${legacy_price:.2f}) / Yearly", callback_data="plan_regular_legacy")
-            )
-            
-            # Add back button
-            markup.add(InlineKeyboardButton("⬅️ Go Back", callback_data="back_to_mentorship_type"))
-            
-            # Customize message based on whether this is a renewal
-            intro_text = "Renewal options" if is_renewal else "Please select your Regular Mentorship plan"
-            
-            # FIXED: Use edit_message_text instead of send_message
-            bot.edit_message_text(
-                f"{intro_text}:\n\n"
-                f"💰 <b>Trial</b> - ${trial_price:.2f} / Monthly\n"
-                f"💰 <b>Momentum</b> - ${momentum_price:.2f} / 3 Months\n"
-                f"💰 <b>Legacy</b> - ${legacy_price:.2f} / Yearly", 
-                chat_id,
-                message_id,
-                reply_markup=markup, 
-                parse_mode="HTML"
-            )
-    else:
-        # Supreme membership
-        # Get supreme discount if applicable
-        applicable_discount = DISCOUNTS.get('supreme')
-        discount_active = applicable_discount and applicable_discount.get('active', False)
-        
-        # Check if discount applies to this transaction type
-        if discount_active:
-            transaction_type = "renewal" if is_renewal else "new"
-            discount_transaction_type = applicable_discount.get('transaction_type', 'both')
-            
-            # Determine if discount applies to this transaction type
-            applies_to_transaction = (
-                discount_transaction_type == 'both' or 
-                discount_transaction_type == transaction_type
-            )
-            
-            # Only consider discount active if it applies to this transaction type
-            if not applies_to_transaction:
-                discount_active = False
-                
-        discount_percentage = applicable_discount.get('percentage', 0) if discount_active else 0
-        discount_name = applicable_discount.get('name', '') if discount_active else ''
-        
-        # Original prices
-        apprentice_price = 309.99
-        disciple_price = 524.99
-        legacy_price = 899.99
-        
-        if discount_active:
-            # Calculate discounted prices
-            apprentice_discounted = round(apprentice_price * (1 - discount_percentage / 100), 2)
-            disciple_discounted = round(disciple_price * (1 - discount_percentage / 100), 2)
-            legacy_discounted = round(legacy_price * (1 - discount_percentage / 100), 2)
-            
-            # Add buttons with discounted prices
-            markup.add(
-                InlineKeyboardButton(f"Apprentice (${apprentice_discounted:.2f}) / 3 Months", callback_data="plan_apprentice"),
-                InlineKeyboardButton(f"Disciple (${disciple_discounted:.2f}) / 6 Months", callback_data="plan_disciple"),
-                InlineKeyboardButton(f"Legacy (${legacy_discounted:.2f}) / Lifetime", callback_data="plan_supreme_legacy")
-            )
-            
-            # Add back button
-            markup.add(InlineKeyboardButton("⬅️ Go Back", callback_data="back_to_mentorship_type"))
-            
-            # Customize message based on whether this is a renewal
-            intro_text = "Renewal options" if is_renewal else "Please select your Supreme Mentorship plan"
-            
-            # FIXED: Use edit_message_text instead of send_message
-            bot.edit_message_text(
-                f"{intro_text}:\n\n"
-                f"🎉 <b>{discount_name}: {discount_percentage}% OFF!</b>\n\n"
-                f"💰 <b>Apprentice</b> - <s>${apprentice_price:.2f}</s> ${apprentice_discounted:.2f} / 3 Months\n"
-                f"💰 <b>Disciple</b> - <s>${disciple_price:.2f}</s> ${disciple_discounted:.2f} / 6 Months\n"
-                f"💰 <b>Legacy</b> - <s>${legacy_price:.2f}</s> ${legacy_discounted:.2f} / Lifetime", 
-                chat_id,
-                message_id,
-                reply_markup=markup, 
-                parse_mode="HTML"
-            )
-        else:
-            # No discount - show regular prices without strikethrough
-            markup.add(
-                InlineKeyboardButton(f"Apprentice (${apprentice_price:.2f}) / 3 Months", callback_data="plan_apprentice"),
-                InlineKeyboardButton(f"Disciple (${disciple_price:.2f}) / 6 Months", callback_data="plan_disciple"),
-                InlineKeyboardButton(f"Legacy (${legacy_price:.2f}) / Lifetime", callback_data="plan_supreme_legacy")
-            )
-            
-            # Add back button
-            markup.add(InlineKeyboardButton("⬅️ Go Back", callback_data="back_to_mentorship_type"))
-            
-            # Customize message based on whether this is a renewal
-            intro_text = "Renewal options" if is_renewal else "Please select your Supreme Mentorship plan"
-            
-            # FIXED: Use edit_message_text instead of send_message
-            bot.edit_message_text(
-                f"{intro_text}:\n\n"
-                f"💰 <b>Apprentice</b> - ${apprentice_price:.2f} / 3 Months\n"
-                f"💰 <b>Disciple</b> - ${disciple_price:.2f} / 6 Months\n"
-                f"💰 <b>Legacy</b> - ${legacy_price:.2f} / Lifetime", 
-                chat_id,
-                message_id,
-                reply_markup=markup, 
-                parse_mode="HTML"
-            )
+    # Customize message based on whether this is a renewal
+    intro_text = "Renewal options" if is_renewal else f"Please select your {mentorship_type.capitalize()} Mentorship plan"
+    
+    bot.edit_message_text(
+        f"{intro_text}:\n\n{menu.text}",
+        chat_id,
+        message_id,
+        reply_markup=plan_menu_markup(menu, "back_to_mentorship_type"),
+        parse_mode="HTML"
+    )
 
 # Add handler for back button if needed
 @bot.callback_query_handler(func=lambda call: call.data == "back_to_mentorship_type")
@@ -5288,6 +5135,65 @@ def back_to_mentorship_type(call):
 def has_user_paid(user_id):
     return str(user_id) in PAYMENT_DATA and PAYMENT_DATA[str(user_id)]['haspayed']
 
+def group_access(user_id, chat_id):
+    """Check whether a user may be in one of the paid groups; returns (allowed, reason)
+
+    A single PAYMENT_DATA lookup: the membership must be paid, not cancelled
+    and not past its due date (unless in a grace period), and the Supreme
+    group also needs a Supreme membership.
+    """
+    data = PAYMENT_DATA.get(str(user_id))
+    if not data or not data.get('haspayed', False):
+        return False, "no active membership"
+    if data.get('cancelled', False):
+        return False, "membership cancelled"
+    if not data.get('grace_period', False) and data.get('due_date'):
+        try:
+            due_date = datetime.strptime(data['due_date'], '%Y-%m-%d %H:%M:%S')
+            if due_date < datetime.now():
+                return False, "membership expired"
+        except ValueError:
+            logging.error(f"Invalid due_date for user {user_id}: {data['due_date']}")
+    if chat_id == SUPREME_GROUP_ID and data.get('mentorship_type', 'regular').lower() != 'supreme':
+        return False, "not a Supreme member"
+    return True, None
+
+@bot.chat_join_request_handler(func=lambda join_request: join_request.chat.id in (PAID_GROUP_ID, SUPREME_GROUP_ID))
+def handle_group_join_request(join_request):
+    """Approve join requests to the paid groups from active members, decline the rest"""
+    user_id = join_request.from_user.id
+    chat_id = join_request.chat.id
+    allowed, reason = group_access(user_id, chat_id)
+    
+    # Users who were just sent their invite may not be marked as paid yet
+    invite_link = join_request.invite_link.invite_link if join_request.invite_link else None
+    if not allowed and invite_link and invite_pool.issued_to(invite_link) == user_id:
+        allowed, reason = True, None
+    
+    try:
+        if allowed:
+            bot.approve_chat_join_request(chat_id, user_id)
+            reconcile.forget(user_id)
+            logging.info(f"Approved join request from user {user_id} to group {chat_id}")
+        else:
+            bot.decline_chat_join_request(chat_id, user_id)
+            logging.info(f"Declined join request from user {user_id} to group {chat_id}: {reason}")
+    except Exception as e:
+        logging.error(f"Error handling join request from user {user_id} to group {chat_id}: {e}")
+        return
+    
+    if not allowed:
+        try:
+            bot.send_message(
+                user_id,
+                "❌ *Join Request Declined*\n\n"
+                "We couldn't find an active membership for this group on your account.\n\n"
+                "Use /start to purchase or renew your membership.",
+                parse_mode="Markdown"
+            )
+        except Exception as e:
+            logging.error(f"Could not notify user {user_id} about declined join request: {e}")
+
 def can_renew_membership(user_id):
     """Check if user can renew their membership based on expiration date"""
     user_id_str = str(user_id)
@@ -5363,8 +5269,16 @@ def process_serial_number(message):
     user_id = message.from_user.id
     serial = message.text.strip()
     
+    # Check and claim the serial in one step so two users can't redeem it at once
+    with SERIAL_NUMBERS.locked(serial) as serial_data:
+        already_used = serial_data is not None and serial_data.get('used', False)
+        if serial_data is not None and not already_used:
+            serial_data['used'] = True
+            serial_data['used_by'] = user_id
+            serial_data['used_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    
     # Check if the serial number exists in our database
-    if serial not in SERIAL_NUMBERS:
+    if serial_data is None:
         bot.send_message(
             chat_id,
             "❌ Invalid serial number. Please check and try again, or contact support if you believe this is an error.",
@@ -5373,7 +5287,7 @@ def process_serial_number(message):
         return
     
     # Check if the serial has already been used
-    if SERIAL_NUMBERS[serial].get('used', False):
+    if already_used:
         bot.send_message(
             chat_id,
             "❌ This serial number has already been used. Each serial can only be redeemed once.",
@@ -5410,10 +5324,7 @@ def process_serial_number(message):
     else:
         due_date = datetime.now() + timedelta(days=30)  # Default to 1 month
     
-    # Mark the serial as used
-    SERIAL_NUMBERS[serial]['used'] = True
-    SERIAL_NUMBERS[serial]['used_by'] = user_id
-    SERIAL_NUMBERS[serial]['used_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # Persist the claim made above
     save_serial_number(serial, SERIAL_NUMBERS[serial])
     
     # Save user membership data
@@ -5791,14 +5702,13 @@ def request_payment_proof(message):
     save_pending_users()
     bot.send_message(chat_id, "📸 Please upload a screenshot of your payment proof.")
 
-# Handle Screenshot Upload
+# Photos that no flow step is waiting for
 @bot.message_handler(content_types=['photo'])
-def handle_payment_screenshot(message):
+def handle_unexpected_photo(message):
     if message.chat.type != 'private':
         return  # Ignore if not in private chat
     
     user_id = message.from_user.id
-    chat_id = message.chat.id
     
     # First check if user is in confession mode - if so, skip this handler
     if user_id in USERS_CONFESSING and USERS_CONFESSING[user_id]['status'] == 'awaiting_confession':
@@ -5812,72 +5722,59 @@ def handle_payment_screenshot(message):
         handle_announcement_message(message)
         return
 
-    # Add new condition for awaiting XM account screenshot
-    if user_id in PENDING_USERS and PENDING_USERS[user_id].get('status') == 'xm_awaiting_account_screenshot':
-        # Store screenshot details
-        PENDING_USERS[user_id]['screenshot_message_id'] = message.message_id
-        PENDING_USERS[user_id]['status'] = 'xm_awaiting_account_id'
-        save_pending_users()
-        
-        # Ask for account ID
-        bot.send_message(
-            chat_id,
-            "📝 *XM Account ID*\n\n"
-            "Thank you for the screenshot. Now, please provide your XM Trading Account ID:",
-            parse_mode="Markdown"
-        )
-        return
+    bot.send_message(message.chat.id, "❌ Please start verification with `/verify`.")
+
+# Handle XM verification screenshot
+@flows.step('xm', 'xm_awaiting_screenshot', content_types=['photo'], transitions=['xm_waiting_approval'])
+def handle_xm_verification_screenshot(message):
+    user_id = message.from_user.id
+    chat_id = message.chat.id
     
-    # Check if waiting for XM screenshot
-    if user_id in PENDING_USERS and PENDING_USERS[user_id].get('status') == 'xm_awaiting_screenshot':
-        # Handle XM verification screenshot
-        username = message.from_user.username or "No Username"
-        if username != "No Username":
-            username = re.sub(r'([_*[\]()~`>#\+\-=|{}.!])', r'\\\1', username)
+    # Handle XM verification screenshot
+    username = message.from_user.username or "No Username"
+    if username != "No Username":
+        username = re.sub(r'([_*[\]()~`>#\+\-=|{}.!])', r'\\\1', username)
+    
+    # Forward screenshot to admins WITH enhanced context and inline buttons
+    for admin in ADMIN_IDS:
+        # Forward the actual screenshot
+        bot.forward_message(admin, chat_id, message.message_id)
         
-        # Forward screenshot to admins WITH enhanced context and inline buttons
-        for admin in ADMIN_IDS:
-            # Forward the actual screenshot
-            bot.forward_message(admin, chat_id, message.message_id)
-            
-            # Send explanatory message with verification buttons
-            markup = InlineKeyboardMarkup()
-            markup.add(
-                InlineKeyboardButton("✅ Approve XM", callback_data=f"approve_xm_{user_id}"),
-                InlineKeyboardButton("❌ Reject XM", callback_data=f"reject_xm_{user_id}")
-            )
+        # Send explanatory message with verification buttons
+        markup = InlineKeyboardMarkup()
+        markup.add(
+            InlineKeyboardButton("✅ Approve XM", callback_data=f"approve_xm_{user_id}"),
+            InlineKeyboardButton("❌ Reject XM", callback_data=f"reject_xm_{user_id}")
+        )
 
-            bot.send_message(
-                admin,
-                f"🔔 *XM Partnership Verification Request:*\n\n"
-                f"User @{username} (ID: `{user_id}`) has submitted a screenshot showing their XM account with partner code.\n\n"
-                f"Please verify that:\n"
-                f"• The partner code PTAPARTNER is correctly applied\n"
-                f"• The screenshot is from a valid XM account\n\n"
-                f"Then approve or reject this verification request.",
-                reply_markup=markup,
-                parse_mode="Markdown"
-            )
-        
-        # Update user status
-        PENDING_USERS[user_id]['status'] = 'xm_waiting_approval'
-        save_pending_users()
-        
-        # Send confirmation message to user
         bot.send_message(
-            chat_id,
-            "✅ *XM Verification Submitted*\n\n"
-            "Your XM account verification screenshot has been sent to our admins for review.\n\n"
-            "You will be notified once your verification is approved or rejected.",
+            admin,
+            f"🔔 *XM Partnership Verification Request:*\n\n"
+            f"User @{username} (ID: `{user_id}`) has submitted a screenshot showing their XM account with partner code.\n\n"
+            f"Please verify that:\n"
+            f"• The partner code PTAPARTNER is correctly applied\n"
+            f"• The screenshot is from a valid XM account\n\n"
+            f"Then approve or reject this verification request.",
+            reply_markup=markup,
             parse_mode="Markdown"
         )
-        return
     
-    # Otherwise, continue with original payment verification logic
-    if chat_id not in PENDING_USERS or PENDING_USERS[chat_id]['status'] != 'awaiting_proof':
-        bot.send_message(chat_id, "❌ Please start verification with `/verify`.")
-        return
+    # Update user status
+    flows.advance(user_id, 'xm_waiting_approval')
+    
+    # Send confirmation message to user
+    bot.send_message(
+        chat_id,
+        "✅ *XM Verification Submitted*\n\n"
+        "Your XM account verification screenshot has been sent to our admins for review.\n\n"
+        "You will be notified once your verification is approved or rejected.",
+        parse_mode="Markdown"
+    )
 
+# Handle Screenshot Upload
+@flows.step('payment', 'awaiting_proof', content_types=['photo'], transitions=['waiting_approval'])
+def handle_payment_screenshot(message):
+    chat_id = message.chat.id
     user_id = message.from_user.id
     username = message.from_user.username or "No Username"
     
@@ -5902,9 +5799,9 @@ def handle_payment_screenshot(message):
         fee_percentage = PAYMENT_FEES.get(method, 0.0)
         
         if fee_percentage > 0:
-            # Apply fee to the already-discounted price
-            adjusted_price_usd = price_usd * (1 + fee_percentage/100)
-            adjusted_price = f"${adjusted_price_usd:.2f}"
+            # Fee on the already-discounted price, as quoted at payment method selection
+            quote = pending_quote(PENDING_USERS[chat_id], fee_percentage)
+            adjusted_price = pricing.usd(quote.final) if quote else f"${price_usd * (1 + fee_percentage/100):.2f}"
             
             # Create complete price display showing both discount and fee if applicable
             if discount_applied:
@@ -5950,35 +5847,10 @@ def handle_payment_screenshot(message):
         price_usd = PENDING_USERS[chat_id].get('price_usd', 0)  # Base price
         fee_adjusted_price = PENDING_USERS[chat_id].get('final_price_usd', price_usd)  # With payment fee if applicable
 
-        exchange_rates = get_exchange_rates()
-
         currency_info = ""
-        if exchange_rates:
-            currency_info = "\n\n💱 *Currency Equivalents*:\n"
-            
-            # Define currency symbols for better display
-            currency_symbols = {
-                'USD': '$', 'GBP': '£', 'EUR': '€', 'IDR': 'Rp', 'PHP': '₱'
-            }
-            
-            for currency, rate in exchange_rates.items():
-                if currency == 'USD':
-                    continue  # Skip USD as it's already shown
-                
-                # Calculate equivalent price in this currency
-                equivalent_price = fee_adjusted_price * rate
-                
-                symbol = currency_symbols.get(currency, '')
-                
-                # Format based on currency
-                if currency in ['IDR', 'PHP']:
-                    formatted_price = f"{symbol}{equivalent_price:,.0f}"
-                else:
-                    # For currencies like GBP and EUR, always use .99 ending for consistent pricing
-                    whole_price = int(equivalent_price)
-                    formatted_price = f"{symbol}{whole_price}.99"
-                
-                currency_info += f"• *{currency}*: {formatted_price}\n"
+        equivalents = pricing.equivalents(fee_adjusted_price)
+        if equivalents:
+            currency_info = "\n\n💱 *Currency Equivalents*:\n" + equivalents
 
         bot.send_message(admin,
             f"🔔 *Payment Request:*\n"
@@ -5993,10 +5865,7 @@ def handle_payment_screenshot(message):
             parse_mode="Markdown"
         )
 
-    PENDING_USERS[chat_id]['status'] = 'waiting_approval'
-    PENDING_USERS[chat_id]['request_time'] = datetime.now()  # Add timestamp
-    delete_pending_user(user_id)
-    save_pending_users()
+    flows.advance(chat_id, 'waiting_approval', {'request_time': datetime.now()})  # Add timestamp
     bot.send_message(chat_id, random.choice(payment_review_messages), parse_mode="Markdown")
 
 # Admin Approves Payment
@@ -6299,14 +6168,12 @@ def send_onboarding_form(user_id):
 
 # REGULAR MEMBERSHIP FORM HANDLERS
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_regular_step1')
+@flows.step('onboarding_regular', 'onboarding_form_regular_step1', transitions=['onboarding_form_regular_step2'])
 def handle_regular_form_step1(message):
     user_id = message.from_user.id
     
     # Store the answer - this is the full name question
-    PENDING_USERS[user_id]['form_answers']['full_name'] = message.text
-    PENDING_USERS[user_id]['status'] = 'onboarding_form_regular_step2'
-    save_pending_users()
+    flows.advance(user_id, 'onboarding_form_regular_step2', {'form_answers.full_name': message.text})
     
     # Show typing indicator
     bot.send_chat_action(user_id, 'typing')
@@ -6319,7 +6186,7 @@ def handle_regular_form_step1(message):
         parse_mode="Markdown"
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_regular_step2')
+@flows.step('onboarding_regular', 'onboarding_form_regular_step2', transitions=['onboarding_form_regular_step2_confirm'])
 def handle_regular_form_step2(message):
     user_id = message.from_user.id
     birthday_input = message.text
@@ -6347,9 +6214,7 @@ def handle_regular_form_step2(message):
             return
         
         # Store the birthday temporarily and move to confirmation step
-        PENDING_USERS[user_id]['temp_birthday'] = birthday_input
-        PENDING_USERS[user_id]['status'] = 'onboarding_form_regular_step2_confirm'
-        save_pending_users()
+        flows.advance(user_id, 'onboarding_form_regular_step2_confirm', {'temp_birthday': birthday_input})
         
         # Format the date in a human-readable format for confirmation
         formatted_date = birthday_date.strftime("%B %d, %Y")  # Format as "June 15, 1990"
@@ -6373,7 +6238,7 @@ def handle_regular_form_step2(message):
         )
 
 # Add a new handler for the birthday confirmation step
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_regular_step2_confirm')
+@flows.step('onboarding_regular', 'onboarding_form_regular_step2_confirm', transitions=['onboarding_form_regular_step2', 'onboarding_form_regular_step3'])
 def handle_regular_form_step2_confirm(message):
     user_id = message.from_user.id
     response = message.text.lower()
@@ -6385,16 +6250,8 @@ def handle_regular_form_step2_confirm(message):
         # Get the temporary birthday we stored
         birthday = PENDING_USERS[user_id].get('temp_birthday')
         
-        # Store the answer in form_answers
-        PENDING_USERS[user_id]['form_answers']['birthday'] = birthday
-        
-        # Remove temporary birthday storage
-        if 'temp_birthday' in PENDING_USERS[user_id]:
-            del PENDING_USERS[user_id]['temp_birthday']
-        
-        # Move to step 3
-        PENDING_USERS[user_id]['status'] = 'onboarding_form_regular_step3'
-        save_pending_users()
+        # Store the answer, drop the temporary copy and move to step 3
+        flows.advance(user_id, 'onboarding_form_regular_step3', {'form_answers.birthday': birthday}, unset=['temp_birthday'])
         
         # Show typing indicator
         bot.send_chat_action(user_id, 'typing')
@@ -6419,8 +6276,7 @@ def handle_regular_form_step2_confirm(message):
         )
     else:
         # User wants to re-enter the birthday
-        PENDING_USERS[user_id]['status'] = 'onboarding_form_regular_step2'
-        save_pending_users()
+        flows.advance(user_id, 'onboarding_form_regular_step2')
         
         # Remove keyboard
         markup = ReplyKeyboardRemove()
@@ -6432,14 +6288,12 @@ def handle_regular_form_step2_confirm(message):
             reply_markup=markup
         )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_regular_step3')
+@flows.step('onboarding_regular', 'onboarding_form_regular_step3', transitions=['onboarding_form_regular_step4'])
 def handle_regular_form_step3(message):
     user_id = message.from_user.id
     
     # Store the answer - this is the experience level
-    PENDING_USERS[user_id]['form_answers']['experience_level'] = message.text
-    PENDING_USERS[user_id]['status'] = 'onboarding_form_regular_step4'
-    save_pending_users()
+    flows.advance(user_id, 'onboarding_form_regular_step4', {'form_answers.experience_level': message.text})
     
     # Show typing indicator
     bot.send_chat_action(user_id, 'typing')
@@ -6465,14 +6319,12 @@ def handle_regular_form_step3(message):
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_regular_step4')
+@flows.step('onboarding_regular', 'onboarding_form_regular_step4', transitions=['onboarding_form_regular_step5'])
 def handle_regular_form_step4(message):
     user_id = message.from_user.id
     
     # Store the answer - this is what they hope to learn
-    PENDING_USERS[user_id]['form_answers']['learning_goals'] = message.text
-    PENDING_USERS[user_id]['status'] = 'onboarding_form_regular_step5'
-    save_pending_users()
+    flows.advance(user_id, 'onboarding_form_regular_step5', {'form_answers.learning_goals': message.text})
     
     # Show typing indicator
     bot.send_chat_action(user_id, 'typing')
@@ -6497,12 +6349,12 @@ def handle_regular_form_step4(message):
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_regular_step5')
+@flows.step('onboarding_regular', 'onboarding_form_regular_step5', transitions=['completed_onboarding'])
 def handle_regular_form_step5(message):
     user_id = message.from_user.id
     
     # Store the answer - this is how they found PTA
-    PENDING_USERS[user_id]['form_answers']['source'] = message.text
+    flows.record(user_id, {'form_answers.source': message.text})
     
     # Remove custom keyboard
     markup = ReplyKeyboardRemove()
@@ -6554,14 +6406,12 @@ def handle_regular_form_step5(message):
 
 # SUPREME MEMBERSHIP FORM HANDLERS
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_supreme_step1')
+@flows.step('onboarding_supreme', 'onboarding_form_supreme_step1', transitions=['onboarding_form_supreme_step2'])
 def handle_supreme_form_step1(message):
     user_id = message.from_user.id
     
     # Store the answer - this is the full name question
-    PENDING_USERS[user_id]['form_answers']['full_name'] = message.text
-    PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step2'
-    save_pending_users()
+    flows.advance(user_id, 'onboarding_form_supreme_step2', {'form_answers.full_name': message.text})
     
     # Show typing indicator
     bot.send_chat_action(user_id, 'typing')
@@ -6574,7 +6424,7 @@ def handle_supreme_form_step1(message):
         parse_mode="Markdown"
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_supreme_step2')
+@flows.step('onboarding_supreme', 'onboarding_form_supreme_step2', transitions=['onboarding_form_supreme_step2_confirm'])
 def handle_supreme_form_step2(message):
     user_id = message.from_user.id
     birthday_input = message.text
@@ -6602,9 +6452,7 @@ def handle_supreme_form_step2(message):
             return
         
         # Store the birthday temporarily and move to confirmation step
-        PENDING_USERS[user_id]['temp_birthday'] = birthday_input
-        PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step2_confirm'
-        save_pending_users()
+        flows.advance(user_id, 'onboarding_form_supreme_step2_confirm', {'temp_birthday': birthday_input})
         
         # Format the date in a human-readable format for confirmation
         formatted_date = birthday_date.strftime("%B %d, %Y")  # Format as "June 15, 1990"
@@ -6628,7 +6476,7 @@ def handle_supreme_form_step2(message):
         )
 
 # Add a new handler for the birthday confirmation step
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_supreme_step2_confirm')
+@flows.step('onboarding_supreme', 'onboarding_form_supreme_step2_confirm', transitions=['onboarding_form_supreme_step2', 'onboarding_form_supreme_step3'])
 def handle_supreme_form_step2_confirm(message):
     user_id = message.from_user.id
     response = message.text.lower()
@@ -6640,16 +6488,8 @@ def handle_supreme_form_step2_confirm(message):
         # Get the temporary birthday we stored
         birthday = PENDING_USERS[user_id].get('temp_birthday')
         
-        # Store the answer in form_answers
-        PENDING_USERS[user_id]['form_answers']['birthday'] = birthday
-        
-        # Remove temporary birthday storage
-        if 'temp_birthday' in PENDING_USERS[user_id]:
-            del PENDING_USERS[user_id]['temp_birthday']
-        
-        # Move to step 3
-        PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step3'
-        save_pending_users()
+        # Store the answer, drop the temporary copy and move to step 3
+        flows.advance(user_id, 'onboarding_form_supreme_step3', {'form_answers.birthday': birthday}, unset=['temp_birthday'])
         
         # Show typing indicator
         bot.send_chat_action(user_id, 'typing')
@@ -6667,8 +6507,7 @@ def handle_supreme_form_step2_confirm(message):
         )
     else:
         # User wants to re-enter the birthday
-        PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step2'
-        save_pending_users()
+        flows.advance(user_id, 'onboarding_form_supreme_step2')
         
         # Remove keyboard
         markup = ReplyKeyboardRemove()
@@ -6680,15 +6519,13 @@ def handle_supreme_form_step2_confirm(message):
             reply_markup=markup
         )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_supreme_step3')
+@flows.step('onboarding_supreme', 'onboarding_form_supreme_step3', transitions=['onboarding_form_supreme_step4'])
 def handle_supreme_form_step3(message):
     user_id = message.from_user.id
     phone = message.text
     
     # Store the answer - this is the phone number
-    PENDING_USERS[user_id]['form_answers']['phone_number'] = phone
-    PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step4'
-    save_pending_users()
+    flows.advance(user_id, 'onboarding_form_supreme_step4', {'form_answers.phone_number': phone})
     
     # Show typing indicator
     bot.send_chat_action(user_id, 'typing')
@@ -6707,7 +6544,7 @@ def handle_supreme_form_step3(message):
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_supreme_step4')
+@flows.step('onboarding_supreme', 'onboarding_form_supreme_step4', transitions=['onboarding_form_supreme_step4_custom', 'onboarding_form_supreme_step5'])
 def handle_supreme_form_step4(message):
     user_id = message.from_user.id
     timezone = message.text
@@ -6715,8 +6552,7 @@ def handle_supreme_form_step4(message):
     # Check if the user selected "Other (please specify)"
     if timezone == "Other (please specify)":
         # Set a different status for custom timezone entry
-        PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step4_custom'
-        save_pending_users()
+        flows.advance(user_id, 'onboarding_form_supreme_step4_custom')
         
         # Show typing indicator
         bot.send_chat_action(user_id, 'typing')
@@ -6732,9 +6568,7 @@ def handle_supreme_form_step4(message):
     
     # Regular flow for predefined options
     # Store the answer - this is the time zone
-    PENDING_USERS[user_id]['form_answers']['time_zone'] = timezone
-    PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step5'
-    save_pending_users()
+    flows.advance(user_id, 'onboarding_form_supreme_step5', {'form_answers.time_zone': timezone})
     
     # Show typing indicator
     bot.send_chat_action(user_id, 'typing')
@@ -6761,15 +6595,13 @@ def handle_supreme_form_step4(message):
     )
 
 # Add a new handler for custom timezone entry
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_supreme_step4_custom')
+@flows.step('onboarding_supreme', 'onboarding_form_supreme_step4_custom', transitions=['onboarding_form_supreme_step5'])
 def handle_supreme_form_step4_custom(message):
     user_id = message.from_user.id
     custom_timezone = message.text
     
     # Store the answer - this is the custom time zone
-    PENDING_USERS[user_id]['form_answers']['time_zone'] = f"Custom: {custom_timezone}"
-    PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step5'
-    save_pending_users()
+    flows.advance(user_id, 'onboarding_form_supreme_step5', {'form_answers.time_zone': f"Custom: {custom_timezone}"})
     
     # Show typing indicator
     bot.send_chat_action(user_id, 'typing')
@@ -6795,15 +6627,13 @@ def handle_supreme_form_step4_custom(message):
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_supreme_step5')
+@flows.step('onboarding_supreme', 'onboarding_form_supreme_step5', transitions=['onboarding_form_supreme_step6'])
 def handle_supreme_form_step5(message):
     user_id = message.from_user.id
     expertise = message.text
     
     # Store the answer - this is the trading expertise level
-    PENDING_USERS[user_id]['form_answers']['expertise_level'] = expertise
-    PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step6'
-    save_pending_users()
+    flows.advance(user_id, 'onboarding_form_supreme_step6', {'form_answers.expertise_level': expertise})
     
     # Show typing indicator
     bot.send_chat_action(user_id, 'typing')
@@ -6828,15 +6658,13 @@ def handle_supreme_form_step5(message):
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_supreme_step6')
+@flows.step('onboarding_supreme', 'onboarding_form_supreme_step6', transitions=['onboarding_form_supreme_step7'])
 def handle_supreme_form_step6(message):
     user_id = message.from_user.id
     trading_time = message.text
     
     # Store the answer - this is the part-time vs. full-time answer
-    PENDING_USERS[user_id]['form_answers']['trading_time_commitment'] = trading_time
-    PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step7'
-    save_pending_users()
+    flows.advance(user_id, 'onboarding_form_supreme_step7', {'form_answers.trading_time_commitment': trading_time})
     
     # Show typing indicator
     bot.send_chat_action(user_id, 'typing')
@@ -6862,15 +6690,13 @@ def handle_supreme_form_step6(message):
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_supreme_step7')
+@flows.step('onboarding_supreme', 'onboarding_form_supreme_step7', transitions=['onboarding_form_supreme_step8'])
 def handle_supreme_form_step7(message):
     user_id = message.from_user.id
     interest_reason = message.text
     
     # Store the answer - interest in supreme mentorship
-    PENDING_USERS[user_id]['form_answers']['interest_reason'] = interest_reason
-    PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step8'
-    save_pending_users()
+    flows.advance(user_id, 'onboarding_form_supreme_step8', {'form_answers.interest_reason': interest_reason})
     
     # Show typing indicator
     bot.send_chat_action(user_id, 'typing')
@@ -6883,15 +6709,13 @@ def handle_supreme_form_step7(message):
         parse_mode="Markdown"
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_supreme_step8')
+@flows.step('onboarding_supreme', 'onboarding_form_supreme_step8', transitions=['onboarding_form_supreme_step9'])
 def handle_supreme_form_step8(message):
     user_id = message.from_user.id
     goals = message.text
     
     # Store the answer - personal goals
-    PENDING_USERS[user_id]['form_answers']['personal_goals'] = goals
-    PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step9'
-    save_pending_users()
+    flows.advance(user_id, 'onboarding_form_supreme_step9', {'form_answers.personal_goals': goals})
     
     # Show typing indicator
     bot.send_chat_action(user_id, 'typing')
@@ -6915,15 +6739,13 @@ def handle_supreme_form_step8(message):
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_supreme_step9')
+@flows.step('onboarding_supreme', 'onboarding_form_supreme_step9', transitions=['onboarding_form_supreme_step10'])
 def handle_supreme_form_step9(message):
     user_id = message.from_user.id
     call_preference = message.text
     
     # Store the answer - 1:1 call preference
-    PENDING_USERS[user_id]['form_answers']['call_preference'] = call_preference
-    PENDING_USERS[user_id]['status'] = 'onboarding_form_supreme_step10'
-    save_pending_users()
+    flows.advance(user_id, 'onboarding_form_supreme_step10', {'form_answers.call_preference': call_preference})
     
     # Show typing indicator
     bot.send_chat_action(user_id, 'typing')
@@ -6950,13 +6772,13 @@ def handle_supreme_form_step9(message):
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: PENDING_USERS.get(message.from_user.id, {}).get('status') == 'onboarding_form_supreme_step10')
+@flows.step('onboarding_supreme', 'onboarding_form_supreme_step10', transitions=['completed_onboarding'])
 def handle_supreme_form_step10(message):
     user_id = message.from_user.id
     challenges = message.text
     
     # Store the answer
-    PENDING_USERS[user_id]['form_answers']['challenges'] = challenges
+    flows.record(user_id, {'form_answers.challenges': challenges})
     
     # Remove custom keyboard
     markup = ReplyKeyboardRemove()
@@ -7009,6 +6831,40 @@ def handle_supreme_form_step10(message):
     # Now proceed with the welcome package and group invite
     complete_onboarding(user_id)
 
+def save_completed_form(user_id, form_answers):
+    """Copy finished onboarding answers to the member record and close the form in one transaction"""
+    user_id_str = str(user_id)
+    completed = {
+        'form_answers': form_answers,
+        'form_completion_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        # IMPORTANT FIX: Remove the forms_needed flag after completion
+        'forms_needed': False
+    }
+    is_member = user_id_str in PAYMENT_DATA
+    if is_member:
+        PAYMENT_DATA.update_fields(user_id_str, completed)
+    # None when the pending record has other unsaved changes and has to be written in full
+    pending_update = PENDING_USERS.set_fields(user_id, {'status': 'completed_onboarding'})
+
+    def write(session):
+        if is_member:
+            payment_collection.update_one(
+                {'_id': user_id_str},
+                {'$set': {**completed, 'last_updated': completed['form_completion_date']}},
+                session=session
+            )
+        if pending_update is not None:
+            pending_collection.update_one({'_id': user_id_str}, pending_update, session=session)
+
+    try:
+        database.run_transaction(write)
+        logging.info(f"Form responses saved to PAYMENT_DATA for user {user_id}")
+    except Exception as e:
+        PENDING_USERS.mark_dirty(user_id)
+        logging.error(f"MongoDB error saving form responses for user {user_id}: {e}")
+    if pending_update is None:
+        save_pending_users()
+
 def complete_onboarding(user_id):
     """Complete the onboarding process by sending welcome package and group invite"""
     try:
@@ -7073,19 +6929,10 @@ def complete_onboarding(user_id):
             if not invite_link:
                 try:
                     # Generate a new invite link - explicitly note it's a ChatInviteLink object
-                    new_invite: ChatInviteLink = bot.create_chat_invite_link(
-                        target_group_id,
-                        name=f"User {user_id} onboarding",
-                        creates_join_request=False,
-                        member_limit=1,
-                        expire_date=int((datetime.now() + timedelta(minutes=15)).timestamp())
-                    )
-                    invite_link = new_invite.invite_link
+                    invite_link = invite_pool.take_invite_link(target_group_id, name=f"User {user_id} onboarding", user_id=user_id)
                     
                     # Save the new invite link
-                    PENDING_USERS[user_id]['invite_link'] = invite_link
-                    PENDING_USERS[user_id]['target_group_id'] = target_group_id
-                    save_pending_users()
+                    update_pending_user(user_id, {'invite_link': invite_link, 'target_group_id': target_group_id})
                     
                     logging.info(f"Generated new invite link for user {user_id} joining group {target_group_id}")
                 except Exception as e:
@@ -7161,17 +7008,8 @@ def complete_onboarding(user_id):
                     parse_mode="Markdown"
                 )
                 
-                # Set up delayed link revocation with longer timeout
-                def revoke_link_later(chat_id, invite_link, admin_ids):
-                    time.sleep(60)  # Wait 60 seconds before revoking
-                    try:
-                        bot.revoke_chat_invite_link(chat_id, invite_link)
-                        for admin_id in admin_ids:
-                            pass
-                    except Exception as e:
-                        logging.error(f"⚠️ Failed to revoke invite link: {e}")
-
-                threading.Thread(target=revoke_link_later, args=(target_group_id, invite_link, ADMIN_IDS)).start()
+                # Revoke the link once its 60 seconds are up
+                invite_pool.revoke_later(target_group_id, invite_link, 60)
         
         # 3. Record user form responses for admin reference
         try:
@@ -7182,16 +7020,8 @@ def complete_onboarding(user_id):
             # Check if this is a renewal - if so, skip admin notifications
             is_renewal = PENDING_USERS[user_id].get('is_renewal', False)
             
-            # NEW: Save form responses to PAYMENT_DATA for persistence
-            user_id_str = str(user_id)
-            if user_id_str in PAYMENT_DATA:
-                # Add form answers to payment data
-                PAYMENT_DATA[user_id_str]['form_answers'] = form_answers
-                PAYMENT_DATA[user_id_str]['form_completion_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                # IMPORTANT FIX: Remove the forms_needed flag after completion
-                PAYMENT_DATA[user_id_str]['forms_needed'] = False
-                save_payment_data()  # Save to database
-                logging.info(f"Form responses saved to PAYMENT_DATA for user {user_id}")
+            # NEW: Save form responses to PAYMENT_DATA for persistence, closing the form with the same write
+            save_completed_form(user_id, form_answers)
             
             # Only send admin notifications if this is NOT a renewal
             if not is_renewal:
@@ -7273,9 +7103,10 @@ def complete_onboarding(user_id):
         )
         
         # 4. Clean up pending user data - THIS IS THE IMPORTANT CHANGE
-        # Instead of deleting the user, set a completed status
-        PENDING_USERS[user_id]['status'] = 'completed_onboarding'
-        save_pending_users()
+        # Instead of deleting the user, set a completed status (normally already
+        # done when the form answers were saved)
+        if pending_status(user_id) != 'completed_onboarding':
+            update_pending_user(user_id, {'status': 'completed_onboarding'})
         
     except Exception as e:
         logging.error(f"Error in complete_onboarding for user {user_id}: {e}")
@@ -7592,6 +7423,7 @@ def send_payment_reminder():
     
     while True:
         try:
+            heartbeat.beat('payment_reminder', max_runtime=3600)
             # Get current time in Philippines timezone
             now = datetime.now(pytz.timezone('Asia/Manila'))
             current_time = now.strftime('%H:%M')
@@ -7738,6 +7570,7 @@ def send_payment_reminder():
                             
                             try:
                                 # Send reminder to user
+                                unreachable.ensure_reachable(user_id, 'payment_reminders')
                                 bot.send_chat_action(user_id, 'typing')
                                 user_msg = bot.send_message(
                                     user_id, 
@@ -7854,6 +7687,7 @@ def send_payment_reminder():
                                     admin_messages[admin_id] = admin_msg.message_id
                             try:
                                 # Send expiry notice to user
+                                unreachable.ensure_reachable(user_id, 'payment_reminders')
                                 bot.send_chat_action(user_id, 'typing')
                                 user_msg = bot.send_message(
                                     user_id, 
@@ -7940,11 +7774,13 @@ def send_payment_reminder():
             # Calculate the time to sleep until the start of the next minute
             now = datetime.now(pytz.timezone('Asia/Manila'))
             sleep_time = 60 - now.second - now.microsecond / 1_000_000
-            time.sleep(sleep_time)
+            heartbeat.success('payment_reminder')
+            heartbeat.sleep('payment_reminder', sleep_time)
             
         except Exception as e:
             logging.error(f"Error in payment reminder main loop: {e}")
-            time.sleep(60)  # Wait a minute on error before trying again
+            heartbeat.failure('payment_reminder', e)
+            heartbeat.sleep('payment_reminder', 60)  # Wait a minute on error before trying again
 
 def safe_markdown_escape_v2(text):
     """Comprehensive and reliable function to escape text for Telegram Markdown V2"""
@@ -8527,6 +8363,7 @@ def handle_action_cancellation(call):
         bot.answer_callback_query(call.id, "❌ Error cancelling action", show_alert=True)
 
 
+@metrics.timed_job('delete_all_reminders')
 def delete_all_reminders():
     """Function to delete all payment reminder messages at midnight."""
     logging.info("Midnight cleanup: Deleting all payment reminder messages")
@@ -8603,6 +8440,7 @@ def midnight_cleanup_thread():
     
     while True:
         try:
+            heartbeat.beat('midnight_cleanup')
             # Get current time in Philippines timezone
             now = datetime.now(pytz.timezone('Asia/Manila'))
             current_time = now.strftime('%H:%M')
@@ -8616,11 +8454,13 @@ def midnight_cleanup_thread():
             
             # Calculate the time to sleep until the start of the next minute
             sleep_time = 60 - now.second - now.microsecond / 1_000_000
-            time.sleep(sleep_time)
+            heartbeat.success('midnight_cleanup')
+            heartbeat.sleep('midnight_cleanup', sleep_time)
             
         except Exception as e:
             logging.error(f"Error in midnight cleanup thread: {e}")
-            time.sleep(60)  # Wait a minute on error before trying again
+            heartbeat.failure('midnight_cleanup', e)
+            heartbeat.sleep('midnight_cleanup', 60)  # Wait a minute on error before trying again
 
 @bot.message_handler(commands=['admin_dashboard'])
 def admin_dashboard(message):
@@ -8675,6 +8515,7 @@ def send_scheduled_gifs():
     logging.info(f"Starting GIF scheduler, last message ID: {last_message_id}")
     
     while True:
+        heartbeat.beat('scheduled_gifs')
         now = datetime.now(pytz.timezone('Asia/Manila'))
         current_time = now.strftime('%H:%M')
         
@@ -8724,7 +8565,8 @@ def send_scheduled_gifs():
         # Calculate the time to sleep until the start of the next minute
         now = datetime.now(pytz.timezone('Asia/Manila'))
         sleep_time = 60 - now.second - now.microsecond / 1_000_000
-        time.sleep(sleep_time)
+        heartbeat.success('scheduled_gifs')
+        heartbeat.sleep('scheduled_gifs', sleep_time)
 
 CREATOR_USERNAME = "FujiPTA" 
 
@@ -10536,6 +10378,7 @@ def enter_changelog(message):
         # Track successful and failed deliveries
         success_count = 0
         failed_count = 0
+        skipped_count = 0
         
         # Add a "last_changelog" field to track users who haven't seen latest changelog
         changelog_entry["seen_by"] = []
@@ -10543,6 +10386,9 @@ def enter_changelog(message):
         for user_id_str in PAYMENT_DATA:
             if not PAYMENT_DATA[user_id_str]['haspayed']:
                 continue
+            if unreachable.should_skip(user_id_str, 'changelog_broadcast'):
+                skipped_count += 1
+                continue
                 
             try:
                 user_id = int(user_id_str)
@@ -10571,7 +10417,8 @@ def enter_changelog(message):
         # Show delivery stats
         bot.send_message(
             chat_id, 
-            f"📊 Changelog Delivery Stats:\n✅ Successfully sent: {success_count}\n❌ Failed: {failed_count}"
+            f"📊 Changelog Delivery Stats:\n✅ Successfully sent: {success_count}\n❌ Failed: {failed_count}\n"
+            f"⏭️ Skipped (blocked the bot): {skipped_count}"
         )
         
         # Option to also post in group chat for maximum visibility
@@ -10855,6 +10702,7 @@ def remove_self_from_pending(message):
 def send_pending_request_reminders():
     while True:
         try:
+            heartbeat.beat('pending_request_reminders')
             current_time = datetime.now()
             
             for user_id, data in PENDING_USERS.items():
@@ -10953,41 +10801,160 @@ def send_pending_request_reminders():
                         save_pending_users()
             
             # Sleep for 1 minute before next check
-            time.sleep(60)
+            heartbeat.success('pending_request_reminders')
+            heartbeat.sleep('pending_request_reminders', 60)
             
         except Exception as e:
             logging.error(f"Error in pending request reminder thread: {e}")
-            time.sleep(60)  # Wait a minute on error before trying again
+            heartbeat.failure('pending_request_reminders', e)
+            heartbeat.sleep('pending_request_reminders', 60)  # Wait a minute on error before trying again
 
+def is_mongodb_available():
+    """Ping MongoDB to check whether it is reachable."""
+    try:
+        client.admin.command('ping')
+        return True
+    except Exception as e:
+        logging.warning(f"MongoDB is not reachable: {e}")
+        return False
+
+@metrics.timed_job('refresh_mongodb_data')
 def refresh_mongodb_data():
     """Refresh all data from MongoDB to ensure it's up to date."""
-    global PAYMENT_DATA, CONFIRMED_OLD_MEMBERS, PENDING_USERS, CHANGELOGS
+    global CONFIRMED_OLD_MEMBERS, CHANGELOGS
+    
+    # The snapshot we booted from is merged with MongoDB by reconcile_snapshot_state
+    if not SNAPSHOT_RECONCILED.is_set():
+        logging.info("Skipping MongoDB data refresh until the boot snapshot is reconciled")
+        return False
+    
+    # The loaders return empty collections on failure, so never swap the
+    # in-memory state for them while MongoDB is down
+    if not is_mongodb_available():
+        logging.warning("Skipping MongoDB data refresh - keeping in-memory data")
+        return False
     
     try:
-        PAYMENT_DATA = load_payment_data()
+        PAYMENT_DATA.replace(load_payment_data())
         
         CONFIRMED_OLD_MEMBERS = load_confirmed_old_members()
         
-        PENDING_USERS = load_pending_users()
+        PENDING_USERS.replace(load_pending_users())
         
         CHANGELOGS = load_changelogs()
         logging.info("MongoDB data refresh completed successfully")
+        return True
     except Exception as e:
         logging.error(f"Error refreshing MongoDB data: {e}")
+        return False
 
 def mongodb_refresh_thread():
     """Background thread to periodically refresh MongoDB data."""
     while True:
         try:
             # Sleep first to avoid immediate refresh after startup
-            time.sleep(1800)  # 30 minutes = 1800 seconds
+            heartbeat.sleep('mongodb_refresh', 1800)  # 30 minutes = 1800 seconds
+            heartbeat.beat('mongodb_refresh')
             
             # Refresh all data from MongoDB
             refresh_mongodb_data()
+            heartbeat.success('mongodb_refresh')
             
         except Exception as e:
             logging.error(f"Error in MongoDB refresh thread: {e}")
-            time.sleep(300)  # Wait 5 minutes on error before trying again
+            heartbeat.failure('mongodb_refresh', e)
+            heartbeat.sleep('mongodb_refresh', 300)  # Wait 5 minutes on error before trying again
+
+@metrics.timed_job('save_state_snapshot')
+def save_state_snapshot():
+    """Write the hot in-memory state to the local snapshot file."""
+    # Handler threads may mutate the dictionaries while they are being
+    # serialized, so retry a few times if that happens
+    for attempt in range(3):
+        try:
+            state = {
+                'payment_data': PAYMENT_DATA.snapshot(),
+                'pending_users': PENDING_USERS.snapshot(),
+                'settings': dict(BOT_SETTINGS),
+                'discounts': DISCOUNTS.snapshot()
+            }
+            return snapshot.write_snapshot(SNAPSHOT_PATH, state)
+        except RuntimeError as e:
+            logging.warning(f"State changed while snapshotting (attempt {attempt + 1}): {e}")
+            time.sleep(1)
+    return False
+
+def state_snapshot_thread():
+    """Background thread to periodically write the state snapshot."""
+    while True:
+        try:
+            heartbeat.sleep('state_snapshot', SNAPSHOT_INTERVAL)
+            heartbeat.beat('state_snapshot')
+            save_state_snapshot()
+            heartbeat.success('state_snapshot')
+        except Exception as e:
+            logging.error(f"Error in state snapshot thread: {e}")
+            heartbeat.failure('state_snapshot', e)
+
+def merge_boot_edits(current, loaded_payments, changed, deleted):
+    """Put member records changed or deleted in memory since the snapshot boot on top of MongoDB's data"""
+    merged = dict(loaded_payments)
+    for user_id, data in current.items():
+        if BOOT_PAYMENT_DATA.get(user_id) != data:
+            merged[user_id] = data
+            changed.append(user_id)
+    # Members removed since boot (cancelled, kicked, cleaned up) must not come back from MongoDB
+    for user_id in BOOT_PAYMENT_DATA.keys() - current.keys():
+        merged.pop(user_id, None)
+        deleted.append(user_id)
+    return merged
+
+def reconcile_snapshot_state():
+    """Merge snapshot-served state with MongoDB data once MongoDB is reachable."""
+    global BOT_SETTINGS, CONFESSION_TOPIC_ID, DAILY_CHALLENGE_TOPIC_ID
+    global ANNOUNCEMENT_TOPIC_ID, ACCOUNTABILITY_TOPIC_ID, LEADERBOARD_TOPIC_ID
+    global CONFIRMED_OLD_MEMBERS, CHANGELOGS, BOOT_PAYMENT_DATA
+    
+    retry_delay = 5
+    while True:
+        try:
+            if is_mongodb_available():
+                loaded_payments = load_payment_data()
+                loaded_pending = load_pending_users()
+                # The loaders return an empty dict on failure; don't merge edits onto that
+                if not loaded_payments and BOOT_PAYMENT_DATA:
+                    raise RuntimeError("MongoDB returned no payment records")
+                changed = []
+                deleted = []
+                PAYMENT_DATA.rebuild(lambda current: merge_boot_edits(current, loaded_payments, changed, deleted))
+                if deleted:
+                    payment_collection.delete_many({'_id': {'$in': deleted}})
+                kept = PENDING_USERS.replace_keeping_unsaved(loaded_pending)
+                CONFIRMED_OLD_MEMBERS = load_confirmed_old_members()
+                CHANGELOGS = load_changelogs()
+                BOOT_PAYMENT_DATA = None
+                SNAPSHOT_RECONCILED.set()
+                logging.info(f"Merged {len(changed)} member changes, {len(deleted)} member deletions and {kept} conversation changes made since the snapshot boot")
+                if changed:
+                    save_payment_data()
+                save_pending_users()
+                BOT_SETTINGS = load_settings()
+                DISCOUNTS.replace(load_discounts())
+                schedule_discount_expiries()
+                CONFESSION_TOPIC_ID = BOT_SETTINGS.get('confession_topic_id', None)
+                DAILY_CHALLENGE_TOPIC_ID = BOT_SETTINGS.get('daily_challenge_topic_id', None)
+                ANNOUNCEMENT_TOPIC_ID = BOT_SETTINGS.get('announcement_topic_id', None)
+                ACCOUNTABILITY_TOPIC_ID = BOT_SETTINGS.get('accountability_topic_id', None)
+                LEADERBOARD_TOPIC_ID = BOT_SETTINGS.get('leaderboard_topic_id', None)
+                logging.info(f"Reconciled snapshot state with MongoDB: {len(PAYMENT_DATA)} members, {len(PENDING_USERS)} pending users")
+                save_state_snapshot()
+                return
+        except Exception as e:
+            logging.error(f"Error reconciling snapshot state: {e}")
+        
+        logging.info(f"Retrying snapshot reconciliation in {retry_delay}s")
+        time.sleep(retry_delay)
+        retry_delay = min(retry_delay * 2, 300)
 
 # Define challenge content
 SELF_IMPROVEMENT_CHALLENGES = [
@@ -11061,6 +11028,7 @@ def send_daily_challenges():
     
     while True:
         try:
+            heartbeat.beat('daily_challenges')
             now = datetime.now(pytz.timezone('Asia/Manila'))
             current_time = now.strftime('%H:%M')
             current_date = now.strftime('%Y-%m-%d')
@@ -11128,11 +11096,13 @@ def send_daily_challenges():
             
             # Calculate the time to sleep until the start of the next minute
             sleep_time = 60 - now.second - now.microsecond / 1_000_000
-            time.sleep(sleep_time)
+            heartbeat.success('daily_challenges')
+            heartbeat.sleep('daily_challenges', sleep_time)
             
         except Exception as e:
             logging.error(f"Failed to send daily challenge or reminder: {e}")
-            time.sleep(60)  # Wait a minute on error before trying again
+            heartbeat.failure('daily_challenges', e)
+            heartbeat.sleep('daily_challenges', 60)  # Wait a minute on error before trying again
 
 # Command to set the daily challenge topic ID
 @bot.message_handler(commands=['setchallengetopic'])
@@ -11952,6 +11922,7 @@ def send_daily_leaderboard():
     
     while True:
         try:
+            heartbeat.beat('daily_leaderboard')
             now = datetime.now(pytz.timezone('Asia/Manila'))
             
             # Check if it's midnight (00:00) and we haven't sent a leaderboard today
@@ -12018,11 +11989,13 @@ def send_daily_leaderboard():
             
             # Sleep until the next minute
             sleep_time = 60 - now.second - now.microsecond / 1_000_000
-            time.sleep(sleep_time)
+            heartbeat.success('daily_leaderboard')
+            heartbeat.sleep('daily_leaderboard', sleep_time)
             
         except Exception as e:
             logging.error(f"Error sending leaderboard: {e}")
-            time.sleep(60)  # Wait for a minute before trying again
+            heartbeat.failure('daily_leaderboard', e)
+            heartbeat.sleep('daily_leaderboard', 60)  # Wait for a minute before trying again
 
 # Command handler for /setconfessiontopic
 @bot.message_handler(commands=['setconfessiontopic'])
@@ -12927,6 +12900,7 @@ def process_discount_custom_message(message):
         'user_limit': PENDING_USERS[user_id]['regular_user_limit'],
         'transaction_type': PENDING_USERS[user_id]['regular_transaction_type'],
         'users_used': [],
+        'redemptions': 0,
         'active': True,
         'custom_message': custom_message,
         'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
@@ -12941,6 +12915,7 @@ def process_discount_custom_message(message):
         'user_limit': PENDING_USERS[user_id]['supreme_user_limit'],
         'transaction_type': PENDING_USERS[user_id]['supreme_transaction_type'],
         'users_used': [],
+        'redemptions': 0,
         'active': True,
         'custom_message': custom_message,
         'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
@@ -13139,57 +13114,92 @@ def get_transaction_note(transaction_type):
         return "🔄 *Available for membership renewals only*"
     return ""  # Empty for "both"
 
-# Update the discount expiry check function to handle both discount types
-def check_discount_expiry():
-    """Check if the current discounts have expired and remove them if needed"""
-    global DISCOUNTS
-    
+def discount_end_date(discount):
+    """Return when a discount ends, as a Manila-time aware datetime"""
+    naive_end_date = datetime.strptime(discount.get('end_date'), '%Y-%m-%d %H:%M:%S')
+    return pytz.timezone('Asia/Manila').localize(naive_end_date)
+
+def schedule_discount_expiry(discount_type, discount):
+    """Replace the discount's expiry timer with one firing exactly at its end date"""
+    old_timer = DISCOUNT_EXPIRY_TIMERS.pop(discount_type, None)
+    if old_timer:
+        old_timer.cancel()
+    if not discount or not discount.get('active'):
+        return
+    try:
+        end_date = discount_end_date(discount)
+    except Exception as e:
+        logging.error(f"Error scheduling {discount_type} discount expiry: {e}")
+        return
+    delay = max(0.0, (end_date - datetime.now(pytz.utc)).total_seconds())
+    timer = threading.Timer(delay, expire_discount, args=(discount_type, discount.get('created_at'), discount.get('end_date')))
+    timer.daemon = True
+    timer.name = f"discount-expiry-{discount_type}"
+    DISCOUNT_EXPIRY_TIMERS[discount_type] = timer
+    timer.start()
+    logging.info(f"{discount_type.capitalize()} discount '{discount.get('name')}' will expire in {delay:.0f}s")
+
+def schedule_discount_expiries():
+    """Schedule expiry timers for every active discount, e.g. after loading them"""
     for discount_type in ['regular', 'supreme']:
-        discount = DISCOUNTS.get(discount_type)
-        if discount and discount.get('active'):
-            try:
-                # Parse the stored end date (naive datetime)
-                naive_end_date = datetime.strptime(discount.get('end_date'), '%Y-%m-%d %H:%M:%S')
-                
-                # Make it timezone-aware by adding Manila timezone
-                manila_tz = pytz.timezone('Asia/Manila')
-                end_date = manila_tz.localize(naive_end_date)
-                
-                # Compare with current time in Manila timezone
-                now = datetime.now(manila_tz)
-                
-                if now >= end_date:
-                    # Discount has expired
-                    old_discount = discount.copy()
-                    DISCOUNTS[discount_type] = None
-                    save_discount(None, discount_type)
-                    logging.info(f"{discount_type.capitalize()} discount '{old_discount.get('name')}' has expired and has been removed at {now.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-                    
-                    # Notify admins about expired discount
-                    for admin_id in ADMIN_IDS:
-                        try:
-                            bot.send_message(admin_id, 
-                                f"🕒 *{discount_type.capitalize()} Discount Expired*\n\n"
-                                f"The '{old_discount.get('name')}' discount ({old_discount.get('percentage')}% off) "
-                                f"for {discount_type.capitalize()} memberships has ended and has been automatically removed.\n\n"
-                                f"Expired at: {end_date.strftime('%Y-%m-%d %I:%M:%S %p')} Manila time",
-                                parse_mode="Markdown"
-                            )
-                        except Exception as e:
-                            logging.error(f"Failed to notify admin {admin_id} about expired discount: {e}")
-            except Exception as e:
-                logging.error(f"Error checking {discount_type} discount expiry: {e}")
+        schedule_discount_expiry(discount_type, DISCOUNTS.get(discount_type))
 
-def discount_expiry_thread():
-    """Thread to check for expired discounts"""
-    logging.info("Discount expiry check thread started")
-    while True:
+@metrics.timed_job('expire_discount')
+def expire_discount(discount_type, created_at, end_date_str):
+    """Remove a discount when its expiry timer fires, unless it was replaced since"""
+    with DISCOUNTS.lock_for(discount_type):
+        discount = DISCOUNTS.get(discount_type)
+        if not discount or discount.get('created_at') != created_at or discount.get('end_date') != end_date_str:
+            return
+        old_discount = discount.copy()
+        DISCOUNTS[discount_type] = None
+    save_discount(None, discount_type)
+    
+    end_date = discount_end_date(old_discount)
+    now = datetime.now(pytz.timezone('Asia/Manila'))
+    logging.info(f"{discount_type.capitalize()} discount '{old_discount.get('name')}' has expired and has been removed at {now.strftime('%Y-%m-%d %H:%M:%S %Z')}")
+    
+    # Notify admins about expired discount
+    for admin_id in ADMIN_IDS:
         try:
-            check_discount_expiry()
-            time.sleep(60)  # Check every minute
+            bot.send_message(admin_id, 
+                f"🕒 *{discount_type.capitalize()} Discount Expired*\n\n"
+                f"The '{old_discount.get('name')}' discount ({old_discount.get('percentage')}% off) "
+                f"for {discount_type.capitalize()} memberships has ended and has been automatically removed.\n\n"
+                f"Expired at: {end_date.strftime('%Y-%m-%d %I:%M:%S %p')} Manila time",
+                parse_mode="Markdown"
+            )
         except Exception as e:
-            logging.error(f"Error in discount expiry thread: {e}")
-            time.sleep(60)  # Wait a minute on error before trying again
+            logging.error(f"Failed to notify admin {admin_id} about expired discount: {e}")
+
+@bot.message_handler(commands=['membership_report'])
+def membership_report(message):
+    """Show members whose group presence disagrees with their membership"""
+    if message.from_user.id not in ADMIN_IDS and message.from_user.id != CREATOR_ID:
+        bot.reply_to(message, "❌ This command is only available to administrators.")
+        return
+    
+    report = reconcile.report()
+    group_names = {PAID_GROUP_ID: "Regular", SUPREME_GROUP_ID: "Supreme"}
+    
+    def describe(entries):
+        lines = []
+        for (user_id, chat_id), status in entries[:20]:
+            username = PAYMENT_DATA.get(str(user_id), {}).get('username') or "No Username"
+            lines.append(f"• {user_id} ({username}) - {group_names.get(chat_id, chat_id)}, {status}")
+        if len(entries) > 20:
+            lines.append(f"… and {len(entries) - 20} more")
+        return "\n".join(lines) or "None"
+    
+    bot.send_message(
+        message.chat.id,
+        f"👥 Group Membership Report\n\n"
+        f"In a group without an active membership ({len(report['expired_present'])}):\n"
+        f"{describe(report['expired_present'])}\n\n"
+        f"Paid but not in their group ({len(report['paid_absent'])}):\n"
+        f"{describe(report['paid_absent'])}\n\n"
+        f"Completed passes: {report['passes']} | Automatic removal: {'on' if reconcile.RECONCILE_AUTO_KICK else 'off'}"
+    )
 
 @bot.message_handler(commands=['export_forms'])
 def export_form_responses(message):
@@ -13877,8 +13887,7 @@ def export_payment_data(message):
         processing_msg = bot.reply_to(message, "📊 *Generating Payment Data Export*\n\nCollecting payment records and creating report...", parse_mode="Markdown")
         
         # ADDED: Refresh payment data from MongoDB before checking
-        global PAYMENT_DATA
-        PAYMENT_DATA = load_payment_data()
+        PAYMENT_DATA.replace(load_payment_data())
         
         # Check if there's any payment data to export
         if not PAYMENT_DATA:
@@ -14308,54 +14317,6 @@ def export_payment_data(message):
                              message_id=processing_msg.message_id)
         logging.error(f"Error in export_payment_data: {e}")
 
-def cleanup_inactive_pending_users():
-    """Clean up inactive pending users every 30 minutes, except those waiting for payment approval"""
-    logging.info("Pending users cleanup thread started")
-    
-    while True:
-        try:
-            # Sleep first to avoid immediate cleanup after startup
-            time.sleep(1800)  # 30 minutes
-            
-            # Get the current time for logging
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            # Track statistics for logging
-            users_before = len(PENDING_USERS)
-            removed_count = 0
-            preserved_count = 0
-            
-            # Create a copy of keys to avoid modifying dictionary during iteration
-            user_ids = list(PENDING_USERS.keys())
-            
-            for user_id in user_ids:
-                # Get user status
-                status = PENDING_USERS[user_id].get('status', '')
-                
-                # Preserve users waiting for payment approval
-                if status == 'waiting_approval':
-                    preserved_count += 1
-                    continue
-                
-                # Remove all other pending users
-                PENDING_USERS.pop(user_id, None)
-                delete_pending_user(user_id)  # Remove from MongoDB
-                removed_count += 1
-                
-            # Save changes
-            save_pending_users()
-            
-            # Log the cleanup results
-            users_after = len(PENDING_USERS)
-            logging.info(f"Pending users cleanup completed at {current_time}: "
-                        f"Removed {removed_count} inactive users, "
-                        f"preserved {preserved_count} users waiting for approval. "
-                        f"Users before: {users_before}, users after: {users_after}")
-            
-        except Exception as e:
-            logging.error(f"Error in pending users cleanup: {e}")
-            time.sleep(300)  # Wait 5 minutes on error before trying again
-
 @bot.message_handler(commands=['remove_all'])
 def remove_all_pending_users(message):
     """Manually remove all pending users except those waiting for payment approval"""
@@ -15920,7 +15881,7 @@ def handle_serial_callbacks(call):
             count = 0
             
             # Create a safe copy for iteration
-            serials_to_process = dict(SERIAL_NUMBERS)
+            serials_to_process = SERIAL_NUMBERS.snapshot()
             
             # Process each serial based on filter
             for serial, data in serials_to_process.items():
@@ -16226,6 +16187,7 @@ def handle_confirm_delete_serial(call):
         logging.error(f"Error deleting serial {serial}: {e}")
         bot.answer_callback_query(call.id, "Error deleting serial")
 
+@metrics.timed_job('send_birthday_greetings')
 def send_birthday_greetings():
     """Check for birthdays and send greetings to users"""
     logging.info("Running birthday greeting check")
@@ -16281,16 +16243,17 @@ def send_birthday_greetings():
                     
                     greeting = random.choice(greeting_templates)
                     
-                    # Send the greeting
-                    bot.send_message(
-                        user_id,
-                        greeting,
-                        parse_mode="Markdown"
-                    )
-                    
-                    # Log successful greeting
-                    logging.info(f"Birthday greeting sent to user {user_id} ({display_name})")
-                    greetings_sent += 1
+                    # Send the greeting, unless the user blocked the bot
+                    if not unreachable.should_skip(user_id, 'birthday_greetings'):
+                        bot.send_message(
+                            user_id,
+                            greeting,
+                            parse_mode="Markdown"
+                        )
+
+                        # Log successful greeting
+                        logging.info(f"Birthday greeting sent to user {user_id} ({display_name})")
+                        greetings_sent += 1
                     
                     # Optional: If you want to announce birthdays in the group
                     if ANNOUNCEMENT_TOPIC_ID:
@@ -16324,6 +16287,7 @@ def birthday_check_thread():
     
     while True:
         try:
+            heartbeat.beat('birthday_check')
             # Get current time in Manila timezone
             manila_tz = pytz.timezone('Asia/Manila')
             now = datetime.now(manila_tz)
@@ -16339,11 +16303,13 @@ def birthday_check_thread():
             
             # Calculate the time to sleep until the start of the next minute
             sleep_time = 60 - now.second - now.microsecond / 1_000_000
-            time.sleep(sleep_time)
+            heartbeat.success('birthday_check')
+            heartbeat.sleep('birthday_check', sleep_time)
             
         except Exception as e:
             logging.error(f"Error in birthday check thread: {e}")
-            time.sleep(60)  # Wait a minute on error before trying again
+            heartbeat.failure('birthday_check', e)
+            heartbeat.sleep('birthday_check', 60)  # Wait a minute on error before trying again
 
 @bot.message_handler(commands=['test_birthday'])
 def test_birthday_message(message):
@@ -17054,8 +17020,12 @@ def notify_enrollment_change_specific(enrollment_type, is_open):
     # Send to all subscribers
     success_count = 0
     fail_count = 0
+    skipped_count = 0
     
     for user_id in UPDATE_SUBSCRIBERS:
+        if unreachable.should_skip(user_id, 'subscriber_broadcast'):
+            skipped_count += 1
+            continue
         try:
             bot.send_message(user_id, message_text, parse_mode="Markdown")
             success_count += 1
@@ -17063,7 +17033,7 @@ def notify_enrollment_change_specific(enrollment_type, is_open):
             logging.error(f"Failed to notify user {user_id} about enrollment change: {e}")
             fail_count += 1
     
-    logging.info(f"{enrollment_type.capitalize()} enrollment {action}: Notified {success_count} subscribers ({fail_count} failed)")
+    logging.info(f"{enrollment_type.capitalize()} enrollment {action}: Notified {success_count} subscribers ({fail_count} failed, {skipped_count} skipped)")
 
 def notify_discount_created(discount_name, reg_discount, sup_discount):
     """Notify subscribers about new discount offers"""
@@ -17116,8 +17086,12 @@ def notify_discount_created(discount_name, reg_discount, sup_discount):
     # Send to all subscribers
     success_count = 0
     fail_count = 0
+    skipped_count = 0
     
     for user_id in UPDATE_SUBSCRIBERS:
+        if unreachable.should_skip(user_id, 'subscriber_broadcast'):
+            skipped_count += 1
+            continue
         try:
             bot.send_chat_action(user_id, 'typing')  # First check if user can receive messages
             
@@ -17148,7 +17122,7 @@ def notify_discount_created(discount_name, reg_discount, sup_discount):
             logging.error(f"Failed to send discount update to user {user_id}: {e}")
             fail_count += 1
     
-    logging.info(f"Discount '{discount_name}' created: Notified {success_count} subscribers ({fail_count} failed)")
+    logging.info(f"Discount '{discount_name}' created: Notified {success_count} subscribers ({fail_count} failed, {skipped_count} skipped)")
 
 def check_and_reset_rate_limits():
     """Background thread to periodically check and reset expired rate limits"""
@@ -17192,6 +17166,16 @@ def check_and_reset_rate_limits():
 
 keep_alive()
 
+# Every handler is registered by now - acknowledge button taps promptly and
+# record latency and errors for all of them
+flows.install(pending_status, update_pending_user)
+callback_ack.install(bot)
+instrumentation.instrument_bot_handlers(bot)
+instrumentation.instrument_telegram_api()
+# Skip users who blocked the bot in bulk sends, until they come back or a re-probe succeeds
+unreachable.install(bot, unreachable_users_collection)
+metrics.QUEUE_DEPTH.set_function(bot.worker_pool.qsize, queue='bot_updates')
+
 # Start the rate limit checker thread
 # threading.Thread(target=check_and_reset_rate_limits, daemon=True).start()
 
@@ -17226,13 +17210,14 @@ leaderboard_thread.start()
 midnight_thread = threading.Thread(target=midnight_cleanup_thread, daemon=True)
 midnight_thread.start()
 
-# Start the discount expiry thread
-discount_thread = threading.Thread(target=discount_expiry_thread, daemon=True)
-discount_thread.start()
+# Keep single-use invite links ready for both paid groups
+invite_pool.start(bot, [PAID_GROUP_ID, SUPREME_GROUP_ID], collection=invite_links_collection)
+
+# Compare the paid groups' members with their memberships, a small batch at a time
+reconcile.start(bot, PAYMENT_DATA, group_access, {PAID_GROUP_ID: 'regular', SUPREME_GROUP_ID: 'supreme'}, settings_collection)
 
-# Start the pending users cleanup thread
-pending_cleanup_thread = threading.Thread(target=cleanup_inactive_pending_users, daemon=True)
-pending_cleanup_thread.start()
+# Expire the active discounts exactly at their end dates
+schedule_discount_expiries()
 
 # Start the birthday greeting thread
 birthday_thread = threading.Thread(target=birthday_check_thread, daemon=True)
@@ -17241,6 +17226,35 @@ birthday_thread.start()
 # Start the trial reminder checker thread
 threading.Thread(target=check_trial_reminders, daemon=True).start()
 
+# Price menus and quotes are built from the live discounts and payment fees
+pricing.install(DISCOUNTS, PAYMENT_FEES)
+
+# Serve exchange rates from the last good copy and keep them fresh in the background
+exchange_rates.start(settings_collection)
+
+# Start the state snapshot thread
+threading.Thread(target=state_snapshot_thread, daemon=True).start()
+
+# Reconcile the snapshot we booted from with MongoDB in the background
+if BOOT_SNAPSHOT:
+    threading.Thread(target=reconcile_snapshot_state, daemon=True).start()
+
+def alert_stalled_jobs(job_names):
+    """Tell the admins that background jobs stopped reporting heartbeats"""
+    jobs = "\n".join(f"• `{name}`" for name in job_names)
+    for admin_id in ADMIN_IDS:
+        try:
+            bot.send_message(
+                admin_id,
+                f"⚠️ *Background jobs stalled*\n\n{jobs}\n\nThese jobs missed their heartbeat and may be hung. Check the logs.",
+                parse_mode="Markdown"
+            )
+        except Exception as e:
+            logging.error(f"Failed to alert admin {admin_id} about stalled jobs: {e}")
+
+# Watch the background threads for missed heartbeats
+heartbeat.start_watchdog(alert_stalled_jobs)
+
 # Function to start the bot with auto-restart
 def start_bot():
     """Start the bot with enhanced error handling and reconnection logic"""
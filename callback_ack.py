@@ -0,0 +1,182 @@
+import functools
+import heapq
+import logging
+import os
+import threading
+import time
+
+# How long after a callback arrives it is acknowledged automatically, unless its
+# handler has started by then
+CALLBACK_ACK_GRACE = float(os.getenv('CALLBACK_ACK_GRACE', '0.25'))
+# A handler that started within the grace period may answer itself (with a toast
+# or alert) until it returns, but no longer than this after it started
+CALLBACK_ACK_HANDLER_LIMIT = float(os.getenv('CALLBACK_ACK_HANDLER_LIMIT', '5'))
+# Repeated taps on the same button of the same message within this window are dropped
+CALLBACK_DEDUPE_WINDOW = float(os.getenv('CALLBACK_DEDUPE_WINDOW', '3'))
+ANSWERED_TTL = 300  # Seconds answered query ids are remembered
+
+_answered = {}
+_recent_taps = {}
+_in_flight = set()
+_lock = threading.Lock()
+_ack_due = {}  # callback_query_id -> when it is acknowledged automatically
+_ack_heap = []  # (due, callback_query_id), may hold superseded entries
+_ack_ready = threading.Condition(_lock)
+_original_answer = None
+
+
+def _tap_key(call):
+    """Identify a button press by the message it belongs to and its data"""
+    if call.message is not None:
+        return (call.message.chat.id, call.message.message_id, call.data)
+    return (call.inline_message_id, None, call.data)
+
+
+def _prune(now):
+    for query_id, answered_at in list(_answered.items()):
+        if now - answered_at > ANSWERED_TTL:
+            del _answered[query_id]
+    for key, tapped_at in list(_recent_taps.items()):
+        if now - tapped_at > CALLBACK_DEDUPE_WINDOW and key not in _in_flight:
+            del _recent_taps[key]
+
+
+def _answer_once(callback_query_id, *args, **kwargs):
+    """answer_callback_query that answers each query at most once
+
+    Telegram rejects a second answer, so a handler answering after the
+    automatic ack gets False instead of an exception.
+    """
+    with _lock:
+        if callback_query_id in _answered:
+            if args or kwargs:
+                logging.info(f"Dropped answer {args or kwargs} to callback query {callback_query_id}, it was already acknowledged")
+            else:
+                logging.debug(f"Callback query {callback_query_id} was already answered")
+            return False
+        _answered[callback_query_id] = time.time()
+        _ack_due.pop(callback_query_id, None)
+    try:
+        return _original_answer(callback_query_id, *args, **kwargs)
+    except Exception:
+        # Let a later answer (the handler's or the automatic ack) try again
+        with _lock:
+            _answered.pop(callback_query_id, None)
+        raise
+
+
+def _schedule_ack(callback_query_id, due):
+    """Acknowledge a callback at `due` unless it is answered (or rescheduled) before then"""
+    with _lock:
+        if callback_query_id in _answered:
+            return
+        _ack_due[callback_query_id] = due
+        heapq.heappush(_ack_heap, (due, callback_query_id))
+        _ack_ready.notify()
+
+
+def _ack_worker():
+    """Answer callbacks that nobody answered by their due time"""
+    while True:
+        with _lock:
+            while True:
+                now = time.time()
+                if _ack_heap and _ack_heap[0][0] <= now:
+                    due, callback_query_id = heapq.heappop(_ack_heap)
+                    # Skip entries for answered queries and ones a handler pushed back
+                    if _ack_due.get(callback_query_id) == due:
+                        del _ack_due[callback_query_id]
+                        break
+                    continue
+                _ack_ready.wait(_ack_heap[0][0] - now if _ack_heap else None)
+        try:
+            _answer_once(callback_query_id)
+        except Exception as e:
+            logging.warning(f"Failed to acknowledge callback query {callback_query_id}: {e}")
+
+
+def _claim(callback_query_id, now):
+    """Let a handler that started within the grace period answer first
+
+    The automatic ack moves to CALLBACK_ACK_HANDLER_LIMIT after the start;
+    the handler wrapper answers on return if the handler didn't.
+    """
+    with _lock:
+        due = _ack_due.get(callback_query_id)
+        if due is None or now >= due:
+            return False
+        due = now + CALLBACK_ACK_HANDLER_LIMIT
+        _ack_due[callback_query_id] = due
+        heapq.heappush(_ack_heap, (due, callback_query_id))
+        return True
+
+
+def acknowledge_on_arrival(bot):
+    """Schedule the automatic ack when callbacks are dispatched, before they wait in a worker lane"""
+    original_process = bot.process_new_callback_query
+
+    @functools.wraps(original_process)
+    def process_new_callback_query(new_callback_queries):
+        due = time.time() + CALLBACK_ACK_GRACE
+        for call in new_callback_queries:
+            _schedule_ack(call.id, due)
+        return original_process(new_callback_queries)
+
+    bot.process_new_callback_query = process_new_callback_query
+
+
+def wrap_callback_handler(function):
+    """Give a handler that started in time the first answer and drop repeated taps while it runs"""
+
+    @functools.wraps(function)
+    def wrapper(call, *args, **kwargs):
+        key = _tap_key(call)
+        now = time.time()
+        with _lock:
+            _prune(now)
+            last_tap = _recent_taps.get(key)
+            duplicate = key in _in_flight or (last_tap is not None and now - last_tap < CALLBACK_DEDUPE_WINDOW)
+            _recent_taps[key] = now
+            if not duplicate:
+                _in_flight.add(key)
+
+        if duplicate:
+            logging.info(f"Ignoring repeated tap on '{call.data}' from user {call.from_user.id}")
+            try:
+                _answer_once(call.id)
+            except Exception as e:
+                logging.warning(f"Failed to acknowledge repeated callback {call.id}: {e}")
+            return None
+
+        claimed = _claim(call.id, now)
+        try:
+            return function(call, *args, **kwargs)
+        finally:
+            with _lock:
+                _in_flight.discard(key)
+                # A repeated tap queued behind this run in the user's lane only gets
+                # here now, so the window has to count from when the handler finished
+                _recent_taps[key] = time.time()
+            if claimed:
+                try:
+                    _answer_once(call.id)
+                except Exception as e:
+                    logging.warning(f"Failed to acknowledge callback query {call.id}: {e}")
+
+    return wrapper
+
+
+def install(bot):
+    """Wrap every callback query handler; call after all handlers are registered"""
+    global _original_answer
+    if _original_answer is not None:
+        return
+    _original_answer = bot.answer_callback_query
+    bot.answer_callback_query = _answer_once
+
+    for handler in bot.callback_query_handlers:
+        handler['function'] = wrap_callback_handler(handler['function'])
+    acknowledge_on_arrival(bot)
+
+    threading.Thread(target=_ack_worker, name='callback-ack', daemon=True).start()
+    logging.info(f"Installed fast acknowledgement on {len(bot.callback_query_handlers)} callback handlers")
@@ -0,0 +1,367 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from member_store import MemberStore
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Idle time after which a conversation expires, by status. None keeps the
+# state until the flow is resolved (e.g. an admin approves or rejects it).
+CONVERSATION_TTL_DEFAULT = int(os.getenv('CONVERSATION_TTL_DEFAULT', str(DAY)))
+ONBOARDING_FORM_TTL = int(os.getenv('ONBOARDING_FORM_TTL', str(7 * DAY)))
+CONVERSATION_TTLS = {
+    # Waiting on an admin decision
+    'waiting_approval': None,
+    'old_member_request': None,
+    'xm_waiting_approval': None,
+    'xm_awaiting_deposit_verification': None,
+    # Grace and trial periods that are still being tracked
+    'xm_awaiting_compliance': 30 * DAY,
+    'form_completion_pending': 30 * DAY,
+    'xm_trial_approved': 30 * DAY,
+    'xm_approved': 30 * DAY,
+    # Paying can take a while
+    'choosing_payment_method': 3 * DAY,
+    'awaiting_payment': 3 * DAY,
+    'awaiting_proof': 3 * DAY,
+    # Idle menus and chats
+    'at_main_menu': 2 * HOUR,
+    'choosing_option': 2 * HOUR,
+    'awaiting_ai_query': 2 * HOUR,
+    'conversation_active': 6 * HOUR
+}
+
+# Fields maintained by the store rather than the conversation itself
+ACTIVITY_FIELDS = ('last_activity', 'expires_at')
+
+EVICTION_INTERVAL = 60  # Minimum seconds between idle scans of the in-memory map
+EVICTION_BATCH = 500  # Most entries dropped by one idle scan
+# Records handed out are changed in place, so they stay dirty this many seconds
+# after the last access even when a save finds them unchanged
+DIRTY_GRACE = 60
+
+
+def conversation_ttl(status):
+    """Return how long a conversation in this status may sit idle, or None if it never expires"""
+    if status in CONVERSATION_TTLS:
+        return CONVERSATION_TTLS[status]
+    if status and status.startswith('onboarding_form_'):
+        return ONBOARDING_FORM_TTL
+    return CONVERSATION_TTL_DEFAULT
+
+
+MIN_CONVERSATION_TTL = min(
+    ttl for ttl in [*CONVERSATION_TTLS.values(), CONVERSATION_TTL_DEFAULT, ONBOARDING_FORM_TTL] if ttl is not None
+)
+
+
+def to_utc_datetime(timestamp):
+    """Convert an epoch timestamp to the naive UTC datetime MongoDB stores"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+
+def to_timestamp(value):
+    """Convert a naive UTC datetime read from MongoDB back to an epoch timestamp"""
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def fingerprint(record):
+    """Summarize a record's conversation fields to detect changes since it was last saved"""
+    return repr({key: value for key, value in record.items() if key not in ACTIVITY_FIELDS})
+
+
+def expiry_query(now=None):
+    """Filter matching conversation documents that haven't expired yet
+
+    The TTL monitor only runs once a minute, so loads filter out documents
+    it hasn't got to.
+    """
+    now = to_utc_datetime(now or time.time())
+    # A null expires_at also matches documents without the field
+    return {'$or': [{'expires_at': None}, {'expires_at': {'$gt': now}}]}
+
+
+class ConversationStore(MemberStore):
+    """MemberStore of per-user conversation state that expires after idling
+
+    Each record carries last_activity and expires_at (naive UTC datetimes),
+    refreshed whenever the conversation changes and is saved. The same
+    expires_at backs a TTL index in MongoDB, so stale flows are removed
+    individually in both places without a periodic sweep: in memory, a
+    record is dropped when it is next looked up after expiring, and saves
+    evict idle entries from the least recently active end of the map.
+
+    Saves only look at dirty keys: those set, changed or handed out (and so
+    possibly changed in place) since they were last found unchanged.
+    Records changed while iterating over items() or values() have to be
+    flagged with mark_dirty().
+    """
+
+    def __init__(self, initial=None, ttl_for=conversation_ttl):
+        self._ttl_for = ttl_for
+        self._order_lock = threading.Lock()
+        self._deadlines = OrderedDict()  # Least recently active first
+        self._saved = {}
+        self._dirty = {}  # key -> when its record was last handed out or changed
+        self._last_eviction = 0.0
+        super().__init__(initial)
+        self.replace(self._data)
+
+    def _expired(self, key, now=None):
+        deadline = self._deadlines.get(key)
+        return deadline is not None and deadline <= (now or time.time())
+
+    def _forget(self, key):
+        with self._order_lock:
+            self._deadlines.pop(key, None)
+        self._saved.pop(key, None)
+        self._dirty.pop(key, None)
+
+    def _mark(self, key):
+        self._dirty[key] = time.time()
+
+    def _expire(self, key, now=None):
+        """Drop a record if it has expired; returns True if it was dropped"""
+        with self.lock_for(key):
+            if not self._expired(key, now):
+                return False
+            record = self._data.pop(key, None)
+            self._forget(key)
+        if record is not None:
+            self._keys_changed()
+            logging.info(f"Conversation state for user {key} expired (status {record.get('status')})")
+        return True
+
+    def __getitem__(self, key):
+        if self._expired(key):
+            self._expire(key)
+        record = self._data[key]
+        self._mark(key)
+        return record
+
+    def __contains__(self, key):
+        if self._expired(key):
+            self._expire(key)
+        return key in self._data
+
+    def get(self, key, default=None):
+        if self._expired(key):
+            self._expire(key)
+        record = self._data.get(key, default)
+        if key in self._data:
+            self._mark(key)
+        return record
+
+    def __setitem__(self, key, value):
+        with self.lock_for(key):
+            added = key not in self._data
+            self._data[key] = value
+            self._touch(key, value)
+            self._mark(key)
+            if added:
+                self._keys_changed()
+
+    def __delitem__(self, key):
+        with self.lock_for(key):
+            del self._data[key]
+            self._forget(key)
+            self._keys_changed()
+
+    def pop(self, key, *default):
+        with self.lock_for(key):
+            removed = key in self._data
+            value = self._data.pop(key, *default)
+            self._forget(key)
+            if removed:
+                self._keys_changed()
+            return value
+
+    def setdefault(self, key, default=None):
+        with self.lock_for(key):
+            if key not in self._data:
+                self[key] = default
+            self._mark(key)
+            return self._data[key]
+
+    def update_value(self, key, function, default=None):
+        with self.lock_for(key):
+            value = super().update_value(key, function, default)
+            self._mark(key)
+            return value
+
+    def update_fields(self, key, fields):
+        with self.lock_for(key):
+            record = super().update_fields(key, fields)
+            self._mark(key)
+            return record
+
+    @contextmanager
+    def locked(self, key):
+        with self.lock_for(key):
+            if key in self._data:
+                self._mark(key)
+            yield self._data.get(key)
+
+    def _touch(self, key, record, now=None):
+        """Mark a record as active now and push back its expiry"""
+        now = now or time.time()
+        ttl = self._ttl_for(record.get('status'))
+        record['last_activity'] = to_utc_datetime(now)
+        record['expires_at'] = to_utc_datetime(now + ttl) if ttl is not None else None
+        with self._order_lock:
+            self._deadlines[key] = now + ttl if ttl is not None else None
+            self._deadlines.move_to_end(key)
+
+    def touch(self, key, now=None):
+        """Record activity on a conversation, e.g. a message that didn't change its state"""
+        with self.lock_for(key):
+            record = self._data.get(key)
+            if record is not None:
+                self._touch(key, record, now)
+
+    def pending_writes(self, now=None):
+        """Touch and return (key, document, fingerprint) for every record changed since it was saved
+
+        Only dirty keys are fingerprinted, so the cost follows recent
+        activity rather than the number of conversations in memory.
+        """
+        now = now or time.time()
+        writes = []
+        for key, marked_at in list(self._dirty.items()):
+            with self.lock_for(key):
+                record = self._data.get(key)
+                if record is None:
+                    self._dirty.pop(key, None)
+                    continue
+                current = fingerprint(record)
+                if self._saved.get(key) == current:
+                    if now - marked_at > DIRTY_GRACE and self._dirty.get(key) == marked_at:
+                        del self._dirty[key]
+                    continue
+                self._touch(key, record, now)
+                writes.append((key, dict(record), current))
+        self.evict_idle(now)
+        return writes
+
+    def set_fields(self, key, fields, unset=(), now=None):
+        """Apply field changes to a record and return the update that persists just those
+
+        Field names may be dotted paths into nested dicts, as in MongoDB.
+        Returns {'$set': ..., '$unset': ...} including the refreshed activity
+        fields, or None if the record already had unsaved changes and has to
+        be written in full. Raises KeyError if there is no record.
+        """
+        with self.lock_for(key):
+            record = self._data[key]
+            in_sync = self._saved.get(key) == fingerprint(record)
+            for path, value in fields.items():
+                *parents, name = path.split('.')
+                target = record
+                for parent in parents:
+                    target = target.setdefault(parent, {})
+                target[name] = value
+            for path in unset:
+                *parents, name = path.split('.')
+                target = record
+                for parent in parents:
+                    target = target.get(parent, {})
+                target.pop(name, None)
+            self._touch(key, record, now)
+            self._mark(key)
+            if not in_sync:
+                return None
+            self._saved[key] = fingerprint(record)
+            update = {'$set': {**fields, 'last_activity': record['last_activity'], 'expires_at': record['expires_at']}}
+            if unset:
+                update['$unset'] = {path: '' for path in unset}
+            return update
+
+    def mark_dirty(self, key):
+        """Forget that a record is persisted, e.g. after a targeted write failed"""
+        self._saved.pop(key, None)
+        if key in self._data:
+            self._mark(key)
+
+    def mark_saved(self, key, saved_fingerprint):
+        """Remember what was persisted for a record so unchanged records aren't written again"""
+        with self.lock_for(key):
+            if key in self._data:
+                self._saved[key] = saved_fingerprint
+
+    def evict_idle(self, now=None):
+        """Drop expired records, scanning from the least recently active end
+
+        Every TTL is at least MIN_CONVERSATION_TTL, so the scan stops at the
+        first record active more recently than that. Scans run at most once
+        per EVICTION_INTERVAL and are triggered by saves, not a timer.
+        """
+        now = now or time.time()
+        if now - self._last_eviction < EVICTION_INTERVAL:
+            return 0
+        self._last_eviction = now
+
+        candidates = []
+        with self._order_lock:
+            for key, deadline in self._deadlines.items():
+                if len(candidates) >= EVICTION_BATCH:
+                    break
+                if deadline is not None and deadline <= now:
+                    candidates.append(key)
+                    continue
+                record = self._data.get(key)
+                last_activity = to_timestamp(record.get('last_activity')) if record else None
+                if last_activity is not None and now - last_activity < MIN_CONVERSATION_TTL:
+                    break
+
+        evicted = sum(1 for key in candidates if self._expire(key, now))
+        if evicted:
+            logging.info(f"Evicted {evicted} idle conversations from memory")
+        return evicted
+
+    def replace_keeping_unsaved(self, data):
+        """Swap in a freshly loaded dataset, keeping records with changes not saved yet
+
+        Returns how many records were kept; they stay dirty so the next
+        save writes them.
+        """
+        unsaved = {}
+        for key in list(self._dirty):
+            record = self._data.get(key)
+            if record is not None and self._saved.get(key) != fingerprint(record):
+                unsaved[key] = record
+        self.replace({**dict(data), **unsaved})
+        for key in unsaved:
+            self.mark_dirty(key)
+        return len(unsaved)
+
+    def replace(self, data):
+        """Swap in a freshly loaded dataset, treating it as what's already persisted"""
+        now = time.time()
+        data = dict(data)
+        entries = []
+        saved = {}
+        for key, record in data.items():
+            last_activity = to_timestamp(record.get('last_activity'))
+            if last_activity is None:
+                # Saved before activity was tracked; the next save stamps it
+                last_activity = now
+            else:
+                saved[key] = fingerprint(record)
+            ttl = self._ttl_for(record.get('status'))
+            entries.append((last_activity, key, last_activity + ttl if ttl is not None else None))
+        entries.sort(key=lambda entry: entry[0])
+
+        super().replace(data)
+        with self._order_lock:
+            self._deadlines = OrderedDict((key, deadline) for _, key, deadline in entries)
+        self._saved = saved
+        self._dirty = {key: now for key in data if key not in saved}
@@ -0,0 +1,346 @@
+import base64
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import timedelta
+import pymongo
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+from dotenv import load_dotenv
+from mongo_monitor import command_listener
+
+load_dotenv()
+
+MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
+DB_NAME = os.getenv('DB_NAME', 'PTABotDB')
+
+# Connection pool tuning - one client is shared by the bot and the dashboard
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '2'))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '300000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '10000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '30000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '10000'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '10000'))
+
+# Members whose due date is within this many days are "expiring soon"
+EXPIRING_SOON_DAYS = 7
+MEMBER_PAGE_SIZE_MAX = 200
+
+# Fields the dashboard needs from a payment document
+MEMBER_LIST_PROJECTION = {
+    'username': 1,
+    'payment_plan': 1,
+    'payment_mode': 1,
+    'due_date': 1,
+    'haspayed': 1,
+    'cancelled': 1
+}
+
+# Sort keys the member list API accepts, mapped to document fields
+MEMBER_SORT_FIELDS = {
+    'due_date': 'due_date',
+    'user_id': '_id'
+}
+
+# How long cached dashboard summary counts stay fresh (seconds)
+MEMBER_STATS_TTL = int(os.getenv('MEMBER_STATS_TTL', '60'))
+
+_client = None
+_client_lock = threading.Lock()
+_transactions_supported = None
+_member_indexes_ready = False
+
+_member_stats_cache = {'stats': None, 'computed_at': 0}
+_member_stats_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide pooled MongoClient, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    MONGO_URI,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    retryWrites=True,
+                    appname='PTABot',
+                    event_listeners=[command_listener]
+                )
+                logging.info(f"Created shared MongoDB client (max pool size {MONGO_MAX_POOL_SIZE})")
+    return _client
+
+
+def ping(timeout_ms):
+    """Whether MongoDB answers within timeout_ms, without the shared client's longer timeouts"""
+    probe = MongoClient(MONGO_URI, serverSelectionTimeoutMS=timeout_ms, connectTimeoutMS=timeout_ms)
+    try:
+        probe.admin.command('ping')
+        return True
+    except Exception as e:
+        logging.warning(f"MongoDB did not answer within {timeout_ms}ms: {e}")
+        return False
+    finally:
+        probe.close()
+
+
+def get_db():
+    """Return the bot's database on the shared client"""
+    return get_client()[DB_NAME]
+
+
+def run_transaction(callback):
+    """Run callback(session) as one transaction, retrying it on transient errors
+
+    Transactions need a replica set or sharded cluster; on a standalone
+    server callback(None) runs the same writes without one.
+    """
+    global _transactions_supported
+    if _transactions_supported is not False:
+        try:
+            with get_client().start_session() as session:
+                return session.with_transaction(callback)
+        except OperationFailure as e:
+            # IllegalOperation: this deployment doesn't support transactions
+            if e.code != 20:
+                raise
+            _transactions_supported = False
+            logging.warning("MongoDB deployment doesn't support transactions, writing without them")
+    return callback(None)
+
+
+def close_client():
+    """Close the shared client and release its pooled connections"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+### Membership data access used by the web dashboard ###
+
+def get_all_members():
+    """Return every payment document"""
+    return list(get_db()['payments'].find())
+
+
+def get_member(user_id):
+    """Return a single payment document, or None if it doesn't exist"""
+    return get_db()['payments'].find_one({"_id": str(user_id)})
+
+
+def mark_member_cancelled(user_id):
+    """Flag a member's membership as cancelled"""
+    result = get_db()['payments'].update_one(
+        {"_id": str(user_id)},
+        {"$set": {"cancelled": True}}
+    )
+    invalidate_member_stats()
+    return result
+
+
+def set_member_due_date(user_id, due_date):
+    """Update a member's due date (formatted as '%Y-%m-%d %H:%M:%S')"""
+    result = get_db()['payments'].update_one(
+        {"_id": str(user_id)},
+        {"$set": {"due_date": due_date}}
+    )
+    invalidate_member_stats()
+    return result
+
+
+def ensure_member_indexes():
+    """Create the indexes backing the member list queries (idempotent)"""
+    global _member_indexes_ready
+    if _member_indexes_ready:
+        return
+    payments = get_db()['payments']
+    payments.create_index([('haspayed', 1), ('due_date', 1), ('_id', 1)], name='status_due_date')
+    payments.create_index([('username', 1)], name='username')
+    # Prefix searches run case-sensitively on a lowercased copy, so they stay index range scans
+    payments.create_index([('username_lower', 1)], name='username_lower')
+    payments.update_many(
+        {'username': {'$type': 'string'}, 'username_lower': {'$exists': False}},
+        [{'$set': {'username_lower': {'$toLower': '$username'}}}]
+    )
+    _member_indexes_ready = True
+
+
+def add_username_key(doc):
+    """Set the lowercased username the member search runs on; call before writing a whole member document"""
+    username = doc.get('username')
+    if isinstance(username, str):
+        doc['username_lower'] = username.lower()
+    else:
+        doc.pop('username_lower', None)
+    return doc
+
+
+def ensure_pending_indexes():
+    """Create the TTL index that expires idle conversation state (idempotent)
+
+    Each pending document carries its own expires_at, set from its status
+    whenever it is saved; documents without one never expire.
+    """
+    get_db()['pending'].create_index([('expires_at', 1)], name='conversation_expiry', expireAfterSeconds=0)
+
+
+def member_status_filter(status, now):
+    """Return the query matching members in a dashboard category at the given time
+
+    Due dates are stored as '%Y-%m-%d %H:%M:%S' strings, which sort
+    chronologically, so range comparisons on them can use the index.
+    """
+    # A paid member is "expiring" while fewer than EXPIRING_SOON_DAYS + 1 whole days remain
+    threshold = (now + timedelta(days=EXPIRING_SOON_DAYS + 1)).strftime('%Y-%m-%d %H:%M:%S')
+
+    if status == 'active':
+        return {'haspayed': True, 'due_date': {'$type': 'string', '$gt': threshold}}
+    if status == 'expiring':
+        return {'haspayed': True, 'due_date': {'$type': 'string', '$lte': threshold}}
+    if status == 'expired':
+        return {'haspayed': {'$ne': True}, 'due_date': {'$type': 'string'}}
+    raise ValueError(f"Unknown member status: {status}")
+
+
+def encode_member_cursor(sort_value, user_id):
+    """Encode the position after a member into an opaque cursor string"""
+    raw = json.dumps([sort_value, user_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_member_cursor(cursor):
+    """Decode a cursor created by encode_member_cursor"""
+    try:
+        sort_value, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return sort_value, user_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def query_members(status, now, sort='due_date', descending=False, search=None, cursor=None, limit=50):
+    """Return one page of members in a category and the cursor for the next page
+
+    Pagination is keyset-based on (sort field, _id) so every page is an
+    index range scan, no matter how deep into the list it is.
+    """
+    if sort not in MEMBER_SORT_FIELDS:
+        raise ValueError(f"Unknown sort key: {sort}")
+    field = MEMBER_SORT_FIELDS[sort]
+    limit = max(1, min(int(limit), MEMBER_PAGE_SIZE_MAX))
+
+    ensure_member_indexes()
+
+    clauses = [member_status_filter(status, now)]
+
+    if search:
+        term = search.strip().lstrip('@')
+        if term.isdigit():
+            clauses.append({'_id': {'$regex': f'^{re.escape(term)}'}})
+        elif term:
+            clauses.append({'username_lower': {'$regex': f'^{re.escape(term.lower())}'}})
+
+    if cursor:
+        after_value, after_id = decode_member_cursor(cursor)
+        op = '$lt' if descending else '$gt'
+        if field == '_id':
+            clauses.append({'_id': {op: after_id}})
+        else:
+            clauses.append({'$or': [
+                {field: {op: after_value}},
+                {field: after_value, '_id': {op: after_id}}
+            ]})
+
+    direction = pymongo.DESCENDING if descending else pymongo.ASCENDING
+    sort_spec = [(field, direction)]
+    if field != '_id':
+        sort_spec.append(('_id', direction))
+
+    # Fetch one extra document to know whether another page exists
+    docs = list(
+        get_db()['payments']
+        .find({'$and': clauses}, MEMBER_LIST_PROJECTION)
+        .sort(sort_spec)
+        .limit(limit + 1)
+    )
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_member_cursor(last.get(field) if field != '_id' else last['_id'], last['_id'])
+
+    return docs, next_cursor
+
+
+def compute_member_stats(now):
+    """Compute the dashboard summary counts and breakdowns in one aggregation"""
+    paid_filter = {'haspayed': True}
+    pipeline = [
+        {'$match': {'due_date': {'$type': 'string'}}},
+        {'$facet': {
+            'active': [{'$match': member_status_filter('active', now)}, {'$count': 'count'}],
+            'expiring': [{'$match': member_status_filter('expiring', now)}, {'$count': 'count'}],
+            'expired': [{'$match': member_status_filter('expired', now)}, {'$count': 'count'}],
+            'by_plan': [
+                {'$match': paid_filter},
+                {'$group': {'_id': {'$ifNull': ['$payment_plan', 'Unknown']}, 'count': {'$sum': 1}}},
+                {'$sort': {'count': -1}}
+            ],
+            'by_payment_method': [
+                {'$match': paid_filter},
+                {'$group': {'_id': {'$ifNull': ['$payment_mode', 'Unknown']}, 'count': {'$sum': 1}}},
+                {'$sort': {'count': -1}}
+            ]
+        }}
+    ]
+    result = next(get_db()['payments'].aggregate(pipeline))
+
+    def first_count(facet):
+        return facet[0]['count'] if facet else 0
+
+    return {
+        'active': first_count(result['active']),
+        'expiring': first_count(result['expiring']),
+        'expired': first_count(result['expired']),
+        'by_plan': [{'name': row['_id'], 'count': row['count']} for row in result['by_plan']],
+        'by_payment_method': [{'name': row['_id'], 'count': row['count']} for row in result['by_payment_method']]
+    }
+
+
+def get_member_stats(now):
+    """Return the dashboard summary stats, recomputing them once the cache expires"""
+    with _member_stats_lock:
+        cached = _member_stats_cache['stats']
+        if cached is not None and time.time() - _member_stats_cache['computed_at'] < MEMBER_STATS_TTL:
+            return cached
+
+        stats = compute_member_stats(now)
+        _member_stats_cache['stats'] = stats
+        _member_stats_cache['computed_at'] = time.time()
+        return stats
+
+
+def invalidate_member_stats():
+    """Drop the cached summary stats after membership data changes"""
+    with _member_stats_lock:
+        _member_stats_cache['stats'] = None
+
+
+def get_changelogs():
+    """Return the admin and user changelogs"""
+    doc = get_db()['changelogs'].find_one({'_id': 'changelogs'})
+    if doc:
+        return {k: v for k, v in doc.items() if k != '_id'}
+    return {"admin": [], "user": []}
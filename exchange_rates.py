@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+import requests
+import metrics
+
+EXCHANGE_RATE_URL = os.getenv('EXCHANGE_RATE_URL', 'https://open.er-api.com/v6/latest/USD')
+EXCHANGE_RATE_TTL = int(os.getenv('EXCHANGE_RATE_TTL', '3600'))  # Seconds rates are served without a refresh
+EXCHANGE_RATE_MAX_AGE = int(os.getenv('EXCHANGE_RATE_MAX_AGE', str(3 * 24 * 3600)))  # Older rates aren't shown at all
+EXCHANGE_RATE_TIMEOUT = 10  # Seconds per API request; only the background refresh waits on it
+BREAKER_FAILURES = 3  # Consecutive failed refreshes that open the circuit breaker
+BREAKER_COOLDOWN = 300  # Seconds the breaker stays open before another attempt
+CURRENCIES = ('USD', 'GBP', 'EUR', 'IDR', 'PHP')
+SETTINGS_ID = 'exchange_rates'
+
+EXCHANGE_RATE_AGE = metrics.gauge('ptabot_exchange_rate_age_seconds', 'Age of the cached exchange rates')
+
+_rates = None
+_fetched_at = 0.0
+_failures = 0
+_breaker_open_until = 0.0
+_refreshing = False
+_lock = threading.Lock()
+_collection = None
+
+
+def fetch_rates():
+    """Fetch the current rates for CURRENCIES against USD from the API"""
+    response = requests.get(EXCHANGE_RATE_URL, timeout=EXCHANGE_RATE_TIMEOUT)
+    data = response.json()
+    if data.get('result') != 'success':
+        raise ValueError(f"Exchange rate API error: {data}")
+    rates = {currency: data['rates'].get(currency, 0) for currency in CURRENCIES}
+    rates['USD'] = 1.0  # Base currency is always 1.0
+    return rates
+
+
+def _store(rates, fetched_at):
+    global _rates, _fetched_at
+    with _lock:
+        _rates = rates
+        _fetched_at = fetched_at
+
+
+def _refresh():
+    """Fetch fresh rates, keeping the last good ones if the API fails"""
+    global _failures, _breaker_open_until, _refreshing
+    try:
+        rates = fetch_rates()
+        now = time.time()
+        _store(rates, now)
+        with _lock:
+            _failures = 0
+        if _collection is not None:
+            _collection.replace_one(
+                {'_id': SETTINGS_ID},
+                {'_id': SETTINGS_ID, 'rates': rates, 'fetched_at': now},
+                upsert=True
+            )
+        logging.info("Refreshed exchange rates")
+    except Exception as e:
+        with _lock:
+            _failures += 1
+            if _failures >= BREAKER_FAILURES:
+                _breaker_open_until = time.time() + BREAKER_COOLDOWN
+        logging.error(f"Error fetching exchange rates: {e}")
+        if _failures >= BREAKER_FAILURES:
+            logging.warning(f"Exchange rate API failed {_failures} times in a row, pausing refreshes for {BREAKER_COOLDOWN}s")
+    finally:
+        with _lock:
+            _refreshing = False
+
+
+def refresh_in_background():
+    """Start a refresh unless one is running or the circuit breaker is open"""
+    global _refreshing
+    with _lock:
+        if _refreshing or time.time() < _breaker_open_until:
+            return False
+        _refreshing = True
+    threading.Thread(target=_refresh, name='exchange-rate-refresh', daemon=True).start()
+    return True
+
+
+def get_exchange_rates():
+    """Return the cached rates against USD without waiting on the network
+
+    Rates older than EXCHANGE_RATE_TTL are still returned while a
+    background refresh replaces them. Returns None when no rates newer
+    than EXCHANGE_RATE_MAX_AGE are known, so callers leave out currency
+    lines instead of showing badly outdated prices.
+    """
+    with _lock:
+        rates, fetched_at = _rates, _fetched_at
+    age = time.time() - fetched_at
+    if rates is None or age > EXCHANGE_RATE_TTL:
+        refresh_in_background()
+    if rates is None or age > EXCHANGE_RATE_MAX_AGE:
+        return None
+    return dict(rates)
+
+
+def status():
+    """Return the cache age and circuit breaker state"""
+    with _lock:
+        return {
+            'age': time.time() - _fetched_at if _rates is not None else None,
+            'failures': _failures,
+            'breaker_open': time.time() < _breaker_open_until
+        }
+
+
+def _cache_age():
+    age = status()['age']
+    if age is None:
+        raise LookupError("No exchange rates cached")
+    return age
+
+
+def start(collection):
+    """Load the last good rates saved in MongoDB, then refresh them in the background"""
+    global _collection
+    _collection = collection
+    try:
+        doc = collection.find_one({'_id': SETTINGS_ID})
+        if doc and doc.get('rates'):
+            _store(doc['rates'], doc.get('fetched_at', 0.0))
+            logging.info(f"Loaded exchange rates saved {time.time() - _fetched_at:.0f}s ago")
+    except Exception as e:
+        logging.error(f"Error loading saved exchange rates: {e}")
+    EXCHANGE_RATE_AGE.set_function(_cache_age)
+    refresh_in_background()
@@ -0,0 +1,124 @@
+import logging
+from collections import OrderedDict
+
+# Message content types a flow step can accept
+CONTENT_TYPES = [
+    'text', 'photo', 'document', 'video', 'animation', 'voice', 'audio',
+    'video_note', 'sticker', 'contact', 'location'
+]
+
+_steps = {}  # (state, content_type) -> Step
+_transitions = {}  # state -> states it may move to
+_flows = OrderedDict()  # flow -> states in registration order
+_get_state = None
+_persist = None
+
+
+class Step:
+    """A registered conversation step: the handler for one state and input type"""
+
+    def __init__(self, flow, state, content_type, handler):
+        self.flow = flow
+        self.state = state
+        self.content_type = content_type
+        self.handler = handler
+
+
+def step(flow, state, content_types=('text',), transitions=()):
+    """Register a handler for a conversation state
+
+    transitions lists every state the handler may advance() the user to;
+    moves to any other state are rejected. Final steps that hand off to
+    other code leave it empty.
+    """
+    def decorator(function):
+        for content_type in content_types:
+            if (state, content_type) in _steps:
+                raise ValueError(f"Flow step already registered for {state} ({content_type})")
+            _steps[(state, content_type)] = Step(flow, state, content_type, function)
+        _transitions.setdefault(state, set()).update(transitions)
+        states = _flows.setdefault(flow, [])
+        if state not in states:
+            states.append(state)
+        return function
+    return decorator
+
+
+def install(get_state, persist):
+    """Connect the engine to the conversation state store
+
+    get_state(user_id) returns the user's current state (or None) and
+    persist(user_id, fields, unset) saves a state change.
+    """
+    global _get_state, _persist
+    _get_state = get_state
+    _persist = persist
+    logging.info(f"Conversation flows ready: {len(_flows)} flows, {len(_transitions)} states")
+
+
+def find_step(message):
+    """Return the step handling this message in the sender's current state, or None"""
+    if _get_state is None or message.from_user is None:
+        return None
+    return _steps.get((_get_state(message.from_user.id), message.content_type))
+
+
+def accepts(message):
+    """Whether the sender's current state has a step for this kind of message"""
+    return find_step(message) is not None
+
+
+def dispatch(message):
+    """Run the step registered for the sender's state and the message's content type"""
+    found = find_step(message)
+    if found is None:
+        return None
+    return found.handler(message)
+
+
+def advance(user_id, state, fields=None, unset=()):
+    """Move a user to a new state, saving the step's answers with it in one write
+
+    fields may use dotted paths (e.g. 'form_answers.full_name') to set one
+    nested answer. Moves out of a registered state must be declared in its
+    transitions; entering a flow from elsewhere is always allowed.
+    """
+    current = _get_state(user_id)
+    allowed = _transitions.get(current)
+    if allowed is not None and state not in allowed:
+        raise ValueError(f"Flow transition from {current} to {state} is not registered")
+    _persist(user_id, {'status': state, **(fields or {})}, unset)
+
+
+def record(user_id, fields, unset=()):
+    """Save answers without changing the user's state"""
+    _persist(user_id, dict(fields), unset)
+
+
+def steps():
+    """Return every registered step"""
+    return list(_steps.values())
+
+
+def registered_flows():
+    """Return the registered flows and their states in registration order"""
+    return {flow: list(states) for flow, states in _flows.items()}
+
+
+def render_graph(flow=None):
+    """Render the registered flows (or one of them) as a Graphviz DOT digraph"""
+    lines = ['digraph flows {', '    rankdir=LR;', '    node [shape=box, fontname="Helvetica"];']
+    for name, states in _flows.items():
+        if flow is not None and name != flow:
+            continue
+        lines.append(f'    subgraph "cluster_{name}" {{')
+        lines.append(f'        label="{name}";')
+        for state in states:
+            inputs = ', '.join(sorted(content_type for (step_state, content_type) in _steps if step_state == state))
+            lines.append(f'        "{state}" [label="{state}\\n({inputs})"];')
+        lines.append('    }')
+        for state in states:
+            for target in sorted(_transitions.get(state, ())):
+                lines.append(f'    "{state}" -> "{target}";')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,125 @@
+import logging
+import os
+import threading
+import time
+
+HEARTBEAT_MAX_RUNTIME = int(os.getenv('HEARTBEAT_MAX_RUNTIME', '900'))  # Seconds one loop iteration may take
+HEARTBEAT_SLEEP_GRACE = 120  # Seconds a loop may oversleep before it counts as stalled
+WATCHDOG_INTERVAL = 60  # Seconds between stalled-job checks
+POLLING_STALE_AFTER = int(os.getenv('POLLING_STALE_AFTER', '120'))  # Seconds without a getUpdates reply before polling counts as stalled
+POLLING_JOB = 'telegram_polling'
+
+_jobs = {}
+_lock = threading.Lock()
+_watchdog_started = False
+
+
+def _job(name):
+    job = _jobs.get(name)
+    if job is None:
+        job = _jobs[name] = {
+            'state': 'starting',
+            'last_tick': None,
+            'last_success': None,
+            'last_error': None,
+            'last_error_at': None,
+            'deadline': None,
+            'stalled': False
+        }
+    return job
+
+
+def beat(name, max_runtime=HEARTBEAT_MAX_RUNTIME):
+    """Report that a background loop is starting an iteration"""
+    now = time.time()
+    with _lock:
+        job = _job(name)
+        job['state'] = 'running'
+        job['last_tick'] = now
+        job['deadline'] = now + max_runtime
+
+
+def success(name):
+    """Report that a background loop finished an iteration without errors"""
+    with _lock:
+        _job(name)['last_success'] = time.time()
+
+
+def failure(name, error):
+    """Report that a background loop iteration failed"""
+    with _lock:
+        job = _job(name)
+        job['last_error'] = str(error)
+        job['last_error_at'] = time.time()
+
+
+def expect(name, seconds):
+    """Report that a background loop is idle and will tick again within the given time"""
+    now = time.time()
+    with _lock:
+        job = _job(name)
+        job['state'] = 'sleeping'
+        job['last_tick'] = now
+        job['deadline'] = now + seconds + HEARTBEAT_SLEEP_GRACE
+
+
+def sleep(name, seconds):
+    """time.sleep() that tells the registry when the loop is due back"""
+    expect(name, seconds)
+    time.sleep(seconds)
+
+
+def status(now=None):
+    """Return every registered job with its ages and whether it has stalled"""
+    now = now or time.time()
+    with _lock:
+        jobs = {name: dict(job) for name, job in _jobs.items()}
+
+    report = []
+    for name, job in sorted(jobs.items()):
+        report.append({
+            'name': name,
+            'state': job['state'],
+            'stale': job['deadline'] is not None and now > job['deadline'],
+            'last_tick_age': now - job['last_tick'] if job['last_tick'] else None,
+            'last_success_age': now - job['last_success'] if job['last_success'] else None,
+            'last_error': job['last_error'],
+            'last_error_age': now - job['last_error_at'] if job['last_error_at'] else None
+        })
+    return report
+
+
+def stale_jobs(now=None):
+    """Return the names of jobs that missed their deadline"""
+    return [job['name'] for job in status(now) if job['stale']]
+
+
+def _watchdog(alert):
+    while True:
+        time.sleep(WATCHDOG_INTERVAL)
+        try:
+            stale = set(stale_jobs())
+            with _lock:
+                newly_stalled = [name for name in stale if not _jobs[name]['stalled']]
+                recovered = [name for name, job in _jobs.items() if job['stalled'] and name not in stale]
+                for name in newly_stalled:
+                    _jobs[name]['stalled'] = True
+                for name in recovered:
+                    _jobs[name]['stalled'] = False
+
+            for name in recovered:
+                logging.info(f"Background job {name} recovered")
+            if newly_stalled:
+                logging.error(f"Background jobs stalled: {', '.join(sorted(newly_stalled))}")
+                alert(sorted(newly_stalled))
+        except Exception as e:
+            logging.error(f"Error in heartbeat watchdog: {e}")
+
+
+def start_watchdog(alert):
+    """Start checking for stalled jobs; alert(names) is called once per stall"""
+    global _watchdog_started
+    if _watchdog_started:
+        return
+    _watchdog_started = True
+    threading.Thread(target=_watchdog, args=(alert,), name='heartbeat-watchdog', daemon=True).start()
@@ -0,0 +1,121 @@
+import functools
+import logging
+import time
+import requests
+from telebot import apihelper
+import flows
+import heartbeat
+import profiling
+from metrics import HANDLER_DURATION, HANDLER_ERRORS, TELEGRAM_REQUEST_DURATION
+
+_original_make_request = None
+_original_session_send = None
+
+
+def _update_type(attribute):
+    """Map a TeleBot handler list name to the update type it serves"""
+    return attribute[:-len('_handlers')]
+
+
+def wrap_handler(function, update_type):
+    """Wrap a handler so each call records its latency and any exception"""
+    if getattr(function, '_instrumented', False):
+        return function
+
+    name = getattr(function, '__name__', repr(function))
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        call = profiling.begin(name, update_type) if profiling.PROFILE_HANDLERS else None
+        start = time.perf_counter()
+        failed = False
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            failed = True
+            HANDLER_ERRORS.inc(handler=name, update_type=update_type)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            HANDLER_DURATION.observe(elapsed, handler=name, update_type=update_type)
+            if call is not None:
+                profiling.end(call, elapsed, failed)
+
+    wrapper._instrumented = True
+    return wrapper
+
+
+def instrument_bot_handlers(bot):
+    """Wrap every handler registered on the bot; call after all handlers are registered"""
+    count = 0
+    for attribute, handlers in vars(bot).items():
+        if not attribute.endswith('_handlers') or not isinstance(handlers, list):
+            continue
+        for handler in handlers:
+            if isinstance(handler, dict) and callable(handler.get('function')):
+                handler['function'] = wrap_handler(handler['function'], _update_type(attribute))
+                count += 1
+    # Conversation flow steps are dispatched from one handler, so time each step on its own too
+    for step in flows.steps():
+        step.handler = wrap_handler(step.handler, 'message')
+        count += 1
+    if profiling.PROFILE_HANDLERS:
+        instrument_http()
+        profiling.start_watchdog()
+    logging.info(f"Instrumented {count} bot handlers{' with profiling' if profiling.PROFILE_HANDLERS else ''}")
+    return count
+
+
+def _telegram_status(error):
+    if isinstance(error, apihelper.ApiTelegramException):
+        return str(error.error_code)
+    if isinstance(error, apihelper.ApiHTTPException):
+        return str(error.result.status_code)
+    if isinstance(error, requests.exceptions.Timeout):
+        return 'timeout'
+    return 'error'
+
+
+def instrument_telegram_api():
+    """Time every outbound Bot API request by method and outcome"""
+    global _original_make_request
+    if _original_make_request is not None:
+        return
+    _original_make_request = apihelper._make_request
+
+    @functools.wraps(_original_make_request)
+    def timed_make_request(token, method_name, *args, **kwargs):
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            with profiling.external_call('telegram'):
+                return _original_make_request(token, method_name, *args, **kwargs)
+        except Exception as e:
+            status = _telegram_status(e)
+            raise
+        finally:
+            TELEGRAM_REQUEST_DURATION.observe(time.perf_counter() - start, method=method_name, status=status)
+            if method_name == 'getUpdates':
+                # Each long-poll reply is a heartbeat for the polling loop
+                heartbeat.beat(heartbeat.POLLING_JOB, max_runtime=heartbeat.POLLING_STALE_AFTER)
+                if status == 'ok':
+                    heartbeat.success(heartbeat.POLLING_JOB)
+                else:
+                    heartbeat.failure(heartbeat.POLLING_JOB, status)
+
+    apihelper._make_request = timed_make_request
+
+
+def instrument_http():
+    """Attribute outbound HTTP requests (other than Bot API calls) to the running handler"""
+    global _original_session_send
+    if _original_session_send is not None:
+        return
+    _original_session_send = requests.Session.send
+
+    @functools.wraps(_original_session_send)
+    def timed_send(self, request, **kwargs):
+        with profiling.external_call('http'):
+            return _original_session_send(self, request, **kwargs)
+
+    requests.Session.send = timed_send
@@ -0,0 +1,265 @@
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import deque
+import heartbeat
+import metrics
+
+INVITE_POOL_SIZE = int(os.getenv('INVITE_POOL_SIZE', '5'))  # Links kept ready per group
+INVITE_LINK_LIFETIME = int(os.getenv('INVITE_LINK_LIFETIME', str(6 * 3600)))  # Seconds a pooled link stays valid
+INVITE_LINK_MIN_REMAINING = 1800  # Links closer than this to expiring are revoked instead of handed out
+INVITE_MINT_INTERVAL = 1.0  # Seconds between background link creations, to stay clear of Telegram limits
+INVITE_REFILL_INTERVAL = 300  # Seconds between pool checks when no link is taken
+# Links send join requests the bot approves for active members, instead of admitting
+# whoever holds them; Telegram doesn't allow a member limit on such links
+INVITE_JOIN_REQUESTS = os.getenv('INVITE_JOIN_REQUESTS', 'true').lower() == 'true'
+JOB_NAME = 'invite_pool'
+
+POOL_SIZE = metrics.gauge('ptabot_invite_pool_links', 'Pre-created invite links ready to hand out', ('group',))
+POOL_MISSES = metrics.counter('ptabot_invite_pool_misses_total', 'Invite links created on demand because the pool was empty', ('group',))
+
+_pools = {}
+_revocations = []  # Heap of (due, chat_id, invite_link)
+_revocations_lock = threading.Lock()
+_issued = {}  # invite_link -> user_id it was handed to, until it is revoked
+_wake = threading.Event()
+_bot = None
+_started = False
+_collection = None  # Every link the pool created and hasn't revoked yet, so a restart can pick them up
+
+
+class InvitePool:
+    """Invite links for one group, created ahead of time
+
+    take() hands out the oldest ready link without calling Telegram; a
+    background thread tops the pool back up to its size, one creation at
+    a time, and revokes links that are about to expire unused. Links are
+    stored as they are created, so they outlive a restart.
+    """
+
+    def __init__(self, bot, chat_id, size=INVITE_POOL_SIZE, lifetime=INVITE_LINK_LIFETIME):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.size = size
+        self.lifetime = lifetime
+        self._links = deque()  # (invite_link, expire_date), oldest first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._links)
+
+    def create_link(self, name=None):
+        """Create an invite link directly through the Bot API"""
+        expire_date = int(time.time() + self.lifetime)
+        new_invite = self.bot.create_chat_invite_link(
+            self.chat_id,
+            name=name or f"Pool {time.strftime('%Y-%m-%d %H:%M')}",
+            creates_join_request=INVITE_JOIN_REQUESTS,
+            member_limit=None if INVITE_JOIN_REQUESTS else 1,
+            expire_date=expire_date
+        )
+        return new_invite.invite_link, expire_date
+
+    def _pop_stale(self, now):
+        """Remove and return ready links too close to expiring to hand out"""
+        stale = []
+        while self._links and self._links[0][1] - now < INVITE_LINK_MIN_REMAINING:
+            stale.append(self._links.popleft()[0])
+        return stale
+
+    def take(self):
+        """Return a ready invite link, or None if the pool is empty"""
+        with self._lock:
+            stale = self._pop_stale(time.time())
+            link = self._links.popleft()[0] if self._links else None
+        for invite_link in stale:
+            revoke_later(self.chat_id, invite_link, 0)
+        _wake.set()
+        return link
+
+    def prune(self):
+        """Revoke ready links that are about to expire"""
+        with self._lock:
+            stale = self._pop_stale(time.time())
+        for invite_link in stale:
+            revoke_later(self.chat_id, invite_link, 0)
+        return len(stale)
+
+    def refill(self):
+        """Create links until the pool is full; returns how many were created"""
+        created = 0
+        while len(self._links) < self.size:
+            link = self.create_link()
+            _store(link[0], self.chat_id, link[1], 'ready')
+            with self._lock:
+                self._links.append(link)
+            created += 1
+            time.sleep(INVITE_MINT_INTERVAL)
+        return created
+
+
+def _store(invite_link, chat_id, expire_date, state, **fields):
+    if _collection is None:
+        return
+    try:
+        _collection.replace_one(
+            {'_id': invite_link},
+            {'_id': invite_link, 'chat_id': chat_id, 'expire_date': expire_date, 'state': state, **fields},
+            upsert=True
+        )
+    except Exception as e:
+        logging.error(f"Error saving invite link for {chat_id}: {e}")
+
+
+def _update(invite_link, fields):
+    if _collection is None:
+        return
+    try:
+        _collection.update_one({'_id': invite_link}, {'$set': fields})
+    except Exception as e:
+        logging.error(f"Error updating saved invite link: {e}")
+
+
+def _forget(invite_link):
+    if _collection is None:
+        return
+    try:
+        _collection.delete_one({'_id': invite_link})
+    except Exception as e:
+        logging.error(f"Error deleting saved invite link: {e}")
+
+
+def revoke_later(chat_id, invite_link, delay):
+    """Revoke an invite link from the background thread after delay seconds"""
+    due = time.time() + delay
+    with _revocations_lock:
+        heapq.heappush(_revocations, (due, chat_id, invite_link))
+    _update(invite_link, {'revoke_at': due})
+    _wake.set()
+
+
+def _revoke_due(now):
+    while True:
+        with _revocations_lock:
+            if not _revocations or _revocations[0][0] > now:
+                return _revocations[0][0] if _revocations else None
+            _, chat_id, invite_link = heapq.heappop(_revocations)
+        _issued.pop(invite_link, None)
+        try:
+            _bot.revoke_chat_invite_link(chat_id, invite_link)
+        except Exception as e:
+            logging.error(f"Error revoking invite link for {chat_id}: {e}")
+        _forget(invite_link)
+
+
+def take_invite_link(chat_id, name=None, user_id=None):
+    """Return an invite link for a group, from the pool when it has one
+
+    Falls back to creating the link on the spot (named name) when the
+    pool is empty or the group has no pool. The link is remembered as
+    issued to user_id until it is revoked.
+    """
+    pool = _pools.get(chat_id)
+    link = pool.take() if pool is not None else None
+    if link:
+        _update(link, {'state': 'issued', 'user_id': user_id})
+    else:
+        if pool is not None:
+            POOL_MISSES.inc(group=str(chat_id))
+            logging.warning(f"Invite pool for {chat_id} is empty, creating a link on demand")
+        link, expire_date = (pool or InvitePool(_bot, chat_id)).create_link(name)
+        _store(link, chat_id, expire_date, 'issued', user_id=user_id)
+    if user_id is not None:
+        _issued[link] = user_id
+    return link
+
+
+def issued_to(invite_link):
+    """Return the user an invite link was handed to, or None"""
+    return _issued.get(invite_link)
+
+
+def status():
+    """Return how many links are ready per group"""
+    return {chat_id: len(pool) for chat_id, pool in _pools.items()}
+
+
+def _worker():
+    logging.info(f"Invite pool thread started for {len(_pools)} groups")
+    while True:
+        _wake.clear()
+        heartbeat.beat(JOB_NAME)
+        failed = False
+        for pool in list(_pools.values()):
+            try:
+                _revoke_due(time.time())
+                pool.prune()
+                created = pool.refill()
+                if created:
+                    logging.info(f"Added {created} invite links to the pool for {pool.chat_id}")
+            except Exception as e:
+                failed = True
+                logging.error(f"Error refilling invite pool for {pool.chat_id}: {e}")
+                heartbeat.failure(JOB_NAME, e)
+        next_due = _revoke_due(time.time())
+        if not failed:
+            heartbeat.success(JOB_NAME)
+        wait = INVITE_REFILL_INTERVAL if next_due is None else max(0.0, min(INVITE_REFILL_INTERVAL, next_due - time.time()))
+        heartbeat.expect(JOB_NAME, wait)
+        _wake.wait(wait)
+
+
+def _restore():
+    """Pick up the links a previous run created: ready ones go back into their pool, the rest get revoked
+
+    The Bot API can't list a chat's invite links, so the stored copy is the
+    only way to find them again.
+    """
+    now = time.time()
+    try:
+        # Telegram has already expired these
+        _collection.delete_many({'expire_date': {'$lte': now}})
+        docs = sorted(_collection.find(), key=lambda doc: doc['expire_date'])
+    except Exception as e:
+        logging.error(f"Error loading saved invite links: {e}")
+        return
+    reused = 0
+    for doc in docs:
+        invite_link, chat_id = doc['_id'], doc['chat_id']
+        if doc.get('user_id') is not None:
+            _issued[invite_link] = doc['user_id']
+        pool = _pools.get(chat_id)
+        if 'revoke_at' in doc:
+            with _revocations_lock:
+                heapq.heappush(_revocations, (doc['revoke_at'], chat_id, invite_link))
+        elif doc.get('state') == 'ready':
+            if pool is not None and len(pool) < pool.size:
+                with pool._lock:
+                    pool._links.append((invite_link, doc['expire_date']))
+                reused += 1
+            else:
+                revoke_later(chat_id, invite_link, 0)
+    if docs:
+        logging.info(f"Loaded {len(docs)} saved invite links, {reused} back into the pools")
+
+
+def start(bot, chat_ids, size=INVITE_POOL_SIZE, collection=None):
+    """Create a pool for each group and start filling them in the background
+
+    With a collection, links are stored as they are created and links left
+    over from the previous run are reused or revoked.
+    """
+    global _bot, _started, _collection
+    _bot = bot
+    for chat_id in chat_ids:
+        if chat_id and chat_id not in _pools:
+            _pools[chat_id] = InvitePool(bot, chat_id, size)
+            POOL_SIZE.set_function(_pools[chat_id].__len__, group=str(chat_id))
+    if collection is not None and _collection is None:
+        _collection = collection
+        _restore()
+    if not _started:
+        _started = True
+        threading.Thread(target=_worker, name='invite-pool', daemon=True).start()
@@ -1,7 +1,11 @@
-from flask import Flask, render_template_string, request, jsonify, redirect, url_for, session, flash
+from flask import Flask, render_template_string, request, jsonify, redirect, url_for, session, flash, Response, stream_with_context
 from threading import Thread
+from collections import deque
+import itertools
+import json
+import queue
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 import os
 import secrets
@@ -10,6 +14,13 @@ from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 import requests
+import database
+import flows
+import heartbeat
+import metrics
+import profiling
+from log_archive import LogArchiveHandler
+from mongo_monitor import command_listener
 
 os.environ['TZ'] = 'Asia/Manila'
 
@@ -33,6 +44,7 @@ app.secret_key = os.getenv('FLASK_SECRET_KEY', secrets.token_hex(16))  # Generat
 
 ADMIN_USERNAME = os.getenv('ADMIN_USERNAME')
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD')  # Change this to a strong password
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # Bearer token that lets a scraper read /metrics without logging in
 
 # Login required decorator
 def login_required(f):
@@ -48,12 +60,27 @@ def login_required(f):
 # Disable Flask default logging for non-errors
 app.logger.setLevel(logging.ERROR)
 
-# Create a StringIO object to capture logs
+# Live log stream settings
+LOG_STREAM_BACKLOG = int(os.getenv('LOG_STREAM_BACKLOG', '500'))  # Max queued entries per subscriber
+LOG_STREAM_HEARTBEAT = 15  # Seconds between keep-alive comments
+
+class LogSubscriber:
+    """A live log stream client with its own bounded queue"""
+    def __init__(self, levels=None, backlog=LOG_STREAM_BACKLOG):
+        self.queue = queue.Queue(maxsize=backlog)
+        self.levels = levels
+        self.overflowed = False
+
+# Keep the most recent log records in memory for the web logs page
 class WebLoggingHandler(logging.Handler):
     def __init__(self, max_entries=1000):
         super().__init__()
-        self.log_entries = []
+        # Ring buffer, oldest first - appending evicts the oldest entry in O(1)
+        self.log_entries = deque(maxlen=max_entries)
         self.max_entries = max_entries
+        self.last_seq = 0
+        self._seq_counter = itertools.count(1)
+        self.subscribers = set()
         
     def emit(self, record):
         try:
@@ -74,21 +101,88 @@ class WebLoggingHandler(logging.Handler):
             timestamp = manila_tz.localize(timestamp) if timestamp.tzinfo is None else timestamp.astimezone(manila_tz)
             formatted_time = timestamp.strftime('%Y-%m-%d %I:%M:%S %p')
             
-            # Store both formatted log and metadata
+            # Store both formatted log and metadata, tagged with a
+            # monotonically increasing sequence number for incremental polling
+            seq = next(self._seq_counter)
             log_data = {
+                'seq': seq,
                 'message': log_entry,
                 'level': level_name,
                 'timestamp': formatted_time
             }
             
-            # Add to the beginning for reverse chronological order
-            self.log_entries.insert(0, log_data)
+            # emit() runs under the handler lock, so readers holding the
+            # same lock always see a consistent buffer
+            self.log_entries.append(log_data)
+            self.last_seq = seq
             
-            # Trim if exceeded max entries
-            if len(self.log_entries) > self.max_entries:
-                self.log_entries = self.log_entries[:self.max_entries]
+            # Fan the entry out to live stream subscribers
+            for subscriber in list(self.subscribers):
+                if subscriber.levels is not None and level_name not in subscriber.levels:
+                    continue
+                try:
+                    subscriber.queue.put_nowait(log_data)
+                except queue.Full:
+                    self._drop_subscriber(subscriber)
         except Exception:
             self.handleError(record)
+    
+    def _drop_subscriber(self, subscriber):
+        """Disconnect a subscriber that fell too far behind"""
+        # It reconnects with its last event id and catches up from the ring buffer
+        subscriber.overflowed = True
+        self.subscribers.discard(subscriber)
+        try:
+            subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(None)
+        except (queue.Empty, queue.Full):
+            pass
+    
+    def subscribe(self, after=0, levels=None):
+        """Register a live subscriber and return it with the entries it missed, oldest first"""
+        subscriber = LogSubscriber(levels=levels)
+        self.acquire()
+        try:
+            # Taking the backlog and registering under the same lock means
+            # no entry is missed or delivered twice
+            missed = self.get_entries(after=after, levels=levels) if after else []
+            self.subscribers.add(subscriber)
+        finally:
+            self.release()
+        missed.reverse()
+        return subscriber, missed
+    
+    def unsubscribe(self, subscriber):
+        """Remove a live subscriber"""
+        self.acquire()
+        try:
+            self.subscribers.discard(subscriber)
+        finally:
+            self.release()
+    
+    def get_entries(self, after=0, levels=None):
+        """Return entries newer than the given sequence number, newest first"""
+        entries = []
+        self.acquire()
+        try:
+            # Walk back from the newest entry so the cost is proportional
+            # to the number of new entries, not the size of the buffer
+            for log_data in reversed(self.log_entries):
+                if log_data['seq'] <= after:
+                    break
+                if levels is None or log_data['level'] in levels:
+                    entries.append(log_data)
+        finally:
+            self.release()
+        return entries
+    
+    def clear(self):
+        """Remove all buffered entries (sequence numbers keep increasing)"""
+        self.acquire()
+        try:
+            self.log_entries.clear()
+        finally:
+            self.release()
 
 # Create the handler
 web_handler = WebLoggingHandler(max_entries=1000)
@@ -98,9 +192,18 @@ web_handler.setLevel(logging.INFO)
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 web_handler.setFormatter(formatter)
 
-# Get the root logger and add our handler
+# Archive every record to a searchable SQLite database
+archive_handler = LogArchiveHandler()
+archive_handler.setLevel(logging.INFO)
+archive_handler.setFormatter(formatter)
+
+# Get the root logger and add our handlers
 root_logger = logging.getLogger()
 root_logger.addHandler(web_handler)
+root_logger.addHandler(archive_handler)
+
+metrics.QUEUE_DEPTH.set_function(archive_handler.records.qsize, queue='log_archive')
+metrics.QUEUE_DEPTH.set_function(lambda: len(web_handler.subscribers), queue='log_stream_subscribers')
 
 # HTML template for the logs page - modern and professional design
 LOGS_TEMPLATE = '''
@@ -513,6 +616,17 @@ LOGS_TEMPLATE = '''
                             <input type="text" id="search-box" class="form-control" placeholder="Type to search...">
                         </div>
                         
+                        <div class="mb-3">
+                            <label class="form-label">Search Archive</label>
+                            <input type="text" id="archive-query" class="form-control mb-2" placeholder='Words, "phrases" or prefix*'>
+                            <input type="number" id="archive-user-id" class="form-control mb-2" placeholder="User ID (optional)">
+                            <div class="d-grid">
+                                <button id="archive-search" class="btn btn-sm btn-outline-secondary">
+                                    <i class="bi bi-archive"></i> Search All Logs
+                                </button>
+                            </div>
+                        </div>
+                        
                         <div class="d-grid gap-2">
                             <button id="clear-logs" class="btn btn-outline-danger">
                                 <i class="bi bi-trash"></i> Clear Logs
@@ -543,7 +657,7 @@ LOGS_TEMPLATE = '''
                     <div class="card-body" style="max-height: 800px; overflow-y: auto;" id="logs-container">
                         {% if logs %}
                             {% for log in logs %}
-                                <div class="log-entry log-{{ log.level.lower() }}">
+                                <div class="log-entry log-{{ log.level.lower() }}" data-seq="{{ log.seq }}">
                                     <span class="log-level">{{ log.level }}</span>
                                     <span class="log-timestamp">{{ log.timestamp }}</span>
                                     <span class="log-message">{{ log.message }}</span>
@@ -564,6 +678,11 @@ LOGS_TEMPLATE = '''
     <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/js/bootstrap.bundle.min.js"></script>
     <script>
         document.addEventListener('DOMContentLoaded', function() {
+            // Sequence number of the newest entry we have rendered
+            let lastSeq = {{ last_seq }};
+            const MAX_RENDERED_ENTRIES = 1000;
+            const EMPTY_STATE_HTML = '<div class="empty-state"><i class="bi bi-exclamation-circle" style="font-size: 2rem;"></i><p class="mt-3">No log entries found</p></div>';
+            
             // Filter logs by level
             const levelFilters = document.querySelectorAll('.level-filter');
             levelFilters.forEach(filter => {
@@ -572,8 +691,9 @@ LOGS_TEMPLATE = '''
                     levelFilters.forEach(btn => btn.classList.remove('active'));
                     this.classList.add('active');
                     
-                    const level = this.getAttribute('data-level');
-                    filterLogs();
+                    // Reload from the server with the new level filter
+                    stopAutoRefresh();
+                    fetchLogs(true).then(startAutoRefresh);
                 });
             });
             
@@ -609,11 +729,66 @@ LOGS_TEMPLATE = '''
                         .then(response => response.text())
                         .then(() => {
                             const logsContainer = document.getElementById('logs-container');
-                            logsContainer.innerHTML = '<div class="empty-state"><i class="bi bi-exclamation-circle" style="font-size: 2rem;"></i><p class="mt-3">No log entries found</p></div>';
+                            logsContainer.innerHTML = EMPTY_STATE_HTML;
                         });
                 }
             });
             
+            function escapeHtml(value) {
+                return String(value)
+                    .replace(/&/g, '&amp;')
+                    .replace(/</g, '&lt;')
+                    .replace(/>/g, '&gt;');
+            }
+            
+            // Search the persistent archive - pauses live updates while results are shown
+            document.getElementById('archive-search').addEventListener('click', function() {
+                const params = new URLSearchParams();
+                const query = document.getElementById('archive-query').value.trim();
+                const userId = document.getElementById('archive-user-id').value.trim();
+                const selectedLevel = document.querySelector('.level-filter.active').getAttribute('data-level');
+                if (query) params.set('q', query);
+                if (userId) params.set('user_id', userId);
+                if (selectedLevel !== 'all') params.set('level', selectedLevel);
+                
+                autoRefreshToggle.checked = false;
+                stopAutoRefresh();
+                
+                fetch('/logs/search?' + params.toString())
+                    .then(response => response.json())
+                    .then(data => {
+                        const logsContainer = document.getElementById('logs-container');
+                        if (!data.success) {
+                            alert(data.message || 'Search failed');
+                            return;
+                        }
+                        if (data.logs.length === 0) {
+                            logsContainer.innerHTML = EMPTY_STATE_HTML;
+                            return;
+                        }
+                        logsContainer.innerHTML = data.logs.map(log => `
+                            <div class="log-entry log-${log.level.toLowerCase()}">
+                                <span class="log-level">${log.level}</span>
+                                <span class="log-timestamp">${log.timestamp}</span>
+                                <span class="log-message">${escapeHtml(log.message)}</span>
+                            </div>
+                        `).join('');
+                    })
+                    .catch(error => console.error('Error searching log archive:', error));
+            });
+            
+            // Fetch entries from the server - only new ones unless a full reload is requested
+            function fetchLogs(fullReload) {
+                const params = new URLSearchParams();
+                if (!fullReload) params.set('after', lastSeq);
+                const selectedLevel = document.querySelector('.level-filter.active').getAttribute('data-level');
+                if (selectedLevel !== 'all') params.set('level', selectedLevel);
+                
+                return fetch('/logs/data?' + params.toString())
+                    .then(response => response.json())
+                    .then(data => updateLogs(data, fullReload));
+            }
+            
             // Auto-refresh functionality
             const refreshBtn = document.getElementById('refresh-logs');
             const autoRefreshToggle = document.getElementById('auto-refresh');
@@ -622,10 +797,8 @@ LOGS_TEMPLATE = '''
                 const icon = refreshBtn.querySelector('i');
                 icon.classList.add('refresh-animation');
                 
-                fetch('/logs/data')
-                    .then(response => response.json())
-                    .then(data => {
-                        updateLogs(data);
+                fetchLogs(false)
+                    .then(() => {
                         icon.classList.remove('refresh-animation');
                     })
                     .catch(error => {
@@ -634,11 +807,18 @@ LOGS_TEMPLATE = '''
                     });
             });
             
-            function updateLogs(data) {
+            function updateLogs(data, fullReload) {
                 const logsContainer = document.getElementById('logs-container');
+                lastSeq = data.last_seq;
+                
+                if (fullReload) {
+                    logsContainer.innerHTML = '';
+                }
                 
                 if (data.logs.length === 0) {
-                    logsContainer.innerHTML = '<div class="empty-state"><i class="bi bi-exclamation-circle" style="font-size: 2rem;"></i><p class="mt-3">No log entries found</p></div>';
+                    if (!logsContainer.querySelector('.log-entry')) {
+                        logsContainer.innerHTML = EMPTY_STATE_HTML;
+                    }
                     return;
                 }
                 
@@ -646,40 +826,57 @@ LOGS_TEMPLATE = '''
                 data.logs.forEach(log => {
                     const level = log.level.toLowerCase();
                     logsHtml += `
-                        <div class="log-entry log-${level}">
+                        <div class="log-entry log-${level}" data-seq="${log.seq}">
                             <span class="log-level">${log.level}</span>
                             <span class="log-timestamp">${log.timestamp}</span>
-                            <span class="log-message">${log.message}</span>
+                            <span class="log-message">${escapeHtml(log.message)}</span>
                         </div>
                     `;
                 });
                 
-                logsContainer.innerHTML = logsHtml;
+                // New entries go on top (newest first)
+                const emptyState = logsContainer.querySelector('.empty-state');
+                if (emptyState) emptyState.remove();
+                logsContainer.insertAdjacentHTML('afterbegin', logsHtml);
+                
+                // Keep the page bounded like the server-side buffer
+                const entries = logsContainer.querySelectorAll('.log-entry');
+                for (let i = MAX_RENDERED_ENTRIES; i < entries.length; i++) {
+                    entries[i].remove();
+                }
                 
                 // Reapply filters after update
                 filterLogs();
             }
             
-            // Set up auto-refresh interval
-            let refreshInterval;
+            // Live updates are pushed over Server-Sent Events
+            let logStream = null;
             
             function startAutoRefresh() {
-                if (autoRefreshToggle.checked) {
-                    refreshInterval = setInterval(() => {
-                        fetch('/logs/data')
-                            .then(response => response.json())
-                            .then(data => {
-                                updateLogs(data);
-                            })
-                            .catch(error => {
-                                console.error('Error auto-refreshing logs:', error);
-                            });
-                    }, 5000); // Refresh every 5 seconds
+                if (autoRefreshToggle.checked && !logStream) {
+                    const params = new URLSearchParams({after: lastSeq});
+                    const selectedLevel = document.querySelector('.level-filter.active').getAttribute('data-level');
+                    if (selectedLevel !== 'all') params.set('level', selectedLevel);
+                    
+                    logStream = new EventSource('/logs/stream?' + params.toString());
+                    logStream.onmessage = function(event) {
+                        const log = JSON.parse(event.data);
+                        if (log.seq > lastSeq) {
+                            updateLogs({logs: [log], last_seq: log.seq}, false);
+                        }
+                    };
+                    logStream.onerror = function(error) {
+                        // EventSource reconnects by itself and resumes from the last event id
+                        console.error('Log stream interrupted, reconnecting:', error);
+                    };
                 }
             }
             
             function stopAutoRefresh() {
-                clearInterval(refreshInterval);
+                if (logStream) {
+                    logStream.close();
+                    logStream = null;
+                }
             }
             
             autoRefreshToggle.addEventListener('change', function() {
@@ -701,6 +898,7 @@ LOGS_TEMPLATE = '''
 @app.route('/')
 @login_required
 def home():
+    stale_jobs = heartbeat.stale_jobs()
     return render_template_string('''
         <!DOCTYPE html>
         <html lang="en">
@@ -721,6 +919,7 @@ def home():
                     --muted-text: #9CA3AF;
                     --border-color: #2D3748;
                     --success-color: #10B981;
+                    --warning-color: #FBBF24;
                 }
                 
                 body {
@@ -914,8 +1113,13 @@ def home():
                     <p class="welcome-subtitle">Prodigy Trading Academy Telegram Bot Dashboard</p>
                     
                     <div class="d-flex justify-content-center align-items-center mb-4">
+                        {% if stale_jobs %}
+                        <span class="status-indicator" style="background-color: var(--warning-color); animation: none;"></span>
+                        <span class="status-text">Stalled background jobs: {{ stale_jobs|join(', ') }}</span>
+                        {% else %}
                         <span class="status-indicator"></span>
                         <span class="status-text">Bot is currently operational</span>
+                        {% endif %}
                     </div>
                     
                     <a href="/logs" class="btn btn-primary">
@@ -927,7 +1131,7 @@ def home():
             <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/js/bootstrap.bundle.min.js"></script>
         </body>
         </html>
-    ''')
+    ''', stale_jobs=stale_jobs)
 
 DASHBOARD_TEMPLATE = '''
 <!DOCTYPE html>
@@ -1472,6 +1676,44 @@ DASHBOARD_TEMPLATE = '''
             </div>
         </div>
         
+        <!-- Paid member breakdowns -->
+        <div class="row mb-4">
+            <div class="col-md-6">
+                <div class="card">
+                    <div class="card-header">
+                        <i class="bi bi-diagram-3"></i> Paid Members by Plan
+                    </div>
+                    <div class="card-body">
+                        {% for row in plan_breakdown %}
+                            <div class="member-detail">
+                                <span class="detail-label">{{ row.name }}</span>
+                                <span class="detail-value">{{ row.count }}</span>
+                            </div>
+                        {% else %}
+                            <p class="text-muted mb-0">No paid members yet</p>
+                        {% endfor %}
+                    </div>
+                </div>
+            </div>
+            <div class="col-md-6">
+                <div class="card">
+                    <div class="card-header">
+                        <i class="bi bi-credit-card"></i> Paid Members by Payment Method
+                    </div>
+                    <div class="card-body">
+                        {% for row in payment_method_breakdown %}
+                            <div class="member-detail">
+                                <span class="detail-label">{{ row.name }}</span>
+                                <span class="detail-value">{{ row.count }}</span>
+                            </div>
+                        {% else %}
+                            <p class="text-muted mb-0">No paid members yet</p>
+                        {% endfor %}
+                    </div>
+                </div>
+            </div>
+        </div>
+        
         <!-- Current time display and search -->
         <div class="row mb-3">
             <div class="col-md-6">
@@ -1494,9 +1736,15 @@ DASHBOARD_TEMPLATE = '''
             <div class="col-md-6">
                 <div class="card">
                     <div class="card-body">
-                        <div class="search-container">
-                            <input type="text" id="search-box" placeholder="Search members..." onkeyup="searchMembers()">
-                            <i class="bi bi-search search-icon"></i>
+                        <div class="d-flex align-items-center">
+                            <div class="search-container flex-grow-1 me-2">
+                                <input type="text" id="search-box" placeholder="Search by username or user ID..." oninput="searchMembers()">
+                                <i class="bi bi-search search-icon"></i>
+                            </div>
+                            <select id="sort-select" class="form-select w-auto" onchange="reloadAllMembers()">
+                                <option value="due_date">Sort by end date</option>
+                                <option value="user_id">Sort by user ID</option>
+                            </select>
                         </div>
                     </div>
                 </div>
@@ -1530,88 +1778,26 @@ DASHBOARD_TEMPLATE = '''
                         <div class="tab-content" id="membershipTabContent">
                             <!-- Active Members Tab -->
                             <div class="tab-pane fade show active" id="active" role="tabpanel" aria-labelledby="active-tab">
-                                {% if active_memberships %}
-                                    {% for member in active_memberships %}
-                                        <!-- For Active Members Tab -->
-                                        <div class="membership-card membership-active">
-                                                <div class="d-flex justify-content-between align-items-start">
-                                                    <div>
-                                                        <h5 class="membership-name">
-                                                            {{ member.name }}
-                                                            {% if member.cancelled %}
-                                                            <span class="badge-cancelled">CANCELLED</span>
-                                                            {% endif %}
-                                                        </h5>
-                                                        <span class="membership-plan">{{ member.plan }}</span>
-                                                        <span class="days-remaining days-active">{{ member.days_remaining }} days left</span>
-                                                    </div>
-                                                </div>
-                                            <div class="membership-dates mt-2">
-                                                <div>End: <strong>{{ member.end_date }}</strong></div>
-                                            </div>
-                                        </div>
-                                    {% endfor %}
-                                {% else %}
-                                    <div class="empty-state">
-                                        <i class="bi bi-people"></i>
-                                        <p>No active memberships found</p>
-                                    </div>
-                                {% endif %}
+                                <div class="member-list" data-status="active"></div>
+                                <div class="text-center mt-3">
+                                    <button class="btn btn-outline-secondary load-more d-none" data-status="active">Load more</button>
+                                </div>
                             </div>
                             
                             <!-- Expiring Soon Tab -->
                             <div class="tab-pane fade" id="expiring" role="tabpanel" aria-labelledby="expiring-tab">
-                                {% if expiring_soon %}
-                                    {% for member in expiring_soon %}
-                                        <div class="membership-card membership-expiring">
-                                                <div class="d-flex justify-content-between align-items-start">
-                                                    <div>
-                                                        <h5 class="membership-name">
-                                                            {{ member.name }}
-                                                            {% if member.cancelled %}
-                                                            <span class="badge-cancelled">CANCELLED</span>
-                                                            {% endif %}
-                                                        </h5>
-                                                        <span class="membership-plan">{{ member.plan }}</span>
-                                                        <span class="days-remaining days-expiring">{{ member.days_remaining }} days left</span>
-                                                    </div>
-                                                </div>
-                                            <div class="membership-dates mt-2">
-                                                <div>End: <strong>{{ member.end_date }}</strong></div>
-                                            </div>
-                                        </div>
-                                    {% endfor %}
-                                {% else %}
-                                    <div class="empty-state">
-                                        <i class="bi bi-clock"></i>
-                                        <p>No memberships expiring soon</p>
-                                    </div>
-                                {% endif %}
+                                <div class="member-list" data-status="expiring"></div>
+                                <div class="text-center mt-3">
+                                    <button class="btn btn-outline-secondary load-more d-none" data-status="expiring">Load more</button>
+                                </div>
                             </div>
                             
                             <!-- Expired Tab -->
                             <div class="tab-pane fade" id="expired" role="tabpanel" aria-labelledby="expired-tab">
-                                {% if expired_memberships %}
-                                    {% for member in expired_memberships %}
-                                        <div class="membership-card membership-expired">
-                                                <div class="d-flex justify-content-between align-items-start">
-                                                    <div>
-                                                        <h5 class="membership-name">{{ member.name }}</h5>
-                                                        <span class="membership-plan">{{ member.plan }}</span>
-                                                        <span class="days-remaining days-expired">Expired</span>
-                                                    </div>
-                                                </div>
-                                            <div class="membership-dates mt-2">
-                                                <div>End: <strong>{{ member.end_date }}</strong></div>
-                                            </div>
-                                        </div>
-                                    {% endfor %}
-                                {% else %}
-                                    <div class="empty-state">
-                                        <i class="bi bi-person-x"></i>
-                                        <p>No expired memberships found</p>
-                                    </div>
-                                {% endif %}
+                                <div class="member-list" data-status="expired"></div>
+                                <div class="text-center mt-3">
+                                    <button class="btn btn-outline-secondary load-more d-none" data-status="expired">Load more</button>
+                                </div>
                             </div>
                         </div>
                     </div>
@@ -1668,10 +1854,10 @@ DASHBOARD_TEMPLATE = '''
                 </div>
                     <div class="modal-footer d-flex justify-content-between">
                         <div>
-                            <button type="button" class="btn btn-danger" onclick="confirmAction('kick', memberDataCurrent.userId)">
+                            <button type="button" class="btn btn-danger" onclick="confirmAction('kick', memberDataCurrent.user_id)">
                                 <i class="bi bi-x-circle me-1"></i> Kick Member
                             </button>
-                            <button type="button" class="btn btn-warning" onclick="confirmAction('grace', memberDataCurrent.userId)">
+                            <button type="button" class="btn btn-warning" onclick="confirmAction('grace', memberDataCurrent.user_id)">
                                 <i class="bi bi-clock me-1"></i> Give Grace Period
                             </button>
                         </div>
@@ -1744,155 +1930,125 @@ DASHBOARD_TEMPLATE = '''
             });
         }
 
-        function searchMembers() {
-            // Get the search term
-            const searchTerm = document.getElementById('search-box').value.toLowerCase();
-            
-            // Get all membership cards
-            const membershipCards = document.querySelectorAll('.membership-card');
-            
-            // Loop through the cards and hide/show based on the search term
-            membershipCards.forEach(card => {
-                const cardContent = card.textContent.toLowerCase();
-                if (cardContent.includes(searchTerm)) {
-                    card.style.display = 'block';
-                } else {
-                    card.style.display = 'none';
-                }
-            });
-            
-            // Show empty state message if no results in active tab
-            const activeTab = document.querySelector('.tab-pane.active');
-            const visibleCards = activeTab.querySelectorAll('.membership-card[style="display: block;"]');
-            const emptyState = activeTab.querySelector('.empty-state');
-            
-            if (visibleCards.length === 0 && searchTerm) {
-                // If there's an existing empty state, update its message
-                if (emptyState) {
-                    emptyState.querySelector('p').textContent = 'No members found matching your search';
-                } else {
-                    // Create a new empty state
-                    const newEmptyState = document.createElement('div');
-                    newEmptyState.className = 'empty-state';
-                    newEmptyState.innerHTML = `
-                        <i class="bi bi-search"></i>
-                        <p>No members found matching your search</p>
-                    `;
-                    activeTab.appendChild(newEmptyState);
-                }
-            } else if (emptyState && !searchTerm) {
-                // Restore original message if search is cleared
-                if (activeTab.id === 'active') {
-                    emptyState.querySelector('p').textContent = 'No active memberships found';
-                } else if (activeTab.id === 'expiring') {
-                    emptyState.querySelector('p').textContent = 'No memberships expiring soon';
-                } else if (activeTab.id === 'expired') {
-                    emptyState.querySelector('p').textContent = 'No expired memberships found';
-                }
+        const MEMBER_STATUSES = ['active', 'expiring', 'expired'];
+        const EMPTY_MESSAGES = {
+            active: ['bi-people', 'No active memberships found'],
+            expiring: ['bi-clock', 'No memberships expiring soon'],
+            expired: ['bi-person-x', 'No expired memberships found']
+        };
+
+        // Members loaded so far and the cursor for the next page, per tab
+        const memberData = {active: [], expiring: [], expired: []};
+        const nextCursors = {active: null, expiring: null, expired: null};
+        let searchTimer = null;
+
+        function escapeHtml(value) {
+            return String(value)
+                .replace(/&/g, '&amp;')
+                .replace(/</g, '&lt;')
+                .replace(/>/g, '&gt;')
+                .replace(/"/g, '&quot;')
+                .replace(/'/g, '&#39;');
+        }
+
+        function renderMemberCard(category, member, index) {
+            const cancelledBadge = member.cancelled && category !== 'expired'
+                ? '<span class="badge-cancelled">CANCELLED</span>' : '';
+            const daysBadge = category === 'expired'
+                ? '<span class="days-remaining days-expired">Expired</span>'
+                : `<span class="days-remaining days-${category}">${member.days_remaining} days left</span>`;
+            return `
+                <div class="membership-card membership-${category}" onclick="showMemberDetails('${category}', ${index})">
+                    <div class="d-flex justify-content-between align-items-start">
+                        <div>
+                            <h5 class="membership-name">${escapeHtml(member.name)} ${cancelledBadge}</h5>
+                            <span class="membership-plan">${escapeHtml(member.plan)}</span>
+                            ${daysBadge}
+                        </div>
+                    </div>
+                    <div class="membership-dates mt-2">
+                        <div>End: <strong>${escapeHtml(member.end_date)}</strong></div>
+                    </div>
+                </div>
+            `;
+        }
+
+        function loadMembers(category, reset) {
+            const list = document.querySelector(`.member-list[data-status="${category}"]`);
+            const loadMoreBtn = document.querySelector(`.load-more[data-status="${category}"]`);
+
+            if (reset) {
+                memberData[category] = [];
+                nextCursors[category] = null;
+                list.innerHTML = '';
             }
+
+            const params = new URLSearchParams({
+                status: category,
+                sort: document.getElementById('sort-select').value
+            });
+            const searchTerm = document.getElementById('search-box').value.trim();
+            if (searchTerm) params.set('search', searchTerm);
+            if (nextCursors[category]) params.set('cursor', nextCursors[category]);
+
+            loadMoreBtn.classList.add('disabled');
+
+            fetch('/api/members?' + params.toString())
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success) {
+                        showNotification('Error', data.message || 'Failed to load members');
+                        return;
+                    }
+
+                    let html = '';
+                    data.members.forEach(member => {
+                        html += renderMemberCard(category, member, memberData[category].length);
+                        memberData[category].push(member);
+                    });
+                    list.insertAdjacentHTML('beforeend', html);
+
+                    if (memberData[category].length === 0) {
+                        const [icon, message] = searchTerm
+                            ? ['bi-search', 'No members found matching your search']
+                            : EMPTY_MESSAGES[category];
+                        list.innerHTML = `<div class="empty-state"><i class="bi ${icon}"></i><p>${message}</p></div>`;
+                    }
+
+                    nextCursors[category] = data.next_cursor;
+                    loadMoreBtn.classList.toggle('d-none', !data.next_cursor);
+                })
+                .catch(error => {
+                    showNotification('Error', 'An error occurred while loading members');
+                    console.error('Error:', error);
+                })
+                .finally(() => loadMoreBtn.classList.remove('disabled'));
         }
 
-        // Store all member data in a global variable for easy access
-        const memberData = {
-            active: [
-                {% for member in active_memberships %}
-                    {
-                        name: "{{ member.name }}",
-                        userId: "{{ member.user_id }}",
-                        plan: "{{ member.plan }}",
-                        startDate: "{{ member.start_date }}",
-                        endDate: "{{ member.end_date }}",
-                        daysRemaining: "{{ member.days_remaining }}",
-                        paymentMethod: "{{ member.payment_method }}",
-                        hasPaid: {% if member.has_paid %}true{% else %}false{% endif %},
-                        cancelled: {% if member.cancelled %}true{% else %}false{% endif %}
-                    }{% if not loop.last %},{% endif %}
-                {% endfor %}
-            ],
-            expiring: [
-                {% for member in expiring_soon %}
-                    {
-                        name: "{{ member.name }}",
-                        userId: "{{ member.user_id }}",
-                        plan: "{{ member.plan }}",
-                        startDate: "{{ member.start_date }}",
-                        endDate: "{{ member.end_date }}",
-                        daysRemaining: "{{ member.days_remaining }}",
-                        paymentMethod: "{{ member.payment_method }}",
-                        hasPaid: {% if member.has_paid %}true{% else %}false{% endif %},
-                        cancelled: {% if member.cancelled %}true{% else %}false{% endif %}
-                    }{% if not loop.last %},{% endif %}
-                {% endfor %}
-            ],
-            expired: [
-                {% for member in expired_memberships %}
-                    {
-                        name: "{{ member.name }}",
-                        userId: "{{ member.user_id }}",
-                        plan: "{{ member.plan }}",
-                        startDate: "{{ member.start_date }}",
-                        endDate: "{{ member.end_date }}",
-                        daysRemaining: "{{ member.days_remaining }}",
-                        paymentMethod: "{{ member.payment_method }}",
-                        hasPaid: {% if member.has_paid %}true{% else %}false{% endif %},
-                        cancelled: {% if member.cancelled %}true{% else %}false{% endif %}
-                    }{% if not loop.last %},{% endif %}
-                {% endfor %}
-            ]
-        };
+        function reloadAllMembers() {
+            MEMBER_STATUSES.forEach(category => loadMembers(category, true));
+        }
 
-        // Initialize the modal
-        const memberModal = new bootstrap.Modal(document.getElementById('memberDetailsModal'));
+        function searchMembers() {
+            // Debounce so we only query once the admin stops typing
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(reloadAllMembers, 300);
+        }
 
-        // Add click events to membership cards
         document.addEventListener('DOMContentLoaded', function() {
-            // Set up click handlers for active members
-            const activeCards = document.querySelectorAll('#active .membership-card');
-            activeCards.forEach((card, index) => {
-                card.addEventListener('click', () => showMemberDetails('active', index));
-            });
-            
-            // Set up click handlers for expiring members
-            const expiringCards = document.querySelectorAll('#expiring .membership-card');
-            expiringCards.forEach((card, index) => {
-                card.addEventListener('click', () => showMemberDetails('expiring', index));
-            });
-            
-            // Set up click handlers for expired members
-            const expiredCards = document.querySelectorAll('#expired .membership-card');
-            expiredCards.forEach((card, index) => {
-                card.addEventListener('click', () => showMemberDetails('expired', index));
+            document.querySelectorAll('.load-more').forEach(btn => {
+                btn.addEventListener('click', () => loadMembers(btn.getAttribute('data-status'), false));
             });
+            reloadAllMembers();
         });
 
-        // Function to show member details in the modal
-        function showMemberDetails(category, index) {
-            const member = memberData[category][index];
-            if (!member) return;
-            
-            // Update modal title
-            document.getElementById('memberDetailsModalLabel').textContent = `Member Details: ${member.name}`;
-            
-            // Populate member details
-            document.getElementById('member-name').textContent = member.name;
-            document.getElementById('member-id').textContent = member.userId;
-            document.getElementById('member-plan').textContent = member.plan;
-            document.getElementById('member-start-date').textContent = member.startDate;
-            document.getElementById('member-end-date').textContent = member.endDate;
-            document.getElementById('member-days-remaining').textContent = 
-                category === 'expired' ? 'Expired' : `${member.daysRemaining} days`;
-            document.getElementById('member-payment-method').textContent = member.paymentMethod;
-            document.getElementById('member-payment-status').textContent = member.hasPaid ? 'Paid' : 'Unpaid';
-            document.getElementById('member-cancellation').textContent = member.cancelled ? 'Cancelled' : 'Active';
-            
-            // Show the modal
-            memberModal.show();
-        }
+        // Initialize the modal
+        const memberModal = new bootstrap.Modal(document.getElementById('memberDetailsModal'));
 
         // Global variable to store currently displayed member data
         let memberDataCurrent = null;
 
-        // Update the showMemberDetails function
+        // Function to show member details in the modal
         function showMemberDetails(category, index) {
             const member = memberData[category][index];
             if (!member) return;
@@ -1905,14 +2061,14 @@ DASHBOARD_TEMPLATE = '''
             
             // Populate member details
             document.getElementById('member-name').textContent = member.name;
-            document.getElementById('member-id').textContent = member.userId;
+            document.getElementById('member-id').textContent = member.user_id;
             document.getElementById('member-plan').textContent = member.plan;
-            document.getElementById('member-start-date').textContent = member.startDate;
-            document.getElementById('member-end-date').textContent = member.endDate;
+            document.getElementById('member-start-date').textContent = member.start_date;
+            document.getElementById('member-end-date').textContent = member.end_date;
             document.getElementById('member-days-remaining').textContent = 
-                category === 'expired' ? 'Expired' : `${member.daysRemaining} days`;
-            document.getElementById('member-payment-method').textContent = member.paymentMethod;
-            document.getElementById('member-payment-status').textContent = member.hasPaid ? 'Paid' : 'Unpaid';
+                category === 'expired' ? 'Expired' : `${member.days_remaining} days`;
+            document.getElementById('member-payment-method').textContent = member.payment_method;
+            document.getElementById('member-payment-status').textContent = member.has_paid ? 'Paid' : 'Unpaid';
             document.getElementById('member-cancellation').textContent = member.cancelled ? 'Cancelled' : 'Active';
             
             // Show the modal
@@ -2462,60 +2618,486 @@ CHANGELOGS_TEMPLATE = '''
 </html>
 '''
 
-@app.route('/api/member/kick', methods=['POST'])
-@login_required
-def kick_member():
-    """API endpoint to kick a member from the group"""
-    from pymongo import MongoClient
-    import os
-    import requests
-    import json
-    
-    try:
-        data = request.get_json()
-        user_id = data.get('userId')
-        
-        if not user_id:
-            return jsonify({"success": False, "message": "Missing user ID"})
+HANDLER_PROFILE_TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>PTABot Handler Profile</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css" rel="stylesheet">
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/bootstrap-icons.css">
+    <style>
+        :root {
+            --primary-color: #6D5AE6;
+            --dark-bg: #131722;
+            --card-bg: #1E222D;
+            --text-color: #F9FAFB;
+            --muted-text: #9CA3AF;
+            --border-color: #2D3748;
+            --error-color: #EF4444;
+        }
         
-        # Get MongoDB connection details and BOT_TOKEN
-        MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
-        DB_NAME = os.getenv('DB_NAME', 'PTABotDB')
-        BOT_TOKEN = os.getenv('BOT_TOKEN')
-        PAID_GROUP_ID = int(os.getenv('PAID_GROUP_ID', 0))
+        body {
+            background-color: var(--dark-bg);
+            color: var(--text-color);
+            font-family: 'Inter', 'Segoe UI', sans-serif;
+            line-height: 1.6;
+            min-height: 100vh;
+        }
         
-        # Connect to MongoDB
-        client = MongoClient(MONGO_URI)
-        db = client[DB_NAME]
-        payment_collection = db['payments']
+        .navbar {
+            background-color: var(--dark-bg) !important;
+            border-bottom: 1px solid var(--border-color);
+            padding: 0.75rem 1.5rem;
+        }
         
-        # Update payment data to mark as cancelled
-        payment_collection.update_one(
-            {"_id": str(user_id)},
-            {"$set": {"cancelled": True}}
-        )
+        .navbar-brand {
+            color: var(--primary-color) !important;
+            font-weight: 700;
+            font-size: 1.5rem;
+        }
         
-        # Use Telegram API to ban the user
-        if PAID_GROUP_ID:
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/banChatMember"
-            payload = {
-                "chat_id": PAID_GROUP_ID,
-                "user_id": int(user_id)
-            }
-            response = requests.post(url, json=payload)
-            response_data = response.json()
-            
-            if not response_data.get('ok', False):
-                return jsonify({"success": False, "message": f"API Error: {response_data.get('description', 'Unknown error')}"})
+        .navbar-dark .navbar-nav .nav-link {
+            color: var(--text-color);
+            font-weight: 500;
+            padding: 0.5rem 1rem;
+            border-radius: 6px;
+        }
         
-        # Log the action
-        admin_username = session.get('username', 'Admin')
-        logging.info(f"Member {user_id} kicked by {admin_username} via dashboard")
+        .navbar-dark .navbar-nav .nav-link:hover,
+        .navbar-dark .navbar-nav .nav-link.active {
+            color: var(--primary-color);
+            background-color: rgba(109, 90, 230, 0.1);
+        }
         
-        return jsonify({
-            "success": True, 
-            "message": "Member has been kicked and their membership marked as cancelled"
-        })
+        .card {
+            background-color: var(--card-bg);
+            border: 1px solid var(--border-color);
+            margin-bottom: 24px;
+            border-radius: 12px;
+            overflow: hidden;
+        }
+        
+        .card-header {
+            background-color: rgba(0, 0, 0, 0.15);
+            border-bottom: 1px solid var(--border-color);
+            font-weight: 600;
+            color: var(--primary-color);
+            padding: 1rem 1.25rem;
+        }
+        
+        .table {
+            color: var(--text-color);
+            margin-bottom: 0;
+        }
+        
+        .table th a {
+            color: var(--muted-text);
+            text-decoration: none;
+        }
+        
+        .table th a.active {
+            color: var(--primary-color);
+        }
+        
+        .table td, .table th {
+            border-color: var(--border-color);
+            background-color: transparent;
+            color: var(--text-color);
+            white-space: nowrap;
+        }
+        
+        .text-light-muted {
+            color: var(--muted-text);
+        }
+        
+        pre.profile {
+            background-color: rgba(0, 0, 0, 0.3);
+            color: var(--text-color);
+            padding: 1rem;
+            border-radius: 8px;
+            font-size: 0.8rem;
+            max-height: 400px;
+            overflow: auto;
+        }
+    </style>
+</head>
+<body>
+    <nav class="navbar navbar-expand-lg navbar-dark mb-4">
+        <div class="container-fluid">
+            <a class="navbar-brand" href="/">
+                <i class="bi bi-robot"></i> PTA<span style="font-weight: normal">Bot</span>
+            </a>
+            <div class="collapse navbar-collapse" id="navbarNav">
+                <ul class="navbar-nav">
+                    <li class="nav-item">
+                        <a class="nav-link" href="/"><i class="bi bi-house-door"></i> Home</a>
+                    </li>
+                    <li class="nav-item">
+                        <a class="nav-link" href="/dashboard"><i class="bi bi-speedometer2"></i> Dashboard</a>
+                    </li>
+                    <li class="nav-item">
+                        <a class="nav-link" href="/logs"><i class="bi bi-journal-text"></i> Logs</a>
+                    </li>
+                    <li class="nav-item">
+                        <a class="nav-link active" href="/admin/handlers"><i class="bi bi-stopwatch"></i> Handlers</a>
+                    </li>
+                    <li class="nav-item">
+                        <a class="nav-link" href="/admin/mongo"><i class="bi bi-database"></i> MongoDB</a>
+                    </li>
+                </ul>
+                <ul class="navbar-nav ms-auto">
+                    <li class="nav-item">
+                        <a class="nav-link" href="/logout"><i class="bi bi-box-arrow-right"></i> Logout ({{ session['username'] }})</a>
+                    </li>
+                </ul>
+            </div>
+        </div>
+    </nav>
+
+    <div class="container-fluid px-4">
+        <h1 class="h3 mb-2 text-light">Handler Profile</h1>
+        <p class="text-light-muted mb-4">
+            {% if enabled %}
+            Slow threshold {{ '%.1f'|format(threshold) }}s, cProfile on {{ '%.0f'|format(sample_rate * 100) }}% of calls. Times are in milliseconds.
+            {% else %}
+            Profiling is off. Set PROFILE_HANDLERS=1 and restart the bot to collect handler timings.
+            {% endif %}
+        </p>
+
+        <div class="card">
+            <div class="card-header"><i class="bi bi-bar-chart"></i> Handlers ({{ handlers|length }})</div>
+            <div class="table-responsive">
+                <table class="table table-sm">
+                    <thead>
+                        <tr>
+                            <th>Handler</th>
+                            <th>Type</th>
+                            {% for key in ['count', 'errors', 'p95', 'mean', 'max', 'total'] %}
+                            <th><a href="?sort={{ key }}" class="{{ 'active' if sort == key else '' }}">{{ key }}</a></th>
+                            {% endfor %}
+                            <th>p50</th>
+                            <th>Telegram / call</th>
+                            <th>Mongo / call</th>
+                            <th>HTTP / call</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {% for h in handlers %}
+                        <tr>
+                            <td>{{ h.handler }}</td>
+                            <td class="text-light-muted">{{ h.update_type }}</td>
+                            <td>{{ h.count }}</td>
+                            <td>{{ h.errors }}</td>
+                            <td>{{ '%.0f'|format(h.p95 * 1000) }}</td>
+                            <td>{{ '%.0f'|format(h.mean * 1000) }}</td>
+                            <td>{{ '%.0f'|format(h.max * 1000) }}</td>
+                            <td>{{ '%.1f'|format(h.total) }}s</td>
+                            <td>{{ '%.0f'|format(h.p50 * 1000) }}</td>
+                            {% for kind in ['telegram', 'mongo', 'http'] %}
+                            <td>{% if h.calls[kind] %}{{ '%.1f'|format(h.calls[kind].per_call) }} ({{ '%.1f'|format(h.calls[kind].seconds) }}s){% else %}-{% endif %}</td>
+                            {% endfor %}
+                        </tr>
+                        {% else %}
+                        <tr><td colspan="13" class="text-light-muted">No handler calls recorded yet</td></tr>
+                        {% endfor %}
+                    </tbody>
+                </table>
+            </div>
+        </div>
+
+        <div class="card">
+            <div class="card-header"><i class="bi bi-hourglass-split"></i> Recent slow calls ({{ samples|length }})</div>
+            <div class="card-body">
+                {% for sample in samples %}
+                <div class="mb-3">
+                    <div>
+                        <strong>{{ sample.handler }}</strong>
+                        <span class="text-light-muted">{{ sample.time }} &middot; {{ '%.0f'|format(sample.elapsed * 1000) }} ms{% if sample.failed %} &middot; <span style="color: var(--error-color)">failed</span>{% endif %}</span>
+                    </div>
+                    <div class="text-light-muted small">
+                        {% for kind, call in sample.calls.items() %}{{ kind }}: {{ call.count }} calls, {{ '%.0f'|format(call.seconds * 1000) }} ms{% if not loop.last %} &middot; {% endif %}{% endfor %}
+                    </div>
+                    {% if sample.profile %}
+                    <details><summary class="small">cProfile</summary><pre class="profile">{{ sample.profile }}</pre></details>
+                    {% elif sample.stack %}
+                    <details><summary class="small">Stack while running</summary><pre class="profile">{{ sample.stack }}</pre></details>
+                    {% endif %}
+                </div>
+                {% else %}
+                <div class="text-light-muted">No slow calls recorded</div>
+                {% endfor %}
+            </div>
+        </div>
+    </div>
+</body>
+</html>
+'''
+
+MONGO_PROFILE_TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>PTABot MongoDB</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css" rel="stylesheet">
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/bootstrap-icons.css">
+    <style>
+        :root {
+            --primary-color: #6D5AE6;
+            --dark-bg: #131722;
+            --card-bg: #1E222D;
+            --text-color: #F9FAFB;
+            --muted-text: #9CA3AF;
+            --border-color: #2D3748;
+            --error-color: #EF4444;
+        }
+        
+        body {
+            background-color: var(--dark-bg);
+            color: var(--text-color);
+            font-family: 'Inter', 'Segoe UI', sans-serif;
+            line-height: 1.6;
+            min-height: 100vh;
+        }
+        
+        .navbar {
+            background-color: var(--dark-bg) !important;
+            border-bottom: 1px solid var(--border-color);
+            padding: 0.75rem 1.5rem;
+        }
+        
+        .navbar-brand {
+            color: var(--primary-color) !important;
+            font-weight: 700;
+            font-size: 1.5rem;
+        }
+        
+        .navbar-dark .navbar-nav .nav-link {
+            color: var(--text-color);
+            font-weight: 500;
+            padding: 0.5rem 1rem;
+            border-radius: 6px;
+        }
+        
+        .navbar-dark .navbar-nav .nav-link:hover,
+        .navbar-dark .navbar-nav .nav-link.active {
+            color: var(--primary-color);
+            background-color: rgba(109, 90, 230, 0.1);
+        }
+        
+        .card {
+            background-color: var(--card-bg);
+            border: 1px solid var(--border-color);
+            margin-bottom: 24px;
+            border-radius: 12px;
+            overflow: hidden;
+        }
+        
+        .card-header {
+            background-color: rgba(0, 0, 0, 0.15);
+            border-bottom: 1px solid var(--border-color);
+            font-weight: 600;
+            color: var(--primary-color);
+            padding: 1rem 1.25rem;
+        }
+        
+        .table {
+            color: var(--text-color);
+            margin-bottom: 0;
+        }
+        
+        .table th a {
+            color: var(--muted-text);
+            text-decoration: none;
+        }
+        
+        .table th a.active {
+            color: var(--primary-color);
+        }
+        
+        .table td, .table th {
+            border-color: var(--border-color);
+            background-color: transparent;
+            color: var(--text-color);
+            white-space: nowrap;
+        }
+        
+        .text-light-muted {
+            color: var(--muted-text);
+        }
+        
+        pre.profile {
+            background-color: rgba(0, 0, 0, 0.3);
+            color: var(--text-color);
+            padding: 1rem;
+            border-radius: 8px;
+            font-size: 0.8rem;
+            max-height: 400px;
+            overflow: auto;
+        }
+    </style>
+</head>
+<body>
+    <nav class="navbar navbar-expand-lg navbar-dark mb-4">
+        <div class="container-fluid">
+            <a class="navbar-brand" href="/">
+                <i class="bi bi-robot"></i> PTA<span style="font-weight: normal">Bot</span>
+            </a>
+            <div class="collapse navbar-collapse" id="navbarNav">
+                <ul class="navbar-nav">
+                    <li class="nav-item">
+                        <a class="nav-link" href="/"><i class="bi bi-house-door"></i> Home</a>
+                    </li>
+                    <li class="nav-item">
+                        <a class="nav-link" href="/dashboard"><i class="bi bi-speedometer2"></i> Dashboard</a>
+                    </li>
+                    <li class="nav-item">
+                        <a class="nav-link" href="/logs"><i class="bi bi-journal-text"></i> Logs</a>
+                    </li>
+                    <li class="nav-item">
+                        <a class="nav-link" href="/admin/handlers"><i class="bi bi-stopwatch"></i> Handlers</a>
+                    </li>
+                    <li class="nav-item">
+                        <a class="nav-link active" href="/admin/mongo"><i class="bi bi-database"></i> MongoDB</a>
+                    </li>
+                </ul>
+                <ul class="navbar-nav ms-auto">
+                    <li class="nav-item">
+                        <a class="nav-link" href="/logout"><i class="bi bi-box-arrow-right"></i> Logout ({{ session['username'] }})</a>
+                    </li>
+                </ul>
+            </div>
+        </div>
+    </nav>
+
+    <div class="container-fluid px-4">
+        <h1 class="h3 mb-2 text-light">MongoDB Commands</h1>
+        <p class="text-light-muted mb-4">
+            Since startup. Commands slower than {{ '%.0f'|format(threshold_ms) }} ms are logged and grouped below by filter shape and caller. Times are in milliseconds.
+        </p>
+
+        <div class="card">
+            <div class="card-header"><i class="bi bi-exclamation-triangle"></i> Top slow queries ({{ slow_queries|length }})</div>
+            <div class="table-responsive">
+                <table class="table table-sm">
+                    <thead>
+                        <tr>
+                            <th>Collection</th>
+                            <th>Command</th>
+                            <th>Caller</th>
+                            <th>Count</th>
+                            <th>Total</th>
+                            <th>Max</th>
+                            <th>Docs / call</th>
+                            <th>Filter shape</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {% for q in slow_queries %}
+                        <tr>
+                            <td>{{ q.collection }}</td>
+                            <td>{{ q.command }}</td>
+                            <td class="text-light-muted">{{ q.caller }}</td>
+                            <td>{{ q.count }}</td>
+                            <td>{{ '%.0f'|format(q.total * 1000) }}</td>
+                            <td>{{ '%.0f'|format(q.max * 1000) }}</td>
+                            <td>{{ '%.0f'|format(q.documents / q.count) }}</td>
+                            <td style="white-space: normal"><code>{{ q.shape }}</code></td>
+                        </tr>
+                        {% else %}
+                        <tr><td colspan="8" class="text-light-muted">No slow queries recorded</td></tr>
+                        {% endfor %}
+                    </tbody>
+                </table>
+            </div>
+        </div>
+
+        <div class="card">
+            <div class="card-header"><i class="bi bi-database"></i> Commands by collection</div>
+            <div class="table-responsive">
+                <table class="table table-sm">
+                    <thead>
+                        <tr>
+                            <th>Collection</th>
+                            <th>Command</th>
+                            <th>Count</th>
+                            <th>Errors</th>
+                            <th>Slow</th>
+                            <th>Total</th>
+                            <th>Mean</th>
+                            <th>Max</th>
+                            <th>Docs returned</th>
+                            <th>Reply size (est.)</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {% for c in collections %}
+                        <tr>
+                            <td>{{ c.collection }}</td>
+                            <td>{{ c.command }}</td>
+                            <td>{{ c.count }}</td>
+                            <td>{{ c.errors }}</td>
+                            <td>{{ c.slow }}</td>
+                            <td>{{ '%.0f'|format(c.total * 1000) }}</td>
+                            <td>{{ '%.1f'|format(c.mean * 1000) }}</td>
+                            <td>{{ '%.0f'|format(c.max * 1000) }}</td>
+                            <td>{{ c.documents }}</td>
+                            <td>{{ '%.1f'|format(c.bytes / 1048576) }} MB</td>
+                        </tr>
+                        {% else %}
+                        <tr><td colspan="10" class="text-light-muted">No commands recorded yet</td></tr>
+                        {% endfor %}
+                    </tbody>
+                </table>
+            </div>
+        </div>
+    </div>
+</body>
+</html>
+'''
+
+@app.route('/api/member/kick', methods=['POST'])
+@login_required
+def kick_member():
+    """API endpoint to kick a member from the group"""
+    try:
+        data = request.get_json()
+        user_id = data.get('userId')
+        
+        if not user_id:
+            return jsonify({"success": False, "message": "Missing user ID"})
+        
+        # Get BOT_TOKEN and group details
+        BOT_TOKEN = os.getenv('BOT_TOKEN')
+        PAID_GROUP_ID = int(os.getenv('PAID_GROUP_ID', 0))
+        
+        # Update payment data to mark as cancelled
+        database.mark_member_cancelled(user_id)
+        
+        # Use Telegram API to ban the user
+        if PAID_GROUP_ID:
+            url = f"https://api.telegram.org/bot{BOT_TOKEN}/banChatMember"
+            payload = {
+                "chat_id": PAID_GROUP_ID,
+                "user_id": int(user_id)
+            }
+            response = requests.post(url, json=payload)
+            response_data = response.json()
+            
+            if not response_data.get('ok', False):
+                return jsonify({"success": False, "message": f"API Error: {response_data.get('description', 'Unknown error')}"})
+        
+        # Log the action
+        admin_username = session.get('username', 'Admin')
+        logging.info(f"Member {user_id} kicked by {admin_username} via dashboard")
+        
+        return jsonify({
+            "success": True, 
+            "message": "Member has been kicked and their membership marked as cancelled"
+        })
         
     except Exception as e:
         logging.error(f"Error kicking member: {str(e)}")
@@ -2525,10 +3107,6 @@ def kick_member():
 @login_required
 def give_grace_period():
     """API endpoint to give a member a grace period"""
-    from pymongo import MongoClient
-    import os
-    from datetime import datetime, timedelta
-    
     try:
         data = request.get_json()
         user_id = data.get('userId')
@@ -2536,17 +3114,8 @@ def give_grace_period():
         if not user_id:
             return jsonify({"success": False, "message": "Missing user ID"})
         
-        # Get MongoDB connection details
-        MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
-        DB_NAME = os.getenv('DB_NAME', 'PTABotDB')
-        
-        # Connect to MongoDB
-        client = MongoClient(MONGO_URI)
-        db = client[DB_NAME]
-        payment_collection = db['payments']
-        
         # Get the member's data
-        member_data = payment_collection.find_one({"_id": str(user_id)})
+        member_data = database.get_member(user_id)
         if not member_data:
             return jsonify({"success": False, "message": "Member not found"})
         
@@ -2560,10 +3129,7 @@ def give_grace_period():
         new_due_date = (current_due_date + timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
         
         # Update the due date
-        payment_collection.update_one(
-            {"_id": str(user_id)},
-            {"$set": {"due_date": new_due_date}}
-        )
+        database.set_member_due_date(user_id, new_due_date)
         
         # Log the action
         admin_username = session.get('username', 'Admin')
@@ -2593,153 +3159,351 @@ def logs():
     # Use system time instead of hardcoded date
     current_time = datetime.now(pytz.timezone('Asia/Manila')).strftime('%Y-%m-%d %I:%M:%S %p')
     
+    last_seq = web_handler.last_seq
+    logs = web_handler.get_entries()
+    
     return render_template_string(
         LOGS_TEMPLATE,
-        logs=web_handler.log_entries,
-        log_count=len(web_handler.log_entries),
+        logs=logs,
+        log_count=len(logs),
+        last_seq=last_seq,
         current_time=current_time
     )
 
 @app.route('/logs/data')
 @login_required
 def logs_data():
-    """API endpoint to get logs data for AJAX refresh"""
-    # Use system time instead of hardcoded date
+    """API endpoint to get logs data for AJAX refresh
+    
+    Pass ?after=<seq> to only receive entries newer than that sequence
+    number, and ?level=ERROR (repeatable) to filter by level.
+    """
+    after = request.args.get('after', 0, type=int)
+    levels = set(level.upper() for level in request.args.getlist('level')) or None
+    
+    # Read the sequence number first so entries logged while we collect
+    # are picked up by the next poll rather than skipped
+    last_seq = web_handler.last_seq
+    logs = web_handler.get_entries(after=after, levels=levels)
     
     return jsonify({
-        'logs': web_handler.log_entries,
+        'logs': logs,
+        'last_seq': max(last_seq, logs[0]['seq']) if logs else last_seq,
         'log_count': len(web_handler.log_entries),
         'current_time': datetime.now(pytz.timezone('Asia/Manila')).strftime('%Y-%m-%d %I:%M:%S %p')
     })
 
+@app.route('/logs/stream')
+@login_required
+def logs_stream():
+    """Server-Sent Events stream of new log entries
+    
+    Clients resume from the Last-Event-ID header (or ?after=<seq>) after a
+    reconnect, and ?level= filters entries by level.
+    """
+    after = request.headers.get('Last-Event-ID', type=int) or request.args.get('after', 0, type=int)
+    levels = set(level.upper() for level in request.args.getlist('level')) or None
+    subscriber, missed = web_handler.subscribe(after=after, levels=levels)
+    
+    def format_event(log_data):
+        return f"id: {log_data['seq']}\ndata: {json.dumps(log_data)}\n\n"
+    
+    def generate():
+        try:
+            # Tell the browser how long to wait before reconnecting
+            yield "retry: 3000\n\n"
+            for log_data in missed:
+                yield format_event(log_data)
+            
+            while True:
+                try:
+                    log_data = subscriber.queue.get(timeout=LOG_STREAM_HEARTBEAT)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                
+                if log_data is None:
+                    # We fell behind - end the stream so the client reconnects and catches up
+                    yield "event: overflow\ndata: {}\n\n"
+                    return
+                yield format_event(log_data)
+        finally:
+            web_handler.unsubscribe(subscriber)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/logs/search')
+@login_required
+def logs_search():
+    """Search the persistent log archive
+    
+    Supports ?q= (full-text, FTS5 syntax), ?level=, ?user_id=, ?subsystem=,
+    ?since= / ?until= (YYYY-MM-DD, Manila time) and ?limit=.
+    """
+    manila_tz = pytz.timezone('Asia/Manila')
+    
+    def parse_day(value):
+        return manila_tz.localize(datetime.strptime(value, '%Y-%m-%d')).timestamp() if value else None
+    
+    try:
+        since = parse_day(request.args.get('since'))
+        until = parse_day(request.args.get('until'))
+        if until:
+            until += 86400  # Include the whole "until" day
+        
+        results = archive_handler.search(
+            query=request.args.get('q') or None,
+            level=request.args.get('level') or None,
+            user_id=request.args.get('user_id', type=int),
+            subsystem=request.args.get('subsystem') or None,
+            since=since,
+            until=until,
+            limit=min(request.args.get('limit', 200, type=int), 1000)
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    
+    for entry in results:
+        entry['timestamp'] = datetime.fromtimestamp(entry['created'], manila_tz).strftime('%Y-%m-%d %I:%M:%S %p')
+    
+    return jsonify({"success": True, "logs": results, "count": len(results)})
+
+def scraper_authorized():
+    """Whether the request comes from a logged-in admin or carries the METRICS_TOKEN bearer token"""
+    if 'logged_in' in session:
+        return True
+    return bool(METRICS_TOKEN) and secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}')
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if not scraper_authorized():
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/admin/handlers')
+@login_required
+def handler_profile():
+    """Rank bot handlers by latency from the opt-in profiler"""
+    sort = request.args.get('sort', 'p95')
+    try:
+        handlers = profiling.report(sort)
+    except ValueError:
+        sort = 'p95'
+        handlers = profiling.report(sort)
+
+    manila = pytz.timezone('Asia/Manila')
+    samples = [
+        dict(sample, time=datetime.fromtimestamp(sample['timestamp'], manila).strftime('%Y-%m-%d %I:%M:%S %p'))
+        for sample in profiling.slow_samples()
+    ]
+
+    return render_template_string(
+        HANDLER_PROFILE_TEMPLATE,
+        handlers=handlers,
+        samples=samples,
+        sort=sort,
+        enabled=profiling.PROFILE_HANDLERS,
+        threshold=profiling.PROFILE_SLOW_THRESHOLD,
+        sample_rate=profiling.PROFILE_SAMPLE_RATE
+    )
+
+@app.route('/admin/mongo')
+@login_required
+def mongo_profile():
+    """Show MongoDB command latency by collection and the worst slow queries"""
+    return render_template_string(
+        MONGO_PROFILE_TEMPLATE,
+        collections=command_listener.collection_report(),
+        slow_queries=command_listener.slow_query_report()[:100],
+        threshold_ms=command_listener.slow_query_seconds * 1000
+    )
+
+@app.route('/admin/flows')
+@login_required
+def flow_graph():
+    """Render the registered conversation flows as a Graphviz DOT graph"""
+    flow = request.args.get('flow')
+    if flow is not None and flow not in flows.registered_flows():
+        return Response(f"Unknown flow: {flow}\n", status=404, mimetype='text/plain')
+    return Response(flows.render_graph(flow), mimetype='text/vnd.graphviz; charset=utf-8')
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: every background loop has reported a heartbeat on time
+
+    Per-job details (including error text) are only shown to admins and
+    METRICS_TOKEN holders.
+    """
+    jobs = heartbeat.status()
+    stale = [job['name'] for job in jobs if job['stale']]
+    body = {'status': 'ok' if not stale else 'stalled', 'stale_jobs': stale}
+    if scraper_authorized():
+        body['jobs'] = jobs
+    return jsonify(body), 200 if not stale else 503
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: background loops are healthy, MongoDB answers and Telegram polling is current"""
+    jobs = heartbeat.status()
+    stale = [job['name'] for job in jobs if job['stale']]
+
+    try:
+        database.get_client().admin.command('ping')
+        mongo_ok = True
+    except Exception as e:
+        logging.warning(f"Readiness check: MongoDB ping failed: {e}")
+        mongo_ok = False
+
+    polling = next((job for job in jobs if job['name'] == heartbeat.POLLING_JOB), None)
+    polling_lag = polling['last_success_age'] if polling else None
+    polling_ok = polling_lag is not None and polling_lag <= heartbeat.POLLING_STALE_AFTER
+
+    ready = mongo_ok and polling_ok and not stale
+    body = {
+        'status': 'ready' if ready else 'not_ready',
+        'mongodb': mongo_ok,
+        'polling_lag_seconds': polling_lag,
+        'stale_jobs': stale
+    }
+    return jsonify(body), 200 if ready else 503
+
 @app.route('/logs/clear')
 @login_required
 def clear_logs():
-    web_handler.log_entries = []
+    web_handler.clear()
     return "Logs cleared successfully"
 
+def calculate_start_date(end_date_str, plan_name):
+    """Estimate when a membership started from its end date and plan"""
+    try:
+        # Parse the end date string to a datetime object
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d %H:%M:%S')
+        
+        # Determine plan duration
+        if 'yearly' in plan_name.lower() or '1 year' in plan_name.lower():
+            # Yearly plan (subtract 365 days)
+            start_date = end_date - timedelta(days=365)
+        else:
+            # Default to monthly plan (subtract 30 days)
+            start_date = end_date - timedelta(days=30)
+            
+        # Return formatted date string
+        return start_date.strftime('%Y-%m-%d %H:%M:%S')
+    except:
+        return 'Unknown'
+
+def serialize_member(member, current_time):
+    """Build the dashboard view of a payment document"""
+    manila_tz = pytz.timezone('Asia/Manila')
+    
+    # Make the due date timezone-aware by attaching the Manila timezone
+    due_date = manila_tz.localize(datetime.strptime(member['due_date'], '%Y-%m-%d %H:%M:%S'))
+    
+    # Format the username safely
+    username = member.get('username', 'No Username') or 'No Username'
+    
+    return {
+        "name": f"@{username}" if username != 'No Username' else f"User {member['_id']}",
+        "user_id": member['_id'],
+        "plan": member.get('payment_plan', 'Unknown'),
+        "start_date": calculate_start_date(member['due_date'], member.get('payment_plan', '') or ''),
+        "end_date": member['due_date'],
+        "payment_method": member.get('payment_mode', 'Unknown'),
+        "days_remaining": (due_date - current_time).days,
+        "has_paid": member.get('haspayed', False),
+        "cancelled": member.get('cancelled', False)
+    }
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
     """Membership dashboard showing active, expiring, and expired memberships"""
-    # Connect to the MongoDB database that's already set up in bot.py
-    from pymongo import MongoClient
-    import os
-    from datetime import datetime, timedelta
-    
-    # Get MongoDB connection details from environment
-    MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
-    DB_NAME = os.getenv('DB_NAME', 'PTABotDB')
-    
-    # Connect to MongoDB
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    payment_collection = db['payments']
-    
     # Get current time in Philippines timezone
     manila_tz = pytz.timezone('Asia/Manila')
     current_time = datetime.now(manila_tz)
+    now = current_time.replace(tzinfo=None)
     
-    # Fetch all membership data
-    all_memberships = list(payment_collection.find())
+    # Only the summary stats are rendered here - member lists are
+    # fetched page by page from /api/members
+    stats = database.get_member_stats(now)
     
-    # Categorize memberships
-    active_memberships = []
-    expiring_soon = []
-    expired_memberships = []
+    return render_template_string(DASHBOARD_TEMPLATE,
+        current_time=current_time.strftime('%Y-%m-%d %I:%M:%S %p'),
+        active_count=stats['active'],
+        expiring_soon_count=stats['expiring'],
+        expired_count=stats['expired'],
+        plan_breakdown=stats['by_plan'],
+        payment_method_breakdown=stats['by_payment_method']
+    )
 
-    def calculate_start_date(end_date_str, plan_name):
-        try:
-            # Parse the end date string to a datetime object
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d %H:%M:%S')
-            
-            # Determine plan duration
-            if 'yearly' in plan_name.lower() or '1 year' in plan_name.lower():
-                # Yearly plan (subtract 365 days)
-                start_date = end_date - timedelta(days=365)
-            else:
-                # Default to monthly plan (subtract 30 days)
-                start_date = end_date - timedelta(days=30)
-                
-            # Return formatted date string
-            return start_date.strftime('%Y-%m-%d %H:%M:%S')
-        except:
-            return 'Unknown'
+@app.route('/api/members/stats')
+@login_required
+def api_member_stats():
+    """Cached summary counts and plan/payment method breakdowns"""
+    now = datetime.now(pytz.timezone('Asia/Manila')).replace(tzinfo=None)
+    try:
+        return jsonify({"success": True, **database.get_member_stats(now)})
+    except Exception as e:
+        logging.error(f"Error computing member stats: {str(e)}")
+        return jsonify({"success": False, "message": "Failed to compute member stats"}), 500
+
+@app.route('/api/members')
+@login_required
+def api_members():
+    """Paginated member list for the dashboard, filtered by category"""
+    status = request.args.get('status', 'active')
+    sort = request.args.get('sort', 'due_date')
+    # Expired members are listed most recently expired first by default
+    order = request.args.get('order', 'desc' if status == 'expired' else 'asc')
+    search = request.args.get('search')
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', 50, type=int)
     
-    for member in all_memberships:
-        # Skip members that don't have due_date
-        if 'due_date' not in member:
-            continue
-            
-        # Convert due_date string to datetime and make it timezone-aware
+    manila_tz = pytz.timezone('Asia/Manila')
+    current_time = datetime.now(manila_tz)
+    
+    try:
+        docs, next_cursor = database.query_members(
+            status,
+            current_time.replace(tzinfo=None),
+            sort=sort,
+            descending=(order == 'desc'),
+            search=search,
+            cursor=cursor,
+            limit=limit
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error querying members: {str(e)}")
+        return jsonify({"success": False, "message": "Failed to load members"}), 500
+    
+    members = []
+    for member in docs:
         try:
-            due_date = datetime.strptime(member['due_date'], '%Y-%m-%d %H:%M:%S')
-            # Make the datetime timezone-aware by attaching the Manila timezone
-            due_date = manila_tz.localize(due_date)
-            
-            # Format the username safely
-            username = member.get('username', 'No Username') or 'No Username'
-            
-            # Create a membership entry with all necessary data
-            membership = {
-                "name": f"@{username}" if username != 'No Username' else f"User {member['_id']}",
-                "user_id": member['_id'],
-                "plan": member.get('payment_plan', 'Unknown'),
-                "start_date": calculate_start_date(member['due_date'], member.get('payment_plan', '')),
-                "end_date": member['due_date'],
-                "payment_method": member.get('payment_mode', 'Unknown'),
-                "days_remaining": (due_date - current_time).days,
-                "has_paid": member.get('haspayed', False),
-                "cancelled": member.get('cancelled', False)
-            }
-            
-            # Categorize based on payment status and expiration
-            if not member.get('haspayed', False):
-                expired_memberships.append(membership)
-            elif (due_date - current_time).days <= 7:
-                expiring_soon.append(membership)
-            else:
-                active_memberships.append(membership)
-                
+            members.append(serialize_member(member, current_time))
         except Exception as e:
-            print(f"Error processing member {member['_id']}: {e}")
-    
-    # Sort all categories by days_remaining
-    active_memberships.sort(key=lambda x: x['days_remaining'])
-    expiring_soon.sort(key=lambda x: x['days_remaining'])
-    expired_memberships.sort(key=lambda x: x.get('days_remaining', -9999), reverse=True)
+            logging.error(f"Error processing member {member['_id']}: {e}")
     
-    return render_template_string(DASHBOARD_TEMPLATE,
-        current_time=current_time.strftime('%Y-%m-%d %I:%M:%S %p'),
-        active_count=len(active_memberships),
-        expiring_soon_count=len(expiring_soon),
-        expired_count=len(expired_memberships),
-        active_memberships=active_memberships,
-        expiring_soon=expiring_soon,
-        expired_memberships=expired_memberships
-    )
+    return jsonify({
+        "success": True,
+        "members": members,
+        "next_cursor": next_cursor
+    })
 
 @app.route('/export/members.csv')
 @login_required
 def export_members():
-    from pymongo import MongoClient
-    import os
-    from datetime import datetime, timedelta
     import csv
     from io import StringIO
     from flask import Response
     
-    # Get MongoDB connection details from environment
-    MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
-    DB_NAME = os.getenv('DB_NAME', 'PTABotDB')
-    
-    # Connect to MongoDB
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    payment_collection = db['payments']
-    
     # Get all members
-    all_memberships = list(payment_collection.find())
+    all_memberships = database.get_all_members()
     
     # Create CSV in memory
     output = StringIO()
@@ -2811,24 +3575,7 @@ def export_members():
 def changelogs_page():
     """Display admin and user changelogs"""
     # Get changelogs from MongoDB
-    from pymongo import MongoClient
-    import os
-
-    # Get MongoDB connection details from environment
-    MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
-    DB_NAME = os.getenv('DB_NAME', 'PTABotDB')
-    
-    # Connect to MongoDB
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    changelog_collection = db['changelogs']
-    
-    # Get changelogs from MongoDB
-    doc = changelog_collection.find_one({'_id': 'changelogs'})
-    if doc:
-        changelogs = {k: v for k, v in doc.items() if k != '_id'}
-    else:
-        changelogs = {"admin": [], "user": []}
+    changelogs = database.get_changelogs()
     
     # Get current time in Philippines timezone
     current_time = datetime.now(pytz.timezone('Asia/Manila')).strftime('%Y-%m-%d %I:%M:%S %p')
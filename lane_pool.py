@@ -0,0 +1,94 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+from telebot import util
+
+BOT_WORKER_LANES = int(os.getenv('BOT_WORKER_LANES', '16'))  # Serial lanes; users sharing a lane wait for each other
+
+
+def update_shard_key(update):
+    """Return the user (or chat) an update belongs to, or None if it has neither"""
+    from_user = getattr(update, 'from_user', None)
+    if from_user is not None:
+        return from_user.id
+    chat = getattr(update, 'chat', None)
+    if chat is not None:
+        return chat.id
+    return None
+
+
+class LaneWorkerPool:
+    """Worker pool that runs each user's updates in order on one of a fixed set of serial lanes
+
+    Updates are sharded by sender (or chat), so different users are still
+    processed in parallel while any one user's updates never overlap.
+    Implements the part of TeleBot's worker pool interface that TeleBot
+    uses (put, exception_event, raise_exceptions, clear_exceptions, close)
+    with the same exception handling.
+
+    Users are hashed onto lanes, so a slow handler holds up every user
+    that shares its lane, not just its own user. More lanes
+    (BOT_WORKER_LANES) make that less likely, at one thread per lane.
+    """
+
+    def __init__(self, telebot, num_lanes=BOT_WORKER_LANES):
+        self.telebot = telebot
+        self.num_threads = num_lanes
+        self.exception_event = threading.Event()
+        self.exception_info = None
+        self.lanes = [queue.Queue() for _ in range(num_lanes)]
+        self.workers = [
+            util.WorkerThread(self.on_exception, lane, name=f"UpdateLane{index + 1}")
+            for index, lane in enumerate(self.lanes)
+        ]
+        # Tasks without a user or chat (e.g. update listeners) are spread round-robin
+        self._round_robin = itertools.count()
+
+    def lane_for(self, key):
+        if key is None:
+            return next(self._round_robin) % self.num_threads
+        return hash(key) % self.num_threads
+
+    def put(self, func, *args, **kwargs):
+        key = update_shard_key(args[0]) if args else None
+        self.lanes[self.lane_for(key)].put((func, args, kwargs))
+
+    def on_exception(self, worker_thread, exc_info):
+        if self.telebot.exception_handler is not None:
+            handled = self.telebot.exception_handler.handle(exc_info)
+        else:
+            handled = False
+        if not handled:
+            self.exception_info = exc_info
+            self.exception_event.set()
+        worker_thread.continue_event.set()
+
+    def raise_exceptions(self):
+        if self.exception_event.is_set():
+            raise self.exception_info
+
+    def clear_exceptions(self):
+        self.exception_event.clear()
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            if worker != threading.current_thread():
+                worker.join()
+
+    def qsize(self):
+        """Total number of updates waiting across all lanes"""
+        return sum(lane.qsize() for lane in self.lanes)
+
+
+def install(bot, num_lanes=BOT_WORKER_LANES):
+    """Replace the bot's default worker pool with per-user ordered lanes"""
+    old_pool = getattr(bot, 'worker_pool', None)
+    bot.worker_pool = LaneWorkerPool(bot, num_lanes)
+    if old_pool is not None:
+        old_pool.close()
+    logging.info(f"Processing updates on {num_lanes} per-user ordered lanes")
+    return bot.worker_pool
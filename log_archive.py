@@ -0,0 +1,203 @@
+import logging
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+LOG_ARCHIVE_PATH = os.getenv('LOG_ARCHIVE_PATH', 'logs_archive.db')
+LOG_ARCHIVE_RETENTION_DAYS = int(os.getenv('LOG_ARCHIVE_RETENTION_DAYS', '30'))
+LOG_ARCHIVE_MAX_MB = int(os.getenv('LOG_ARCHIVE_MAX_MB', '500'))
+
+BATCH_SIZE = 500  # Max records per insert transaction
+BATCH_INTERVAL = 1.0  # Max seconds a record waits before being written
+QUEUE_SIZE = 50000  # Records buffered before new ones are dropped
+RETENTION_INTERVAL = 600  # Seconds between retention passes
+
+# Pull a Telegram user id out of messages like "User 12345 ..." or "user_id: 12345"
+USER_ID_PATTERN = re.compile(r'\b[Uu]ser(?:[ _]?[Ii][Dd])?[\s:=#]*(\d{5,})')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    level TEXT NOT NULL,
+    user_id INTEGER,
+    subsystem TEXT,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS logs_created ON logs (created);
+CREATE INDEX IF NOT EXISTS logs_user_id ON logs (user_id, created);
+CREATE INDEX IF NOT EXISTS logs_level ON logs (level, created);
+CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(
+    message, content='logs', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS logs_after_insert AFTER INSERT ON logs BEGIN
+    INSERT INTO logs_fts (rowid, message) VALUES (new.id, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS logs_after_delete AFTER DELETE ON logs BEGIN
+    INSERT INTO logs_fts (logs_fts, rowid, message) VALUES ('delete', old.id, old.message);
+END;
+'''
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    # auto_vacuum has to be set before switching to WAL, or a new file keeps auto_vacuum off
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class LogArchiveHandler(logging.Handler):
+    """Archive log records to SQLite with a full-text index on the message
+
+    emit() only enqueues the record; a background thread writes batches,
+    so logging never waits on disk or on a running search.
+    """
+
+    def __init__(self, path=LOG_ARCHIVE_PATH, retention_days=LOG_ARCHIVE_RETENTION_DAYS, max_mb=LOG_ARCHIVE_MAX_MB):
+        super().__init__()
+        self.path = path
+        self.retention_days = retention_days
+        self.max_bytes = max_mb * 1024 * 1024
+        self.records = queue.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+
+        conn = _connect(self.path)
+        conn.executescript(SCHEMA)
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # Archives created without incremental auto-vacuum only switch over on a full VACUUM
+            conn.execute('VACUUM')
+        conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name='log-archive-writer', daemon=True)
+        self._writer.start()
+
+    def emit(self, record):
+        try:
+            message = record.getMessage()
+            if record.exc_info and self.formatter:
+                message = f"{message}\n{self.formatter.formatException(record.exc_info)}"
+
+            match = USER_ID_PATTERN.search(message)
+            row = (
+                record.created,
+                record.levelname,
+                int(match.group(1)) if match else None,
+                getattr(record, 'subsystem', None) or record.funcName,
+                message
+            )
+            self.records.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _write_loop(self):
+        conn = _connect(self.path)
+        last_retention = 0
+        while True:
+            try:
+                batch = [self.records.get()]
+                deadline = time.time() + BATCH_INTERVAL
+                while len(batch) < BATCH_SIZE:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self.records.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+
+                with conn:
+                    conn.executemany(
+                        'INSERT INTO logs (created, level, user_id, subsystem, message) VALUES (?, ?, ?, ?, ?)',
+                        batch
+                    )
+
+                if time.time() - last_retention >= RETENTION_INTERVAL:
+                    self._apply_retention(conn)
+                    last_retention = time.time()
+            except Exception as e:
+                # Don't log through the logging system here - it would feed back into this handler
+                sys.stderr.write(f"Log archive write error: {e}\n")
+                time.sleep(1)
+
+    def _apply_retention(self, conn):
+        """Delete entries past the retention window, then the oldest ones if over the size cap"""
+        with conn:
+            conn.execute('DELETE FROM logs WHERE created < ?', (time.time() - self.retention_days * 86400,))
+
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count, free_pages = conn.execute('SELECT * FROM pragma_page_count(), pragma_freelist_count()').fetchone()
+        used_bytes = (page_count - free_pages) * page_size
+        if used_bytes > self.max_bytes:
+            total = conn.execute('SELECT COUNT(*) FROM logs').fetchone()[0]
+            # Drop the oldest share of rows proportional to the overshoot, plus 10% headroom
+            excess = int(total * (1 - self.max_bytes / used_bytes)) + total // 10
+            with conn:
+                conn.execute(
+                    'DELETE FROM logs WHERE id IN (SELECT id FROM logs ORDER BY id LIMIT ?)',
+                    (excess,)
+                )
+                conn.execute("INSERT INTO logs_fts (logs_fts) VALUES ('optimize')")
+
+        conn.execute('PRAGMA incremental_vacuum').fetchall()  # Frees one page per step, so run it to the end
+
+    def search(self, query=None, level=None, user_id=None, subsystem=None, since=None, until=None, limit=100):
+        """Search archived entries, newest first
+
+        query uses SQLite FTS5 syntax (words, "phrases", prefix*, AND/OR/NOT).
+        Raises ValueError if the query can't be parsed.
+        """
+        clauses = []
+        params = []
+        if query:
+            clauses.append('logs.id IN (SELECT rowid FROM logs_fts WHERE logs_fts MATCH ?)')
+            params.append(query)
+        if level:
+            clauses.append('logs.level = ?')
+            params.append(level.upper())
+        if user_id:
+            clauses.append('logs.user_id = ?')
+            params.append(int(user_id))
+        if subsystem:
+            clauses.append('logs.subsystem = ?')
+            params.append(subsystem)
+        if since:
+            clauses.append('logs.created >= ?')
+            params.append(since)
+        if until:
+            clauses.append('logs.created < ?')
+            params.append(until)
+
+        sql = 'SELECT id, created, level, user_id, subsystem, message FROM logs'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY id DESC LIMIT ?'
+        params.append(int(limit))
+
+        # Searches use their own read connection; WAL lets them run alongside the writer
+        conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, timeout=10)
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid search query: {e}")
+        finally:
+            conn.close()
+
+        return [
+            {
+                'id': row[0],
+                'created': row[1],
+                'level': row[2],
+                'user_id': row[3],
+                'subsystem': row[4],
+                'message': row[5]
+            }
+            for row in rows
+        ]
@@ -0,0 +1,156 @@
+import itertools
+import threading
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+DEFAULT_STRIPES = 64
+
+
+class MemberStore(MutableMapping):
+    """Thread-safe dict for state shared by handler and background threads
+
+    Writes to a key are serialized by one of a fixed set of striped locks,
+    so updates to different users rarely contend. Iteration (keys(),
+    items(), values(), for ... in) walks a copy taken atomically, so a
+    background scan never fails with "dictionary changed size during
+    iteration" while handlers add or remove entries. keys_version changes
+    after every key is added or removed, so a scan that reads it before
+    taking keys() can cache the key set under it.
+    """
+
+    def __init__(self, initial=None, stripes=DEFAULT_STRIPES):
+        self._data = dict(initial or {})
+        self._locks = [threading.RLock() for _ in range(stripes)]
+        self._key_versions = itertools.count(1)
+        self.keys_version = 0
+
+    def _keys_changed(self):
+        # Called after the mutation; next() on a count is atomic, unlike += across stripes
+        self.keys_version = next(self._key_versions)
+
+    def lock_for(self, key):
+        """Return the lock guarding a key, for multi-step read-modify-write sequences"""
+        return self._locks[hash(key) % len(self._locks)]
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        with self.lock_for(key):
+            added = key not in self._data
+            self._data[key] = value
+            if added:
+                self._keys_changed()
+
+    def __delitem__(self, key):
+        with self.lock_for(key):
+            del self._data[key]
+            self._keys_changed()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __repr__(self):
+        return f"MemberStore({self._data!r})"
+
+    def __reduce__(self):
+        # Pickle as a plain copy of the data; locks aren't picklable
+        return (self.__class__, (self.snapshot(),))
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def keys(self):
+        return self.snapshot().keys()
+
+    def items(self):
+        return self.snapshot().items()
+
+    def values(self):
+        return self.snapshot().values()
+
+    def snapshot(self):
+        """Return a point-in-time shallow copy of the data as a plain dict"""
+        # dict.copy() runs entirely in C, so no other thread can resize the dict mid-copy
+        return self._data.copy()
+
+    copy = snapshot
+
+    def setdefault(self, key, default=None):
+        with self.lock_for(key):
+            added = key not in self._data
+            value = self._data.setdefault(key, default)
+            if added:
+                self._keys_changed()
+            return value
+
+    def pop(self, key, *default):
+        with self.lock_for(key):
+            removed = key in self._data
+            value = self._data.pop(key, *default)
+            if removed:
+                self._keys_changed()
+            return value
+
+    def update_value(self, key, function, default=None):
+        """Atomically replace a value with function(current value) and return the new value"""
+        with self.lock_for(key):
+            value = function(self._data.get(key, default))
+            added = key not in self._data
+            self._data[key] = value
+            if added:
+                self._keys_changed()
+            return value
+
+    def update_fields(self, key, fields):
+        """Atomically merge fields into the dict stored at key, creating it if missing"""
+        with self.lock_for(key):
+            added = key not in self._data
+            record = self._data.setdefault(key, {})
+            record.update(fields)
+            if added:
+                self._keys_changed()
+            return record
+
+    @contextmanager
+    def locked(self, key):
+        """Hold a key's lock and yield its current value (or None)
+
+        Use for compound updates of a nested record:
+            with PENDING_USERS.locked(user_id) as pending:
+                ...
+        """
+        with self.lock_for(key):
+            yield self._data.get(key)
+
+    def replace(self, data):
+        """Swap in a freshly loaded dataset in place, so every reference sees it"""
+        new_data = dict(data)
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            self._data = new_data
+            self._keys_changed()
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
+
+    def rebuild(self, function):
+        """Swap in function(current data) while holding every lock, so no write lands in between"""
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            self._data = dict(function(self._data.copy()))
+            self._keys_changed()
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
+
+    def clear(self):
+        self.replace({})
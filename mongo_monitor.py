@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+import bson
+from pymongo import monitoring
+import profiling
+from metrics import MONGO_COMMAND_DURATION, MONGO_DOCUMENTS_RETURNED, MONGO_REPLY_BYTES, MONGO_SLOW_QUERIES
+
+MONGO_SLOW_QUERY_MS = float(os.getenv('MONGO_SLOW_QUERY_MS', '200'))  # Commands slower than this are logged
+MAX_SLOW_QUERY_SHAPES = 500  # Distinct slow query shapes tracked for the dashboard
+# Fraction of fast read replies whose BSON size is measured; each sample counts for 1/rate replies.
+# Slow replies are always measured.
+MONGO_REPLY_SAMPLE_RATE = float(os.getenv('MONGO_REPLY_SAMPLE_RATE', '0.05'))
+
+# Commands whose first field doesn't name the collection they operate on
+_COLLECTION_FIELDS = {
+    'getMore': 'collection'
+}
+
+# Commands that return documents to the caller
+_READ_COMMANDS = {'find', 'aggregate', 'getMore', 'count', 'distinct', 'findAndModify'}
+
+# Source files whose frames are skipped when looking for the code that issued a command
+_INTERNAL_PATHS = (os.path.dirname(monitoring.__file__), os.path.dirname(bson.__file__), __file__)
+
+
+def query_shape(value):
+    """Reduce a query to its structure, replacing literal values with their type names"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # Operator arrays like $in only need one representative element
+        if value and all(not isinstance(item, (dict, list)) for item in value):
+            return [query_shape(value[0])]
+        return [query_shape(item) for item in value]
+    return type(value).__name__
+
+
+def command_filter(command_name, command):
+    """Pull the part of a command that selects documents"""
+    if command_name == 'find':
+        return command.get('filter', {})
+    if command_name in ('count', 'distinct', 'findAndModify'):
+        return command.get('query', {})
+    if command_name == 'aggregate':
+        return command.get('pipeline', [])
+    if command_name == 'update':
+        return [update.get('q', {}) for update in command.get('updates', [])[:1]]
+    if command_name == 'delete':
+        return [delete.get('q', {}) for delete in command.get('deletes', [])[:1]]
+    return None
+
+
+def find_caller():
+    """Return 'file:line in function' for the innermost frame outside pymongo"""
+    for frame in reversed(traceback.extract_stack()):
+        if not frame.filename.startswith(_INTERNAL_PATHS):
+            return f"{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}"
+    return 'unknown'
+
+
+def reply_documents(command_name, reply):
+    """Count the documents a read command returned"""
+    cursor = reply.get('cursor')
+    if isinstance(cursor, dict):
+        return len(cursor.get('firstBatch') or cursor.get('nextBatch') or [])
+    if command_name == 'count':
+        return reply.get('n', 0)
+    if command_name == 'distinct':
+        return len(reply.get('values', []))
+    if command_name == 'findAndModify':
+        return 1 if reply.get('value') else 0
+    return 0
+
+
+class CollectionStats:
+    """Running totals for one (collection, command) pair"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.documents = 0
+        self.bytes = 0
+        self.slow = 0
+
+
+class CommandTimingListener(monitoring.CommandListener):
+    """Record latency and documents returned of every MongoDB command
+
+    Commands slower than MONGO_SLOW_QUERY_MS are logged with their filter
+    shape, reply size and the code that issued them, and kept for the
+    /admin/mongo page. Reply bytes are estimated from every slow reply
+    plus a MONGO_REPLY_SAMPLE_RATE sample of the fast ones.
+    """
+
+    def __init__(self, slow_query_ms=MONGO_SLOW_QUERY_MS):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slow_queries = {}
+
+    def _key(self, event):
+        return (event.connection_id, event.request_id)
+
+    def started(self, event):
+        field = _COLLECTION_FIELDS.get(event.command_name, event.command_name)
+        collection = event.command.get(field)
+        if not isinstance(collection, str):
+            collection = 'none'
+        with self._lock:
+            self._pending[self._key(event)] = (collection, event.command)
+
+    def _finish(self, event, status, reply=None):
+        with self._lock:
+            collection, command = self._pending.pop(self._key(event), ('unknown', None))
+
+        command_name = event.command_name
+        seconds = event.duration_micros / 1e6
+        slow = seconds >= self.slow_query_seconds
+        documents = 0
+        size = 0
+        if reply is not None and command_name in _READ_COMMANDS:
+            documents = reply_documents(command_name, reply)
+            MONGO_DOCUMENTS_RETURNED.inc(documents, collection=collection, command=command_name)
+            # Re-encoding the reply costs as much as decoding it, so fast replies are sampled
+            if slow:
+                size = len(bson.encode(reply))
+                MONGO_REPLY_BYTES.inc(size, collection=collection, command=command_name)
+            elif MONGO_REPLY_SAMPLE_RATE > 0 and random.random() < MONGO_REPLY_SAMPLE_RATE:
+                size = round(len(bson.encode(reply)) / min(MONGO_REPLY_SAMPLE_RATE, 1.0))
+                MONGO_REPLY_BYTES.inc(size, collection=collection, command=command_name)
+
+        # Listeners run on the thread that issued the command
+        profiling.record_call('mongo', seconds)
+        MONGO_COMMAND_DURATION.observe(seconds, collection=collection, command=command_name, status=status)
+
+        with self._lock:
+            stats = self._stats.get((collection, command_name))
+            if stats is None:
+                stats = self._stats[(collection, command_name)] = CollectionStats()
+            stats.count += 1
+            stats.errors += 1 if status != 'ok' else 0
+            stats.total += seconds
+            stats.max = max(stats.max, seconds)
+            stats.documents += documents
+            stats.bytes += size
+            stats.slow += 1 if slow else 0
+
+        if slow:
+            self._record_slow_query(collection, command_name, command, seconds, documents, size)
+
+    def _record_slow_query(self, collection, command_name, command, seconds, documents, size):
+        shape = json.dumps(query_shape(command_filter(command_name, command or {})), sort_keys=True, default=str)
+        caller = find_caller()
+        MONGO_SLOW_QUERIES.inc(collection=collection, command=command_name)
+        logging.warning(
+            f"Slow MongoDB {command_name} on {collection}: {seconds * 1000:.0f}ms, "
+            f"{documents} docs, {size} bytes, filter {shape}, from {caller}"
+        )
+
+        key = (collection, command_name, shape, caller)
+        with self._lock:
+            entry = self._slow_queries.get(key)
+            if entry is None:
+                if len(self._slow_queries) >= MAX_SLOW_QUERY_SHAPES:
+                    return
+                entry = self._slow_queries[key] = {
+                    'collection': collection,
+                    'command': command_name,
+                    'shape': shape,
+                    'caller': caller,
+                    'count': 0,
+                    'total': 0.0,
+                    'max': 0.0,
+                    'documents': 0
+                }
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            entry['documents'] += documents
+            entry['last_seen'] = time.time()
+
+    def succeeded(self, event):
+        self._finish(event, 'ok', event.reply)
+
+    def failed(self, event):
+        self._finish(event, 'error')
+
+    def collection_report(self):
+        """Per-(collection, command) totals, most total time first"""
+        with self._lock:
+            rows = [
+                {
+                    'collection': collection,
+                    'command': command_name,
+                    'count': stats.count,
+                    'errors': stats.errors,
+                    'total': stats.total,
+                    'mean': stats.total / stats.count if stats.count else 0.0,
+                    'max': stats.max,
+                    'documents': stats.documents,
+                    'bytes': stats.bytes,
+                    'slow': stats.slow
+                }
+                for (collection, command_name), stats in self._stats.items()
+            ]
+        rows.sort(key=lambda row: row['total'], reverse=True)
+        return rows
+
+    def slow_query_report(self):
+        """Slow query shapes grouped by caller, most total time first"""
+        with self._lock:
+            rows = [dict(entry) for entry in self._slow_queries.values()]
+        rows.sort(key=lambda row: row['total'], reverse=True)
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow_queries.clear()
+
+
+command_listener = CommandTimingListener()
@@ -0,0 +1,213 @@
+import logging
+import threading
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+import exchange_rates
+
+CENT = Decimal('0.01')
+
+
+class Plan:
+    """A mentorship plan and its list price in USD"""
+
+    def __init__(self, code, name, mentorship_type, price, duration):
+        self.code = code
+        self.name = name
+        self.mentorship_type = mentorship_type
+        self.price = Decimal(price)
+        self.duration = duration
+
+
+# Plans in menu order; the code is the callback suffix (plan_<code>)
+PLANS = {plan.code: plan for plan in [
+    Plan('trial', 'Trial', 'regular', '7.99', 'Monthly'),
+    Plan('momentum', 'Momentum', 'regular', '20.99', '3 Months'),
+    Plan('regular_legacy', 'Legacy', 'regular', '89.99', 'Yearly'),
+    Plan('apprentice', 'Apprentice', 'supreme', '309.99', '3 Months'),
+    Plan('disciple', 'Disciple', 'supreme', '524.99', '6 Months'),
+    Plan('supreme_legacy', 'Legacy', 'supreme', '899.99', 'Lifetime'),
+]}
+
+CURRENCY_SYMBOLS = {'USD': '$', 'GBP': '£', 'EUR': '€', 'IDR': 'Rp', 'PHP': '₱'}
+WHOLE_CURRENCIES = ('IDR', 'PHP')  # Shown without decimals; others are shown as <whole>.99
+
+_discounts = {}
+_fees = {}
+_matrix = None
+_signature = None
+_lock = threading.Lock()
+
+
+class Quote:
+    """Every amount shown for one plan at one discount and payment fee"""
+
+    def __init__(self, plan, discount_percentage=0, fee_percentage=0.0):
+        self.plan = plan
+        self.discount_percentage = discount_percentage
+        self.fee_percentage = fee_percentage
+        self.original = plan.price
+        self.discounted = percent_of(plan.price, 100 - Decimal(str(discount_percentage)))
+        self.discount_amount = self.original - self.discounted
+        self.final = percent_of(self.discounted, 100 + Decimal(str(fee_percentage)))
+        self.fee_amount = self.final - self.discounted
+        self.equivalents = ''  # Filled in from the current exchange rates
+
+
+class PlanMenu:
+    """Price lines (HTML) and plan buttons for one mentorship type at one discount"""
+
+    def __init__(self, text, buttons):
+        self.text = text
+        self.buttons = buttons  # [(label, callback_data), ...]
+
+
+def percent_of(amount, percentage):
+    """Return percentage% of a USD amount, rounded to the cent"""
+    return (amount * percentage / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def usd(amount):
+    """Format a USD amount, e.g. $20.99"""
+    return f"${amount:.2f}"
+
+
+def applicable_discount(discount, is_renewal):
+    """Return the discount if it's active for this kind of purchase, else None"""
+    if not discount or not discount.get('active', False):
+        return None
+    transaction_type = 'renewal' if is_renewal else 'new'
+    if discount.get('transaction_type', 'both') not in ('both', transaction_type):
+        return None
+    return discount
+
+
+def format_equivalents(amount, rates):
+    """Render a USD amount in the other currencies, one Markdown bullet per line"""
+    lines = []
+    for currency, rate in (rates or {}).items():
+        if currency == 'USD':
+            continue  # Already shown
+        equivalent = amount * Decimal(str(rate))
+        symbol = CURRENCY_SYMBOLS.get(currency, '')
+        if currency in WHOLE_CURRENCIES:
+            formatted = f"{symbol}{equivalent.quantize(Decimal(1), rounding=ROUND_HALF_UP):,}"
+        else:
+            formatted = f"{symbol}{equivalent.to_integral_value(rounding=ROUND_DOWN):,}.99"
+        lines.append(f"• *{currency}*: {formatted}\n")
+    return ''.join(lines)
+
+
+def _render_menu(mentorship_type, percentage, name):
+    lines = []
+    buttons = []
+    for plan in PLANS.values():
+        if plan.mentorship_type != mentorship_type:
+            continue
+        if percentage:
+            price = percent_of(plan.price, 100 - Decimal(str(percentage)))
+            lines.append(f"💰 <b>{plan.name}</b> - <s>{usd(plan.price)}</s> {usd(price)} / {plan.duration}")
+        else:
+            price = plan.price
+            lines.append(f"💰 <b>{plan.name}</b> - {usd(price)} / {plan.duration}")
+        buttons.append((f"{plan.name} ({usd(price)}) / {plan.duration}", f"plan_{plan.code}"))
+    text = '\n'.join(lines)
+    if percentage:
+        text = f"🎉 <b>{name}: {percentage}% OFF!</b>\n\n{text}"
+    return PlanMenu(text, buttons)
+
+
+def _current_signature(rates):
+    discounts = tuple(
+        (mentorship_type, discount.get('percentage', 0), discount.get('name', ''))
+        for mentorship_type, discount in sorted(_discounts.items())
+        if discount and discount.get('active', False)
+    )
+    return discounts, tuple(sorted(_fees.items())), tuple(sorted((rates or {}).items()))
+
+
+def build_matrix(rates):
+    """Price every plan at every active discount and payment fee, with its currency equivalents"""
+    discount_options = {'regular': {(0, '')}, 'supreme': {(0, '')}}
+    for mentorship_type, discount in _discounts.items():
+        if discount and discount.get('active', False):
+            discount_options.setdefault(mentorship_type, {(0, '')}).add(
+                (discount.get('percentage', 0), discount.get('name', ''))
+            )
+    fee_options = {0.0, *_fees.values()}
+
+    menus = {}
+    quotes = {}
+    equivalents = {}
+    for mentorship_type, options in discount_options.items():
+        for percentage, name in options:
+            menus[(mentorship_type, percentage, name)] = _render_menu(mentorship_type, percentage, name)
+    for plan in PLANS.values():
+        for percentage, _ in discount_options.get(plan.mentorship_type, ()):
+            for fee in fee_options:
+                quote = Quote(plan, percentage, fee)
+                if quote.final not in equivalents:
+                    equivalents[quote.final] = format_equivalents(quote.final, rates)
+                quote.equivalents = equivalents[quote.final]
+                quotes[(plan.code, percentage, fee)] = quote
+    return {'menus': menus, 'quotes': quotes, 'equivalents': equivalents, 'rates': rates}
+
+
+def matrix():
+    """Return the price matrix, rebuilding it if discounts, fees or exchange rates changed"""
+    global _matrix, _signature
+    rates = exchange_rates.get_exchange_rates()
+    signature = _current_signature(rates)
+    with _lock:
+        if signature != _signature:
+            _matrix = build_matrix(rates)
+            _signature = signature
+            logging.info(f"Rebuilt price matrix: {len(_matrix['quotes'])} quotes, {len(_matrix['menus'])} menus")
+        return _matrix
+
+
+def plan_menu(mentorship_type, discount=None):
+    """Return the plan menu for a mentorship type, at the given applicable discount if any"""
+    percentage = discount.get('percentage', 0) if discount else 0
+    name = discount.get('name', '') if discount else ''
+    key = (mentorship_type, percentage, '' if not percentage else name)
+    menu = matrix()['menus'].get(key)
+    if menu is None:
+        menu = _render_menu(mentorship_type, percentage, name)
+    return menu
+
+
+def quote(plan_code, discount_percentage=0, fee_percentage=0.0):
+    """Return the quote for a plan at a discount and payment fee"""
+    current = matrix()
+    found = current['quotes'].get((plan_code, discount_percentage or 0, fee_percentage or 0.0))
+    if found is None:
+        # e.g. a discount that ended after the user picked their plan
+        found = Quote(PLANS[plan_code], discount_percentage or 0, fee_percentage or 0.0)
+        found.equivalents = format_equivalents(found.final, current['rates'])
+    return found
+
+
+def equivalents(amount):
+    """Return the currency equivalent lines for a USD amount"""
+    amount = Decimal(str(amount)).quantize(CENT, rounding=ROUND_HALF_UP)
+    current = matrix()
+    found = current['equivalents'].get(amount)
+    if found is None:
+        found = format_equivalents(amount, current['rates'])
+    return found
+
+
+def find_plan(mentorship_type, name):
+    """Look up a plan by mentorship type and display name, or None"""
+    for plan in PLANS.values():
+        if plan.mentorship_type == mentorship_type and plan.name == name:
+            return plan
+    return None
+
+
+def install(discounts, fees):
+    """Point the engine at the live discount settings and payment fees"""
+    global _discounts, _fees, _signature
+    _discounts = discounts
+    _fees = fees
+    with _lock:
+        _signature = None
@@ -0,0 +1,223 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+
+# Opt-in: set PROFILE_HANDLERS=1 to profile every bot handler
+PROFILE_HANDLERS = os.getenv('PROFILE_HANDLERS', '').lower() in ('1', 'true', 'yes')
+PROFILE_SLOW_THRESHOLD = float(os.getenv('PROFILE_SLOW_THRESHOLD', '2.0'))  # Seconds before a call counts as slow
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0.05'))  # Share of calls run under cProfile
+PROFILE_HISTORY = 1000  # Recent durations kept per handler for percentiles
+PROFILE_SLOW_SAMPLES = 50  # Slow call samples kept for the report
+
+_local = threading.local()
+_stats = {}
+_stats_lock = threading.Lock()
+_active = {}
+_active_lock = threading.Lock()
+_slow_samples = deque(maxlen=PROFILE_SLOW_SAMPLES)
+# Only one cProfile session can be active in the interpreter at a time
+_profiler_lock = threading.Lock()
+_watchdog_started = False
+
+
+class HandlerStats:
+    """Aggregated timings for one handler"""
+
+    def __init__(self, handler, update_type):
+        self.handler = handler
+        self.update_type = update_type
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.durations = deque(maxlen=PROFILE_HISTORY)
+        self.calls = {}
+
+    def add(self, elapsed, failed, calls):
+        self.count += 1
+        self.errors += 1 if failed else 0
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.durations.append(elapsed)
+        for kind, (count, seconds) in calls.items():
+            totals = self.calls.setdefault(kind, [0, 0.0])
+            totals[0] += count
+            totals[1] += seconds
+
+    def percentile(self, fraction):
+        if not self.durations:
+            return 0.0
+        ordered = sorted(self.durations)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        summary = {
+            'handler': self.handler,
+            'update_type': self.update_type,
+            'count': self.count,
+            'errors': self.errors,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'max': self.max,
+            'calls': {}
+        }
+        for kind, (count, seconds) in self.calls.items():
+            summary['calls'][kind] = {
+                'per_call': count / self.count if self.count else 0.0,
+                'seconds': seconds
+            }
+        return summary
+
+
+class ActiveCall:
+    """A handler invocation in progress"""
+
+    def __init__(self, handler, update_type):
+        self.handler = handler
+        self.update_type = update_type
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.calls = {}
+        self.profiler = None
+        self.stack = None
+
+
+def record_call(kind, seconds):
+    """Attribute an outbound call to the handler running on this thread"""
+    calls = getattr(_local, 'calls', None)
+    if calls is not None:
+        totals = calls.setdefault(kind, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+
+@contextmanager
+def external_call(kind):
+    """Time an outbound call; calls nested inside another one aren't counted twice"""
+    outer = getattr(_local, 'external', None)
+    _local.external = kind
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.external = outer
+        if outer is None:
+            record_call(kind, time.perf_counter() - start)
+
+
+def begin(handler, update_type):
+    """Start profiling a handler call on the current thread"""
+    call = ActiveCall(handler, update_type)
+    _local.calls = call.calls
+    with _active_lock:
+        _active[call.thread_id] = call
+
+    if random.random() < PROFILE_SAMPLE_RATE and _profiler_lock.acquire(blocking=False):
+        try:
+            call.profiler = cProfile.Profile()
+            call.profiler.enable()
+        except Exception:
+            # Another profiler (e.g. a debugger) is already active
+            call.profiler = None
+            _profiler_lock.release()
+    return call
+
+
+def end(call, elapsed, failed=False):
+    """Finish profiling a handler call and fold it into the stats"""
+    profile_text = None
+    if call.profiler is not None:
+        call.profiler.disable()
+        _profiler_lock.release()
+        if elapsed >= PROFILE_SLOW_THRESHOLD:
+            stream = io.StringIO()
+            pstats.Stats(call.profiler, stream=stream).sort_stats('cumulative').print_stats(25)
+            profile_text = stream.getvalue()
+
+    _local.calls = None
+    with _active_lock:
+        _active.pop(call.thread_id, None)
+
+    key = (call.handler, call.update_type)
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = _stats[key] = HandlerStats(call.handler, call.update_type)
+        stats.add(elapsed, failed, call.calls)
+
+    if elapsed >= PROFILE_SLOW_THRESHOLD:
+        _slow_samples.append({
+            'handler': call.handler,
+            'update_type': call.update_type,
+            'timestamp': time.time(),
+            'elapsed': elapsed,
+            'failed': failed,
+            'calls': {kind: {'count': count, 'seconds': seconds} for kind, (count, seconds) in call.calls.items()},
+            'profile': profile_text,
+            'stack': call.stack
+        })
+
+
+def _watchdog():
+    """Snapshot the stack of any handler that has been running past the slow threshold"""
+    interval = max(PROFILE_SLOW_THRESHOLD / 2, 0.1)
+    while True:
+        time.sleep(interval)
+        try:
+            now = time.perf_counter()
+            with _active_lock:
+                overdue = [
+                    call for call in _active.values()
+                    if call.stack is None and call.profiler is None and now - call.started >= PROFILE_SLOW_THRESHOLD
+                ]
+            if not overdue:
+                continue
+            frames = sys._current_frames()
+            for call in overdue:
+                frame = frames.get(call.thread_id)
+                if frame is not None:
+                    call.stack = ''.join(traceback.format_stack(frame))
+        except Exception as e:
+            logging.error(f"Handler profiling watchdog error: {e}")
+
+
+def start_watchdog():
+    """Start the slow-handler stack sampler (once)"""
+    global _watchdog_started
+    if _watchdog_started:
+        return
+    _watchdog_started = True
+    threading.Thread(target=_watchdog, name='handler-profiler', daemon=True).start()
+
+
+def report(sort='p95'):
+    """Return per-handler summaries, slowest first by the given key"""
+    with _stats_lock:
+        summaries = [stats.summary() for stats in _stats.values()]
+    if sort not in ('p95', 'total', 'mean', 'max', 'count', 'errors'):
+        raise ValueError(f"Unknown sort key: {sort}")
+    summaries.sort(key=lambda summary: summary[sort], reverse=True)
+    return summaries
+
+
+def slow_samples():
+    """Return the most recent slow calls, newest first"""
+    return list(reversed(_slow_samples))
+
+
+def reset():
+    """Clear all collected stats and samples"""
+    with _stats_lock:
+        _stats.clear()
+    _slow_samples.clear()
@@ -0,0 +1,209 @@
+import bisect
+import logging
+import os
+import threading
+import time
+import heartbeat
+import metrics
+
+RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', '20'))  # Members checked per run
+RECONCILE_INTERVAL = int(os.getenv('RECONCILE_INTERVAL', '60'))  # Seconds between runs
+RECONCILE_REQUEST_INTERVAL = 0.5  # Seconds between get_chat_member calls
+RECONCILE_CACHE_TTL = int(os.getenv('RECONCILE_CACHE_TTL', str(6 * 3600)))  # Seconds a membership check is reused
+RECONCILE_AUTO_KICK = os.getenv('RECONCILE_AUTO_KICK', 'false').lower() == 'true'
+RECONCILE_KICK_BATCH = 5  # Most members removed per run when auto-kick is on
+SETTINGS_ID = 'member_reconcile'
+JOB_NAME = 'member_reconcile'
+
+PRESENT_STATUSES = ('creator', 'administrator', 'member', 'restricted')
+STAFF_STATUSES = ('creator', 'administrator')
+
+DIFF_SIZE = metrics.gauge('ptabot_reconcile_diff_members', 'Members whose group presence disagrees with their membership', ('kind',))
+CHECKS = metrics.counter('ptabot_reconcile_checks_total', 'Group membership lookups by the reconciliation job', ('source',))
+
+_bot = None
+_members = None
+_access = None
+_groups = {}
+_collection = None
+_cache = {}  # (user_id, chat_id) -> (status, checked_at)
+_cursor = None
+_passes = 0
+_user_ids = []  # Sorted member ids, rebuilt only when the member store's keys change
+_user_ids_version = None
+_expired_present = {}  # (user_id, chat_id) -> status
+_paid_absent = {}  # (user_id, chat_id) -> status
+_lock = threading.Lock()
+
+
+def _status(user_id, chat_id, now):
+    """Return the user's status in a group, from the cache while it is fresh"""
+    cached = _cache.get((user_id, chat_id))
+    if cached and now - cached[1] < RECONCILE_CACHE_TTL:
+        CHECKS.inc(source='cache')
+        return cached[0]
+    try:
+        member = _bot.get_chat_member(chat_id, user_id)
+        status = member.status
+        if status == 'restricted' and not getattr(member, 'is_member', True):
+            status = 'left'
+    except Exception as e:
+        if 'user not found' not in str(e).lower() and 'participant_id_invalid' not in str(e).lower():
+            raise
+        status = 'left'
+    CHECKS.inc(source='api')
+    _cache[(user_id, chat_id)] = (status, now)
+    time.sleep(RECONCILE_REQUEST_INTERVAL)
+    return status
+
+
+def forget(user_id):
+    """Drop cached checks for a user, e.g. after they were kicked or joined"""
+    for chat_id in _groups:
+        _cache.pop((int(user_id), chat_id), None)
+
+
+def _sorted_user_ids():
+    global _user_ids, _user_ids_version
+    version = getattr(_members, 'keys_version', None)
+    if version is None or version != _user_ids_version:
+        _user_ids = sorted(int(user_id) for user_id in _members.keys() if str(user_id).lstrip('-').isdigit())
+        _user_ids_version = version
+    return _user_ids
+
+
+def _next_batch():
+    """Return the next batch of member ids after the cursor, wrapping around at the end"""
+    global _cursor, _passes
+    user_ids = _sorted_user_ids()
+    start = 0 if _cursor is None else bisect.bisect_right(user_ids, _cursor)
+    batch = user_ids[start:start + RECONCILE_BATCH_SIZE]
+    if not batch:
+        _passes += 1
+        _cursor = None
+        batch = user_ids[:RECONCILE_BATCH_SIZE]
+        # Drop diff entries of users who no longer have a member record, once per pass
+        known = set(user_ids)
+        with _lock:
+            for diff in (_expired_present, _paid_absent):
+                for key in [key for key in diff if key[0] not in known]:
+                    del diff[key]
+    if batch:
+        _cursor = batch[-1]
+    return batch
+
+
+def check_user(user_id, now=None):
+    """Compare one member's presence in each group with their membership"""
+    now = now or time.time()
+    for chat_id, tier in _groups.items():
+        allowed, _ = _access(user_id, chat_id)
+        data = _members.get(str(user_id)) or {}
+        home_group = data.get('mentorship_type', 'regular').lower() == tier
+        status = _status(user_id, chat_id, now)
+        present = status in PRESENT_STATUSES
+        key = (user_id, chat_id)
+        with _lock:
+            _expired_present.pop(key, None)
+            _paid_absent.pop(key, None)
+            if present and not allowed and status not in STAFF_STATUSES:
+                _expired_present[key] = status
+            elif allowed and home_group and not present:
+                _paid_absent[key] = status
+
+
+def _kick_expired():
+    with _lock:
+        targets = list(_expired_present)[:RECONCILE_KICK_BATCH]
+    for user_id, chat_id in targets:
+        allowed, reason = _access(user_id, chat_id)
+        if allowed:
+            continue
+        try:
+            _bot.ban_chat_member(chat_id, user_id)
+            _bot.unban_chat_member(chat_id, user_id)  # Immediately unban so they can rejoin later
+            logging.info(f"Reconciliation removed user {user_id} from group {chat_id}: {reason}")
+            with _lock:
+                _expired_present.pop((user_id, chat_id), None)
+            _cache[(user_id, chat_id)] = ('left', time.time())
+        except Exception as e:
+            logging.error(f"Reconciliation failed to remove user {user_id} from group {chat_id}: {e}")
+
+
+def _save():
+    if _collection is None:
+        return
+    with _lock:
+        doc = {
+            '_id': SETTINGS_ID,
+            'cursor': _cursor,
+            'passes': _passes,
+            'expired_present': [[user_id, chat_id, status] for (user_id, chat_id), status in _expired_present.items()],
+            'paid_absent': [[user_id, chat_id, status] for (user_id, chat_id), status in _paid_absent.items()],
+            'updated_at': time.time()
+        }
+    _collection.replace_one({'_id': SETTINGS_ID}, doc, upsert=True)
+
+
+def run_batch():
+    """Check the next batch of members; the cost is bounded by RECONCILE_BATCH_SIZE"""
+    now = time.time()
+    batch = _next_batch()
+    for user_id in batch:
+        try:
+            check_user(user_id, now)
+        except Exception as e:
+            logging.error(f"Error reconciling group membership of user {user_id}: {e}")
+    if RECONCILE_AUTO_KICK:
+        _kick_expired()
+    _save()
+    return len(batch)
+
+
+def report():
+    """Return the current diff: members in groups they shouldn't be in, and paid members missing from theirs"""
+    with _lock:
+        return {
+            'expired_present': sorted(_expired_present.items()),
+            'paid_absent': sorted(_paid_absent.items()),
+            'cursor': _cursor,
+            'passes': _passes
+        }
+
+
+def _worker():
+    logging.info(f"Membership reconciliation started for {len(_groups)} groups")
+    while True:
+        try:
+            heartbeat.beat(JOB_NAME)
+            run_batch()
+            heartbeat.success(JOB_NAME)
+        except Exception as e:
+            logging.error(f"Error in membership reconciliation: {e}")
+            heartbeat.failure(JOB_NAME, e)
+        heartbeat.sleep(JOB_NAME, RECONCILE_INTERVAL)
+
+
+def start(bot, members, access, groups, collection=None):
+    """Start reconciling group presence with memberships in the background
+
+    members is the member store keyed by user id, access(user_id, chat_id)
+    returns (allowed, reason), and groups maps each group id to the
+    mentorship type whose members belong there.
+    """
+    global _bot, _members, _access, _groups, _collection, _cursor, _passes
+    _bot, _members, _access, _groups, _collection = bot, members, access, dict(groups), collection
+    if collection is not None:
+        try:
+            doc = collection.find_one({'_id': SETTINGS_ID})
+            if doc:
+                _cursor = doc.get('cursor')
+                _passes = doc.get('passes', 0)
+                _expired_present.update({(user_id, chat_id): status for user_id, chat_id, status in doc.get('expired_present', [])})
+                _paid_absent.update({(user_id, chat_id): status for user_id, chat_id, status in doc.get('paid_absent', [])})
+                logging.info(f"Resuming membership reconciliation after user {_cursor}")
+        except Exception as e:
+            logging.error(f"Error loading membership reconciliation state: {e}")
+    DIFF_SIZE.set_function(lambda: len(_expired_present), kind='expired_present')
+    DIFF_SIZE.set_function(lambda: len(_paid_absent), kind='paid_absent')
+    threading.Thread(target=_worker, name='member-reconcile', daemon=True).start()
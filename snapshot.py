@@ -0,0 +1,82 @@
+import logging
+import os
+import pickle
+import struct
+import tempfile
+import time
+import zlib
+
+# Snapshot file layout:
+#   magic (4 bytes) | format version (uint16) | written_at (float64)
+#   | payload length (uint64) | payload crc32 (uint32) | zlib(pickle(state))
+SNAPSHOT_MAGIC = b'PTAS'
+SNAPSHOT_VERSION = 1
+_HEADER = struct.Struct('<4sHdQI')
+
+
+def write_snapshot(path, state):
+    """Atomically write the in-memory state to a compact binary snapshot file"""
+    try:
+        start_time = time.time()
+        payload = zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 6)
+        header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, time.time(), len(payload), zlib.crc32(payload))
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            # Rename is atomic, so readers only ever see a complete snapshot
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        elapsed = time.time() - start_time
+        logging.info(f"Wrote state snapshot ({_HEADER.size + len(payload)} bytes) to {path} in {elapsed:.2f}s")
+        return True
+    except Exception as e:
+        logging.error(f"Error writing state snapshot to {path}: {e}")
+        return False
+
+
+def load_snapshot(path, max_age=None):
+    """Read a snapshot file and return its state, or None if missing, stale or corrupt"""
+    if not os.path.exists(path):
+        logging.info(f"No state snapshot found at {path}")
+        return None
+
+    try:
+        start_time = time.time()
+        # The whole state is unpickled at boot, so a single read is all it takes
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < _HEADER.size:
+            logging.warning(f"State snapshot {path} is truncated, ignoring it")
+            return None
+
+        magic, version, written_at, length, checksum = _HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            logging.warning(f"State snapshot {path} has an unknown format, ignoring it")
+            return None
+
+        age = time.time() - written_at
+        if max_age is not None and age > max_age:
+            logging.warning(f"State snapshot {path} is {age / 3600:.1f}h old, ignoring it")
+            return None
+
+        payload = memoryview(data)[_HEADER.size:_HEADER.size + length]
+        if len(payload) != length or zlib.crc32(payload) != checksum:
+            logging.warning(f"State snapshot {path} failed its checksum, ignoring it")
+            return None
+        state = pickle.loads(zlib.decompress(payload))
+
+        elapsed = time.time() - start_time
+        logging.info(f"Loaded state snapshot from {path} ({age:.0f}s old) in {elapsed:.2f}s")
+        return state
+    except Exception as e:
+        logging.error(f"Error loading state snapshot from {path}: {e}")
+        return None
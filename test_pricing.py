@@ -0,0 +1,147 @@
+import unittest
+from decimal import Decimal
+from unittest import mock
+import pricing
+
+RATES = {'USD': 1, 'EUR': 0.9, 'IDR': 16000.5, 'PHP': 56.1}
+SPRING_SALE = {'active': True, 'percentage': 20, 'name': 'Spring Sale', 'transaction_type': 'both'}
+PAYPAL = '💳 Paypal'
+
+
+class PricingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.discounts = {}
+        self.fees = {PAYPAL: 10.0}
+        self.rates = dict(RATES)
+        pricing.install(self.discounts, self.fees)
+        patcher = mock.patch('exchange_rates.get_exchange_rates', side_effect=lambda: self.rates)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestPercentOf(unittest.TestCase):
+
+    def test_rounds_half_up_to_the_cent(self):
+        self.assertEqual(pricing.percent_of(Decimal('0.05'), 50), Decimal('0.03'))
+        self.assertEqual(pricing.percent_of(Decimal('20.99'), 110), Decimal('23.09'))
+        self.assertEqual(pricing.percent_of(Decimal('7.99'), 80), Decimal('6.39'))
+
+    def test_whole_percentage_keeps_amount(self):
+        self.assertEqual(pricing.percent_of(Decimal('899.99'), 100), Decimal('899.99'))
+
+
+class TestQuote(unittest.TestCase):
+
+    def test_no_discount_no_fee(self):
+        quote = pricing.Quote(pricing.PLANS['momentum'])
+        self.assertEqual(quote.final, Decimal('20.99'))
+        self.assertEqual(quote.discount_amount, Decimal('0'))
+        self.assertEqual(quote.fee_amount, Decimal('0'))
+
+    def test_fee_only(self):
+        quote = pricing.Quote(pricing.PLANS['momentum'], fee_percentage=10.0)
+        self.assertEqual(quote.discounted, Decimal('20.99'))
+        self.assertEqual(quote.final, Decimal('23.09'))
+        self.assertEqual(quote.fee_amount, Decimal('2.10'))
+
+    def test_discount_with_paypal_fee(self):
+        # The fee is charged on the discounted price, each step rounded to the cent
+        quote = pricing.Quote(pricing.PLANS['momentum'], 20, 10.0)
+        self.assertEqual(quote.original, Decimal('20.99'))
+        self.assertEqual(quote.discounted, Decimal('16.79'))
+        self.assertEqual(quote.discount_amount, Decimal('4.20'))
+        self.assertEqual(quote.final, Decimal('18.47'))
+        self.assertEqual(quote.fee_amount, Decimal('1.68'))
+
+
+class TestFormatEquivalents(unittest.TestCase):
+
+    def test_formats_each_currency(self):
+        text = pricing.format_equivalents(Decimal('20.99'), RATES)
+        self.assertEqual(text, "• *EUR*: €18.99\n• *IDR*: Rp335,850\n• *PHP*: ₱1,178\n")
+
+    def test_no_rates(self):
+        self.assertEqual(pricing.format_equivalents(Decimal('20.99'), None), '')
+        self.assertEqual(pricing.format_equivalents(Decimal('20.99'), {'USD': 1}), '')
+
+
+class TestPlanMenu(PricingTestCase):
+
+    def test_without_discount(self):
+        menu = pricing.plan_menu('regular')
+        self.assertEqual(menu.text.splitlines()[0], "💰 <b>Trial</b> - $7.99 / Monthly")
+        self.assertEqual(menu.buttons, [
+            ("Trial ($7.99) / Monthly", 'plan_trial'),
+            ("Momentum ($20.99) / 3 Months", 'plan_momentum'),
+            ("Legacy ($89.99) / Yearly", 'plan_regular_legacy'),
+        ])
+
+    def test_with_discount(self):
+        self.discounts['regular'] = SPRING_SALE
+        menu = pricing.plan_menu('regular', pricing.applicable_discount(SPRING_SALE, is_renewal=False))
+        self.assertTrue(menu.text.startswith("🎉 <b>Spring Sale: 20% OFF!</b>\n\n"))
+        self.assertIn("💰 <b>Trial</b> - <s>$7.99</s> $6.39 / Monthly", menu.text)
+        self.assertEqual(menu.buttons[0], ("Trial ($6.39) / Monthly", 'plan_trial'))
+
+    def test_discount_for_other_transaction_type_is_ignored(self):
+        renewals_only = {**SPRING_SALE, 'transaction_type': 'renewal'}
+        self.assertIsNone(pricing.applicable_discount(renewals_only, is_renewal=False))
+        self.assertEqual(pricing.applicable_discount(renewals_only, is_renewal=True), renewals_only)
+
+
+class TestMatrix(PricingTestCase):
+
+    def test_quote_comes_from_matrix(self):
+        self.discounts['regular'] = SPRING_SALE
+        quote = pricing.quote('momentum', 20, 10.0)
+        self.assertIs(quote, pricing.matrix()['quotes'][('momentum', 20, 10.0)])
+        self.assertEqual(quote.final, Decimal('18.47'))
+        self.assertEqual(quote.equivalents, pricing.format_equivalents(Decimal('18.47'), RATES))
+
+    def test_rebuilt_only_when_signature_changes(self):
+        with mock.patch.object(pricing, 'build_matrix', wraps=pricing.build_matrix) as build:
+            pricing.matrix()
+            pricing.matrix()
+            self.assertEqual(build.call_count, 1)
+
+            self.discounts['supreme'] = SPRING_SALE
+            pricing.matrix()
+            self.assertEqual(build.call_count, 2)
+
+            self.fees[PAYPAL] = 12.0
+            pricing.matrix()
+            self.assertEqual(build.call_count, 3)
+
+            self.rates = {**RATES, 'EUR': 0.95}
+            self.assertEqual(pricing.matrix()['rates'], self.rates)
+            self.assertEqual(build.call_count, 4)
+
+            pricing.matrix()
+            self.assertEqual(build.call_count, 4)
+
+    def test_rebuild_drops_ended_discount(self):
+        self.discounts['regular'] = SPRING_SALE
+        self.assertIn(('regular', 20, 'Spring Sale'), pricing.matrix()['menus'])
+        self.discounts['regular'] = {**SPRING_SALE, 'active': False}
+        self.assertNotIn(('regular', 20, 'Spring Sale'), pricing.matrix()['menus'])
+
+    def test_quote_after_discount_ended(self):
+        # The user picked a plan during the sale; the sale ended before they paid
+        self.discounts['regular'] = SPRING_SALE
+        picked = pricing.quote('momentum', 20)
+        del self.discounts['regular']
+        self.assertNotIn(('momentum', 20, 10.0), pricing.matrix()['quotes'])
+
+        quote = pricing.quote('momentum', 20, 10.0)
+        self.assertEqual(quote.discounted, picked.discounted)
+        self.assertEqual(quote.final, Decimal('18.47'))
+        self.assertEqual(quote.equivalents, pricing.format_equivalents(Decimal('18.47'), RATES))
+
+    def test_equivalents_for_amount(self):
+        self.assertEqual(pricing.equivalents(20.99), pricing.format_equivalents(Decimal('20.99'), RATES))
+        self.assertEqual(pricing.equivalents('18.465'), pricing.format_equivalents(Decimal('18.47'), RATES))
+
+
+if __name__ == '__main__':
+    unittest.main()
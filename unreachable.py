@@ -0,0 +1,230 @@
+import functools
+import logging
+import os
+import threading
+import time
+from telebot import apihelper
+import metrics
+
+UNREACHABLE_REPROBE_AFTER = int(os.getenv('UNREACHABLE_REPROBE_AFTER', str(7 * 24 * 3600)))  # Seconds before a skipped user gets one more attempt
+
+# 403 descriptions that mean the user can't receive anything from the bot until they come back
+UNREACHABLE_REASONS = {
+    'bot was blocked by the user': 'blocked',
+    'user is deactivated': 'deactivated',
+}
+# Bot API methods that deliver something to a chat, keyed on their chat_id parameter
+SEND_METHODS = (
+    'sendMessage', 'sendPhoto', 'sendDocument', 'sendVideo', 'sendAnimation', 'sendAudio',
+    'sendVoice', 'sendVideoNote', 'sendSticker', 'sendMediaGroup', 'sendPoll', 'sendChatAction',
+    'forwardMessage', 'copyMessage', 'sendLocation', 'sendContact'
+)
+# Update fields whose from_user is someone interacting with the bot
+INTERACTION_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'pre_checkout_query', 'shipping_query', 'poll_answer', 'chat_join_request'
+)
+
+UNREACHABLE_USERS = metrics.gauge('ptabot_unreachable_users', 'Users skipped by bulk sends because they blocked the bot or were deactivated', ('reason',))
+SKIPPED_SENDS = metrics.counter('ptabot_unreachable_skipped_total', 'Bulk sends skipped for unreachable users', ('job',))
+
+
+class UnreachableUser(apihelper.ApiException):
+    """Raised in place of a send to an unreachable user, so the caller's send-failure path still runs"""
+
+    def __init__(self, user_id, reason):
+        super().__init__(f"User {user_id} is unreachable ({reason}), send skipped", 'send_message', None)
+        self.user_id = user_id
+        self.reason = reason
+
+
+_users = {}  # user_id -> {'reason', 'since', 'last_failure', 'probe_at'}
+_lock = threading.Lock()
+_collection = None
+_original_make_request = None
+
+
+def unreachable_reason(error):
+    """Return 'blocked' or 'deactivated' if a Bot API error means the user can't be reached, else None"""
+    if not isinstance(error, apihelper.ApiTelegramException) or error.error_code != 403:
+        return None
+    description = str(error.description or '').lower()
+    for text, reason in UNREACHABLE_REASONS.items():
+        if text in description:
+            return reason
+    return None
+
+
+def _save(user_id, entry):
+    if _collection is None:
+        return
+    try:
+        if entry is None:
+            _collection.delete_one({'_id': user_id})
+        else:
+            _collection.replace_one({'_id': user_id}, {'_id': user_id, **entry}, upsert=True)
+    except Exception as e:
+        logging.error(f"Error saving unreachable state of user {user_id}: {e}")
+
+
+def record(user_id, reason, now=None):
+    """Remember that a user can't be reached; bulk sends skip them until the next probe"""
+    user_id = int(user_id)
+    now = now or time.time()
+    with _lock:
+        entry = _users.get(user_id)
+        if entry is None:
+            entry = {'reason': reason, 'since': now}
+            logging.info(f"User {user_id} is unreachable ({reason}), skipping them in bulk sends")
+        entry = {**entry, 'reason': reason, 'last_failure': now, 'probe_at': now + UNREACHABLE_REPROBE_AFTER}
+        _users[user_id] = entry
+    _save(user_id, entry)
+
+
+def clear(user_id):
+    """Forget a user's unreachable state, e.g. once they message the bot again"""
+    user_id = int(user_id)
+    with _lock:
+        entry = _users.pop(user_id, None)
+    if entry is not None:
+        logging.info(f"User {user_id} is reachable again, resuming bulk sends")
+        _save(user_id, None)
+    return entry is not None
+
+
+def is_unreachable(user_id):
+    """Whether a user is currently recorded as unreachable"""
+    try:
+        return int(user_id) in _users
+    except (TypeError, ValueError):
+        return False
+
+
+def should_skip(user_id, job=None, now=None):
+    """Whether a bulk send should leave this user out
+
+    Once UNREACHABLE_REPROBE_AFTER has passed since the last failure, one
+    send is let through as a probe: if it fails again the user is recorded
+    again, and if it succeeds they are cleared.
+    """
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return False
+    if user_id not in _users:
+        return False
+    now = now or time.time()
+    with _lock:
+        entry = _users.get(user_id)
+        if entry is None:
+            return False
+        if now >= entry.get('probe_at', 0):
+            # Push the next probe out so only this one send goes through
+            _users[user_id] = {**entry, 'probe_at': now + UNREACHABLE_REPROBE_AFTER}
+            return False
+    if job:
+        SKIPPED_SENDS.inc(job=job)
+    return True
+
+
+def ensure_reachable(user_id, job=None):
+    """Raise UnreachableUser instead of letting a bulk send go to a user it should skip"""
+    if should_skip(user_id, job):
+        raise UnreachableUser(user_id, _users.get(int(user_id), {}).get('reason', 'unknown'))
+
+
+def status():
+    """Return the unreachable users with their reason and timestamps"""
+    with _lock:
+        return {user_id: dict(entry) for user_id, entry in _users.items()}
+
+
+def _count(reason):
+    with _lock:
+        return sum(1 for entry in _users.values() if entry.get('reason') == reason)
+
+
+def _private_chat_id(params):
+    chat_id = (params or {}).get('chat_id')
+    try:
+        chat_id = int(chat_id)
+    except (TypeError, ValueError):
+        return None
+    return chat_id if chat_id > 0 else None  # Groups and channels have negative ids
+
+
+def _observe_send_layer():
+    """Record unreachable users from failed sends, and clear them when a send gets through"""
+    global _original_make_request
+    if _original_make_request is not None:
+        return
+    _original_make_request = apihelper._make_request
+
+    @functools.wraps(_original_make_request)
+    def observed_make_request(token, method_name, method='get', params=None, files=None):
+        if method_name not in SEND_METHODS:
+            return _original_make_request(token, method_name, method=method, params=params, files=files)
+        try:
+            result = _original_make_request(token, method_name, method=method, params=params, files=files)
+        except Exception as e:
+            reason = unreachable_reason(e)
+            chat_id = _private_chat_id(params) if reason else None
+            if chat_id is not None:
+                record(chat_id, reason)
+            raise
+        if _users:
+            chat_id = _private_chat_id(params)
+            if chat_id is not None and chat_id in _users:
+                clear(chat_id)
+        return result
+
+    apihelper._make_request = observed_make_request
+
+
+def _observe_updates(bot):
+    """Clear users as soon as an update shows they are talking to the bot again"""
+    original_process_new_updates = bot.process_new_updates
+
+    @functools.wraps(original_process_new_updates)
+    def process_new_updates(updates):
+        for update in updates:
+            member_update = getattr(update, 'my_chat_member', None)
+            if member_update is not None and member_update.chat.type == 'private':
+                # Blocking or unblocking the bot in a private chat
+                if member_update.new_chat_member.status == 'kicked':
+                    record(member_update.from_user.id, 'blocked')
+                elif _users:
+                    clear(member_update.from_user.id)
+                continue
+            if not _users:
+                continue
+            for field in INTERACTION_FIELDS:
+                item = getattr(update, field, None)
+                from_user = getattr(item, 'from_user', None) or getattr(item, 'user', None)
+                if from_user is not None and from_user.id in _users:
+                    clear(from_user.id)
+        return original_process_new_updates(updates)
+
+    bot.process_new_updates = process_new_updates
+
+
+def install(bot, collection=None):
+    """Load the registry and start recording send outcomes and interactions
+
+    Call after instrumentation.instrument_telegram_api() so failed sends
+    are still timed by method and status.
+    """
+    global _collection
+    _collection = collection
+    if collection is not None:
+        try:
+            for doc in collection.find():
+                _users[int(doc['_id'])] = {key: value for key, value in doc.items() if key != '_id'}
+            if _users:
+                logging.info(f"Loaded {len(_users)} unreachable users")
+        except Exception as e:
+            logging.error(f"Error loading unreachable users: {e}")
+    for reason in set(UNREACHABLE_REASONS.values()):
+        UNREACHABLE_USERS.set_function(functools.partial(_count, reason), reason=reason)
+    _observe_send_layer()
+    _observe_updates(bot)